@@ -4,7 +4,10 @@ import streamlit as st
 from utils.ratings_helper import RatingsHelper
 from utils.user_helper import UserHelper
 from dataframe_manager.manage_dataframe import DataFrameManager
-from model_trainer.cmf_trainer import CMFTrainer
+from model_trainer.training_job import TrainingJob
+from model_trainer.topn_batch import TopNBatch
+from recommenders.model_registry import get_model_registry, get_cmf_recommender, get_topn_table
+from recommenders.result_cache import get_result_cache
 from logging_custom.logger import Logger
 
 load_dotenv()
@@ -27,7 +30,7 @@ def login(userId, password):
         logger.error("Users data environment variable not set or path does not exist.")
         return False
     df_mgr = DataFrameManager(str(user_path))
-    df = df_mgr.load_dataframe()
+    df = df_mgr.load_dataframe(columns=['userId'])
     user = df[df['userId'] == userId]
     if not user.empty:
         logger.info(f"User {userId} found in database.")
@@ -56,25 +59,54 @@ with col2:
         update_model = st.button("Update Model", key="update_model", help="Update recommender models. *Please update ratings first*")
     with cols[0]:
         update_ratings = st.button("Update Ratings", key="update_ratings", help="For updating the ratings and user registrations.")
+    full_retrain = st.checkbox("Full retrain", key="full_retrain", help="Search the model parameters again on all ratings instead of updating the current model with the new ones.")
 
 # update model
 if update_model:
-    cmf = CMFTrainer()
-    try:
-        with st.spinner("CMF training in progress...", show_time=True):
-            if cmf.search_best_param():
-                st.success("Best Model trained and saved. Close the app and reopen to initialize changes.")
-    except Exception as e:
-        logger.error(f"Error occured: {e}")
-        st.error(f"Error occured while training: {e}")
-    # st.warning("Currently models are not being updated due to certain unforseen circumstances. Please come back later...")
-    
+    # training runs in its own process, this session only follows its status
+    job = TrainingJob.start(full=full_retrain)
+    logger.info(f"Training job {job.job_id} requested")
+
+@st.fragment(run_every=2)
+def training_status():
+    job = TrainingJob.latest()
+    if job is None:
+        return
+    status = job.status()
+    state = status.get('state')
+    if state in ('queued', 'running'):
+        if not job.alive():
+            st.warning(f"Training job {job.job_id} stopped unexpectedly. See {status.get('log')}")
+            return
+        eta = status.get('eta_seconds')
+        eta_text = f", about {int(eta // 60)}m {int(eta % 60)}s left" if eta is not None else ""
+        st.progress(status.get('progress', 0.0), text=f"Training job {job.job_id}: {status.get('stage')}{eta_text}")
+    elif state == 'succeeded':
+        if st.session_state.get('published_job') != job.job_id:
+            # sessions pick the new model up on their next request
+            get_model_registry().refresh()
+            st.session_state['published_job'] = job.job_id
+        st.success(f"Training job {job.job_id} finished. Recommendations now use the new model.")
+    elif state == 'unchanged':
+        st.info("No new ratings since the last training, the model is up to date.")
+    elif state == 'failed':
+        st.error(f"Training job {job.job_id} failed: {status.get('error')}")
+
+with col2:
+    training_status()
     
 # update ratings
 if update_ratings:
     ratings_helper = RatingsHelper()
     users_helper = UserHelper()
     if ratings_helper.update_ratings_from_new_ratings(users_helper):
+        # existing users' precomputed recommendations change with their new ratings
+        if len(ratings_helper.updated_users) and get_topn_table() is not None:
+            cmf_recommender = get_cmf_recommender()
+            TopNBatch(model=cmf_recommender.model, factors=cmf_recommender.serving_factors(ratings_helper.updated_users),
+                      ratings_df=ratings_helper.ratings_df).run(user_ids=ratings_helper.updated_users)
+        for updated_user in ratings_helper.updated_users:
+            get_result_cache().invalidate_user(updated_user)
         st.success("Ratings data updated. Train models to get recommendations")
     else:
         st.error("Something didn't work right. Try again later...")
@@ -0,0 +1,64 @@
+"""
+IVF approximate nearest neighbours vs brute-force cosine NearestNeighbors.
+Reports build time, recall@k against the exact neighbours and p50/p99 query latency.
+Pass --model to use the A_ factors of a trained cmfrec model instead of synthetic ones.
+
+    python -m benchmarks.bench_ann --rows 200000 --factors 40 --nprobe 4 8 16
+"""
+import time
+import pickle
+import argparse
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from recommenders.ann_index import IVFIndex
+
+def synthetic_factors(rows, factors, clusters=500, seed=0):
+    # latent factors of real models are clustered, pure gaussian noise would be the worst case
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, factors))
+    return (centers[rng.integers(0, clusters, rows)] + 0.5 * rng.normal(size=(rows, factors))).astype(np.float32)
+
+def latencies(fn, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--factors", type=int, default=40)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs='+', default=[4, 8, 16])
+    args = parser.parse_args()
+
+    if args.model:
+        with open(args.model, 'rb') as f:
+            factors = pickle.load(f).A_
+    else:
+        factors = synthetic_factors(args.rows, args.factors)
+    queries = factors[np.random.default_rng(1).choice(len(factors), args.queries, replace=False)]
+
+    start = time.perf_counter()
+    exact = NearestNeighbors(n_neighbors=args.k, metric='cosine', algorithm='brute').fit(factors)
+    print(f"rows: {len(factors)}, factors: {factors.shape[1]}")
+    print(f"brute force fit: {time.perf_counter() - start:.2f}s")
+    truth = exact.kneighbors(queries, return_distance=False)
+    p50, p99 = latencies(lambda q: exact.kneighbors(q.reshape(1, -1)), queries)
+    print(f"brute force query: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(factors)
+    print(f"IVF build ({len(index.centroids)} lists): {time.perf_counter() - start:.2f}s")
+    for nprobe in args.nprobe:
+        found = index.kneighbors(queries, args.k, nprobe=nprobe)[1]
+        recall = np.mean([len(np.intersect1d(f, t)) / args.k for f, t in zip(found, truth)])
+        p50, p99 = latencies(lambda q: index.kneighbors(q, args.k, nprobe=nprobe), queries)
+        print(f"IVF nprobe {nprobe:>3}: recall@{args.k} {recall:.3f}, p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+if __name__ == "__main__":
+    main()
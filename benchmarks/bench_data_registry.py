@@ -0,0 +1,49 @@
+"""
+Per-rerun cost of st.cache_data (pickle round trip of the cached value on every hit) compared
+with a DataRegistry hit, which hands back the shared object.
+
+    python -m benchmarks.bench_data_registry --ratings datasets/ml-latest/ratings.csv
+"""
+import os
+import time
+import pickle
+import argparse
+import tracemalloc
+import numpy as np
+from dotenv import load_dotenv
+from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.data_registry import DataRegistry
+
+load_dotenv()
+
+def measure(fn, repeat):
+    timings, peaks = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        value = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1e6)
+        tracemalloc.stop()
+        del value
+    return np.median(timings), np.max(peaks)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ratings", default=os.getenv("RATINGS_DATA"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ratings_df = DataFrameManager(args.ratings).load_dataframe()
+    print(f"Ratings: {len(ratings_df)} rows, {ratings_df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+    # what st.cache_data does on every hit
+    pickled = pickle.dumps(ratings_df, protocol=pickle.HIGHEST_PROTOCOL)
+    copy_ms, copy_mb = measure(lambda: pickle.loads(pickled), args.repeat)
+    registry = DataRegistry()
+    registry.get("ratings", lambda: ratings_df)
+    hit_ms, hit_mb = measure(lambda: registry.get("ratings", lambda: ratings_df), args.repeat)
+    print(f"st.cache_data hit: {copy_ms:.2f} ms, {copy_mb:.1f} MB allocated per rerun")
+    print(f"registry hit:      {hit_ms:.4f} ms, {hit_mb:.3f} MB allocated per rerun")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+CMF retraining after new ratings arrive: full refit from random init vs the warm-start
+incremental update (IncrementalCMF). A model is fitted on the older ratings, the newest
+ones (including new users and movies) are added, and both models are scored on a
+holdout of the newest ratings and of the older ones. Reports RMSE drift, and wall time
+both for the factor update alone and end to end: factors plus the serving artifacts that
+CMFTrainer._save_model writes (ANN indexes, int8 export, model pickle, top-N table), which
+is what "Update Model" costs. The incremental run refreshes the ANN indexes of the base model.
+
+    python -m benchmarks.bench_incremental --users 20000 --movies 5000 --ratings 1000000 --new 0.02
+"""
+import os
+import copy
+import time
+import shutil
+import pickle
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from cmfrec import CMF
+from model_trainer.cmf_incremental import IncrementalCMF
+from model_trainer.topn_batch import TopNBatch
+from recommenders.ann_index import IVFIndex
+from recommenders.cmf_recommender import CMFRecommender
+from recommenders.quantized_factors import QuantizedFactors
+
+def synthetic_ratings(args, rng):
+    k = 10
+    user_factors = rng.normal(0, 0.5, (args.users, k))
+    item_factors = rng.normal(0, 0.5, (args.movies, k))
+    activity = rng.lognormal(0, 1, args.users)
+    popularity = 1 / np.arange(1, args.movies + 1) ** 0.7
+    users = rng.choice(args.users, args.ratings, p=activity / activity.sum())
+    items = rng.choice(args.movies, args.ratings, p=popularity / popularity.sum())
+    df = pd.DataFrame({'UserId': users + 1, 'ItemId': items + 1}).drop_duplicates()
+    truth = np.einsum('ij,ij->i', user_factors[df['UserId'] - 1], item_factors[df['ItemId'] - 1]) + 3.5
+    df['Rating'] = np.clip(np.rint((truth + rng.normal(0, 0.7, len(df))) * 2) / 2, 0.5, 5)
+    # timestamp 2 = rated since the last training: everything of the newest users and movies,
+    # plus part of the ratings of a few returning users
+    returning = rng.random(args.users + 1) < args.new
+    late = ((df['UserId'] > args.users * (1 - args.new)) | (df['ItemId'] > args.movies * (1 - args.new))
+            | (returning[df['UserId']] & (rng.random(len(df)) < 0.3)))
+    df['timestamp'] = np.where(late, 2, 1)
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+def rmse(model, df):
+    preds = model.predict(df['UserId'].values, df['ItemId'].values)
+    known = ~np.isnan(preds)
+    return np.sqrt(np.mean((preds[known] - df['Rating'].values[known]) ** 2))
+
+def save_artifacts(model, ratings_df, directory, previous=None, updated_rows=None):
+    """The artifact steps of CMFTrainer._save_model into directory: {step: seconds}."""
+    timings = {}
+    start = time.perf_counter()
+    for side, factors in (('user', model.A_), ('item', model.B_)):
+        path = os.path.join(directory, f"{side}_ann")
+        if previous is not None:
+            index = IVFIndex.load(os.path.join(previous, f"{side}_ann")).refresh(factors, updated_rows[side == 'item'])
+        else:
+            index = IVFIndex.build(factors)
+        index.save(path)
+    timings['ANN'] = time.perf_counter() - start
+    start = time.perf_counter()
+    factors = CMFRecommender.scoring_factors(model)
+    for dtype in QuantizedFactors.DTYPES:
+        QuantizedFactors.from_factors(factors, model.user_mapping_, model.item_mapping_, dtype).save(os.path.join(directory, dtype))
+        with open(os.path.join(directory, dtype, "stripped_model.pkl"), 'wb') as f:
+            pickle.dump(CMFRecommender.strip_factors(model), f)
+    timings['quantized'] = time.perf_counter() - start
+    start = time.perf_counter()
+    model_path = os.path.join(directory, "cmf_full.pkl")
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    timings['pickle'] = time.perf_counter() - start
+    start = time.perf_counter()
+    TopNBatch(model=model, ratings_df=ratings_df).run(path=os.path.join(directory, "cmf_topn.npz"), model_path=model_path)
+    timings['top-N'] = time.perf_counter() - start
+    return timings
+
+def describe(fit_seconds, timings):
+    steps = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items())
+    return f"{fit_seconds + sum(timings.values()):.2f}s (factors {fit_seconds:.2f}s, {steps})"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--ratings", type=int, default=1000000)
+    parser.add_argument("--new", type=float, default=0.02, help="share of new users / new movies / returning users")
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--lambda_", type=float, default=10)
+    parser.add_argument("--sweeps", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    df = synthetic_ratings(args, rng)
+    holdout = rng.random(len(df)) < 0.05
+    train, test = df[~holdout], df[holdout]
+    old = train[train['timestamp'] == 1]
+    new = train[train['timestamp'] == 2]
+    print(f"ratings: {len(train)} train ({len(new)} new), {len(test)} holdout")
+
+    base = CMF(k=args.k, lambda_=args.lambda_, verbose=False).fit(old[['UserId', 'ItemId', 'Rating']])
+    ratings_df = train.rename(columns={'UserId': 'userId', 'ItemId': 'movieId', 'Rating': 'rating'})
+    workdir = tempfile.mkdtemp(prefix="bench_incremental_")
+    for name in ("base", "full", "incremental"):
+        os.makedirs(os.path.join(workdir, name))
+    save_artifacts(base, ratings_df[ratings_df['timestamp'] == 1], os.path.join(workdir, "base"))
+
+    start = time.perf_counter()
+    full = CMF(k=args.k, lambda_=args.lambda_, verbose=False).fit(train[['UserId', 'ItemId', 'Rating']])
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    updater = IncrementalCMF(copy.deepcopy(base), sweeps=args.sweeps)
+    incremental = updater.update(train['UserId'].values, train['ItemId'].values, train['Rating'].values,
+                                 touched_users=new['UserId'].unique(), touched_items=new['ItemId'].unique())
+    incremental_seconds = time.perf_counter() - start
+
+    full_timings = save_artifacts(full, ratings_df, os.path.join(workdir, "full"))
+    incremental_timings = save_artifacts(incremental, ratings_df, os.path.join(workdir, "incremental"),
+                                         previous=os.path.join(workdir, "base"),
+                                         updated_rows=(updater.updated_user_rows, updater.updated_item_rows))
+
+    for name, subset in (("new ratings", test[test['timestamp'] == 2]), ("old ratings", test[test['timestamp'] == 1])):
+        base_rmse, full_rmse, incremental_rmse = rmse(base, subset), rmse(full, subset), rmse(incremental, subset)
+        print(f"holdout {name}: stale model {base_rmse:.4f}, full refit {full_rmse:.4f}, "
+              f"incremental {incremental_rmse:.4f} (drift {incremental_rmse - full_rmse:+.4f})")
+    print(f"factors only: full refit {full_seconds:.2f}s, incremental ({args.sweeps} sweeps): {incremental_seconds:.2f}s "
+          f"({full_seconds / incremental_seconds:.1f}x)")
+    full_total = full_seconds + sum(full_timings.values())
+    incremental_total = incremental_seconds + sum(incremental_timings.values())
+    print(f"end to end: full refit {describe(full_seconds, full_timings)}")
+    print(f"end to end: incremental {describe(incremental_seconds, incremental_timings)} ({full_total / incremental_total:.1f}x)")
+    new_user = int(train['UserId'].max())
+    print(f"topN for new user {new_user}: {incremental.topN(new_user, 5).tolist()}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+User-similarity recommendations: the old per-neighbour set difference + per-movie rating
+lookup loop (on the original DataFrame filters and on RatingsIndex lookups) vs one sparse
+(weights x ratings) product. Neighbours are drawn at random, the
+aggregation cost does not depend on how they were found.
+
+    python -m benchmarks.bench_neighbourhood --ratings 5000000 --users 100000 --movies 50000
+"""
+import time
+import argparse
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from utils.ratings_index import RatingsIndex
+from recommenders.neighbourhood import aggregate_neighbour_ratings
+
+def loop_recommend(index, userId, neighbours):
+    seen_by_user = index.seen(userId).tolist()
+    scores = defaultdict(list)
+    for user_id, sim in neighbours:
+        if user_id != userId:
+            recommendable = list(set(index.seen(user_id).tolist()) - set(seen_by_user))
+            for movie_id in recommendable:
+                scores[movie_id].append(index.rating(user_id, movie_id) * sim)
+    aggregated = {movie_id: sum(values) for movie_id, values in scores.items()}
+    return sorted(aggregated.items(), key=lambda x: x[1], reverse=True)
+
+def pandas_recommend(ratings_df, userId, neighbours):
+    # lookups as they were done before RatingsIndex: boolean filters over the whole table
+    seen_by_user = ratings_df[ratings_df['userId'] == userId]['movieId'].tolist()
+    scores = defaultdict(list)
+    for user_id, sim in neighbours:
+        if user_id != userId:
+            recommendable = list(set(ratings_df[ratings_df['userId'] == user_id]['movieId'].tolist()) - set(seen_by_user))
+            for movie_id in recommendable:
+                rating = ratings_df[(ratings_df['userId'] == user_id) & (ratings_df['movieId'] == movie_id)]['rating'].values[0]
+                scores[movie_id].append(rating * sim)
+    aggregated = {movie_id: sum(values) for movie_id, values in scores.items()}
+    return sorted(aggregated.items(), key=lambda x: x[1], reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ratings", type=int, default=5000000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--movies", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=256)
+    parser.add_argument("--pandas-queries", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # heavy-tailed activity and popularity like MovieLens
+    activity = rng.lognormal(0, 1.2, args.users)
+    users = rng.choice(np.arange(1, args.users + 1), args.ratings, p=activity / activity.sum())
+    popularity = 1 / np.arange(1, args.movies + 1) ** 0.8
+    movies = rng.choice(np.arange(1, args.movies + 1), args.ratings, p=popularity / popularity.sum())
+    ratings_df = pd.DataFrame({'userId': users, 'movieId': movies,
+                               'rating': rng.integers(1, 11, args.ratings) / 2}).drop_duplicates(['userId', 'movieId'])
+    index = RatingsIndex(ratings_df)
+    print(f"ratings: {len(ratings_df)}, users: {len(index.user_ids)}, movies: {len(index.item_ids)}")
+
+    queries = rng.choice(index.user_ids, args.queries, replace=False)
+    neighbours = [list(zip(rng.choice(index.user_ids, 10).tolist(), rng.random(10).tolist())) for _ in queries]
+
+    start = time.perf_counter()
+    for u, n in list(zip(queries, neighbours))[:args.pandas_queries]:
+        pandas_recommend(ratings_df, int(u), n)
+    pandas_ms = (time.perf_counter() - start) * 1000 / max(args.pandas_queries, 1)
+
+    start = time.perf_counter()
+    expected = [loop_recommend(index, int(u), n) for u, n in zip(queries, neighbours)]
+    loop_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    got = [aggregate_neighbour_ratings(index, [int(u)], [n])[0] for u, n in zip(queries, neighbours)]
+    sparse_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    batch_queries = rng.choice(index.user_ids, args.batch).tolist()
+    batch_neighbours = [list(zip(rng.choice(index.user_ids, 10).tolist(), rng.random(10).tolist())) for _ in batch_queries]
+    start = time.perf_counter()
+    aggregate_neighbour_ratings(index, batch_queries, batch_neighbours, k=10)
+    batch_ms = (time.perf_counter() - start) * 1000 / len(batch_queries)
+
+    same = all(dict(a).keys() == dict(b).keys() and np.allclose([s for _, s in sorted(a)], [s for _, s in sorted(b)], atol=1e-4)
+               for a, b in zip(expected, got))
+    print(f"DataFrame filter loop: {pandas_ms:.0f} ms/user")
+    print(f"RatingsIndex loop: {loop_ms:.2f} ms/user")
+    print(f"sparse: {sparse_ms:.2f} ms/user ({pandas_ms / sparse_ms:.0f}x / {loop_ms / sparse_ms:.0f}x), "
+          f"batched top-10: {batch_ms:.3f} ms/user ({pandas_ms / batch_ms:.0f}x / {loop_ms / batch_ms:.0f}x), same results: {same}")
+
+if __name__ == "__main__":
+    main()
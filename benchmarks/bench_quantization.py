@@ -0,0 +1,91 @@
+"""
+CMF serving factors: float64 (pickled model) vs per-row int8 (float32 BLAS over int8 blocks).
+Reports factor memory, top-N latency, top-N overlap with the float64 ranking and the RMSE
+change on observed ratings. Uses synthetic factors and ratings, or the real model and
+ratings with --real (CMF_MODEL_PATH / RATINGS_DATA).
+
+    python -m benchmarks.bench_quantization --users 200000 --movies 50000 --k 40
+"""
+import time
+import argparse
+import numpy as np
+from recommenders.cmf_recommender import CMFRecommender
+from recommenders.quantized_factors import QuantizedFactors
+from utils.id_index import IdIndex
+
+def float64_topN(factors, row, N, exclude_rows):
+    scores = factors['B'] @ factors['A'][row] + factors['item_bias'] + factors['user_bias'][row] + factors['glob_mean']
+    scores[exclude_rows] = -np.inf
+    top = np.argpartition(-scores, N - 1)[:N]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+def synthetic(args, rng):
+    factors = {
+        'A': rng.normal(0, 0.35, (args.users, args.k)),
+        'B': rng.normal(0, 0.35, (args.movies, args.k)),
+        'user_bias': rng.normal(0, 0.4, args.users),
+        'item_bias': rng.normal(0, 0.5, args.movies),
+        'glob_mean': 3.5,
+    }
+    users = rng.integers(0, args.users, args.ratings)
+    items = rng.integers(0, args.movies, args.ratings)
+    truth = (np.einsum('ij,ij->i', factors['A'][users], factors['B'][items]) + factors['user_bias'][users]
+             + factors['item_bias'][items] + factors['glob_mean'] + rng.normal(0, 0.8, args.ratings))
+    ratings = np.clip(np.rint(truth * 2) / 2, 0.5, 5)
+    return factors, np.arange(1, args.users + 1), np.arange(1, args.movies + 1), users + 1, items + 1, ratings
+
+def real():
+    from utils.ratings_helper import RatingsHelper
+    model = CMFRecommender.load_model()
+    ratings_df = RatingsHelper().ratings_df
+    return (CMFRecommender.scoring_factors(model), np.asarray(model.user_mapping_), np.asarray(model.item_mapping_),
+            ratings_df['userId'].values, ratings_df['movieId'].values, ratings_df['rating'].values)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--movies", type=int, default=50000)
+    parser.add_argument("--k", type=int, default=40)
+    parser.add_argument("--ratings", type=int, default=2000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--N", type=int, default=10)
+    parser.add_argument("--real", action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    factors, user_ids, item_ids, rated_users, rated_items, ratings = real() if args.real else synthetic(args, rng)
+    users = IdIndex(user_ids).rows(rated_users)
+    items = IdIndex(item_ids).rows(rated_items)
+    known = (users >= 0) & (items >= 0)
+    u, i = users[known], items[known]
+    full_preds = np.full(len(ratings), np.nan)
+    full_preds[known] = (np.einsum('ij,ij->i', factors['A'][u], factors['B'][i]) + factors['user_bias'][u]
+                         + factors['item_bias'][i] + factors['glob_mean'])
+    full_rmse = np.sqrt(np.mean((full_preds[known] - ratings[known]) ** 2))
+    factor_bytes = factors['A'].nbytes + factors['B'].nbytes
+    print(f"users: {len(user_ids)}, movies: {len(item_ids)}, k: {factors['A'].shape[1]}, ratings: {known.sum()}")
+    print(f"float64: factors {factor_bytes / 1e6:.1f} MB, rating RMSE {full_rmse:.4f}")
+
+    query_rows = rng.choice(len(user_ids), min(args.queries, len(user_ids)), replace=False)
+    excluded = [rng.choice(len(item_ids), min(50, len(item_ids) - args.N), replace=False) for _ in query_rows]
+    start = time.perf_counter()
+    expected = [float64_topN(factors, row, args.N, exclude) for row, exclude in zip(query_rows, excluded)]
+    float64_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+    print(f"float64: top-{args.N} {float64_ms:.2f} ms/user")
+
+    for dtype in QuantizedFactors.DTYPES:
+        quantized = QuantizedFactors.from_factors(factors, user_ids, item_ids, dtype)
+        preds = quantized.predict(rated_users, rated_items).astype(np.float64)
+        rmse = np.sqrt(np.mean((preds[known] - ratings[known]) ** 2))
+        drift = np.sqrt(np.mean((preds[known] - full_preds[known]) ** 2))
+        start = time.perf_counter()
+        got = [quantized.topN(int(user_ids[row]), args.N, exclude=item_ids[exclude]) for row, exclude in zip(query_rows, excluded)]
+        ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+        overlap = np.mean([len(set(item_ids[e].tolist()) & {movieId for movieId, _ in g}) / args.N for e, g in zip(expected, got)])
+        print(f"{dtype}: factors {(quantized.A.nbytes + quantized.B.nbytes) / 1e6:.1f} MB "
+              f"({factor_bytes / (quantized.A.nbytes + quantized.B.nbytes):.1f}x smaller, {quantized.nbytes / 1e6:.1f} MB with ids/scales/biases), "
+              f"top-{args.N} {ms:.2f} ms/user, overlap@{args.N} {overlap:.3f}, "
+              f"rating RMSE {rmse:.4f} (delta {rmse - full_rmse:+.5f}), RMSE vs float64 predictions {drift:.5f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+user_user_sim benchmark: the old per-row cosine_similarity loop vs SimilarityEngine.
+The loop is timed on a slice of the rows and extrapolated to the full matrix.
+
+    python -m benchmarks.bench_similarity --rows 200000 --factors 40
+"""
+import time
+import argparse
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from recommenders.similarity import SimilarityEngine
+
+def loop_similarity(factors, ids, query_row, threshold, limit):
+    query = factors[query_row].reshape(1, -1)
+    sims = {}
+    for i, vec in enumerate(factors[:limit]):
+        if i != query_row:
+            similarity = cosine_similarity(query, vec.reshape(1, -1))[0][0]
+            if similarity > threshold:
+                sims[int(ids[i])] = similarity
+    return dict(sorted(sims.items(), key=lambda x: x[1], reverse=True))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--factors", type=int, default=40)
+    parser.add_argument("--loop-rows", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    factors = rng.normal(size=(args.rows, args.factors))
+    ids = np.arange(1, args.rows + 1)
+
+    start = time.perf_counter()
+    expected = loop_similarity(factors, ids, 0, args.threshold, args.loop_rows)
+    loop_ms = (time.perf_counter() - start) * 1000 * args.rows / args.loop_rows
+
+    start = time.perf_counter()
+    engine = SimilarityEngine(factors, ids)
+    build_ms = (time.perf_counter() - start) * 1000
+    # same answer on the slice the loop covered
+    small = SimilarityEngine(factors[:args.loop_rows], ids[:args.loop_rows])
+    found_ids, _ = small.query(1, threshold=args.threshold)
+    assert found_ids.tolist() == list(expected.keys()), "engine and loop disagree"
+
+    timings = []
+    for query_id in rng.choice(ids, args.queries, replace=False):
+        start = time.perf_counter()
+        engine.query(query_id, threshold=args.threshold)
+        timings.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    engine.query_batch(rng.choice(ids, args.queries, replace=False), k=20)
+    batch_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    print(f"rows: {args.rows}, factors: {args.factors}")
+    print(f"python loop (extrapolated): {loop_ms:.0f} ms per query")
+    print(f"engine build: {build_ms:.0f} ms, query p50: {np.median(timings):.2f} ms, batched: {batch_ms:.2f} ms per query")
+    print(f"speedup: {loop_ms / np.median(timings):.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Title search benchmark: trigram index vs the old str.contains scan.
+
+    python -m benchmarks.bench_title_search --movies datasets/ml-latest/movies.csv
+"""
+import os
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.title_search import TitleSearchIndex
+
+load_dotenv()
+
+QUERIES = ["toy story", "avengers", "star wars", "lord of the rings", "matrix", "godfather",
+           "harry potter", "amelie", "love", "the", "batman begins", "spider", "pulp fiction", "al"]
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, np.array(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", default=os.getenv("MOVIES_DATA"))
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    movies_df = DataFrameManager(args.movies).load_dataframe()
+    start = time.perf_counter()
+    index = TitleSearchIndex(movies_df)
+    print(f"Movies: {len(movies_df)}. Index build: {time.perf_counter() - start:.2f}s")
+
+    scan_all, index_all = [], []
+    print(f"{'query':<20}{'scan ms':>10}{'index ms':>10}{'hits':>8}{'recall@k':>10}")
+    for query in QUERIES:
+        scan, scan_ms = timed(lambda: movies_df[movies_df['title'].str.contains(query, case=False, na=False)], args.repeat)
+        found, index_ms = timed(lambda: index.search(query, k=args.k), args.repeat)
+        expected = set(scan['movieId'].tolist())
+        recall = len(expected & set(found.tolist())) / min(len(expected), args.k) if expected else 1.0
+        scan_all.append(scan_ms)
+        index_all.append(index_ms)
+        print(f"{query:<20}{np.median(scan_ms):>10.2f}{np.median(index_ms):>10.2f}{len(expected):>8}{recall:>10.2f}")
+    scan_all = np.concatenate(scan_all)
+    index_all = np.concatenate(index_all)
+    print(f"substring scan: p50 {np.percentile(scan_all, 50):.2f} ms, p99 {np.percentile(scan_all, 99):.2f} ms")
+    print(f"trigram index:  p50 {np.percentile(index_all, 50):.2f} ms, p99 {np.percentile(index_all, 99):.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,102 @@
 import os
+import numpy as np
 import pandas as pd
+from dotenv import load_dotenv
 from logging_custom.logger import Logger
 
+load_dotenv()
+# "csv" keeps the original behaviour, "parquet" converts each CSV once into a columnar sibling file
+DATA_STORAGE = os.getenv("DATA_STORAGE", "csv").lower()
+
+# compact dtypes applied to known columns before writing the columnar copy
+COMPACT_DTYPES = {
+    'userId': np.int32,
+    'movieId': np.int32,
+    'imdbId': np.int32,
+    'tmdbId': np.int32,
+    'rating': np.float32,
+    'timestamp': np.uint32,
+    'avg_rating': np.float32,
+    'avg_hour': np.float32,
+}
+
 class DataFrameManager:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, storage: str = None):
         self.logger = Logger("DataFrameManager").get_logger()
         self.file_path = file_path
+        self.storage = (storage or DATA_STORAGE).lower()
+        if self.storage not in ("csv", "parquet"):
+            self.logger.error(f"Unknown storage mode {self.storage}")
+            raise ValueError(f"Unknown storage mode {self.storage}. Use 'csv' or 'parquet'.")
+
+    @staticmethod
+    def columnar_path(file_path: str) -> str:
+        """Path of the parquet sibling of a CSV file."""
+        return os.path.splitext(file_path)[0] + ".parquet"
+
+    @staticmethod
+    def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+        """Downcast known id/rating/timestamp columns. Columns with missing values are left as they are."""
+        for column, dtype in COMPACT_DTYPES.items():
+            if column in df.columns and df[column].notna().all():
+                df[column] = df[column].astype(dtype)
+        return df
 
-    def load_dataframe(self) -> pd.DataFrame:
-        """Load a DataFrame from the file path."""
+    def load_dataframe(self, columns: list = None) -> pd.DataFrame:
+        """Load a DataFrame from the file path, optionally projecting only the given columns."""
+        if self.storage == "parquet":
+            return self._load_columnar(columns)
         if os.path.exists(self.file_path):
-            df = pd.read_csv(self.file_path)
+            df = pd.read_csv(self.file_path, usecols=columns)
             self.logger.info(f"DataFrame loaded from {self.file_path}")
         else:
             df = pd.DataFrame()
             self.logger.warning(f"File {self.file_path} does not exist. Initialized empty DataFrame.")
         return df
 
+    def _load_columnar(self, columns: list = None) -> pd.DataFrame:
+        parquet_path = self.columnar_path(self.file_path)
+        csv_exists = os.path.exists(self.file_path)
+        parquet_exists = os.path.exists(parquet_path)
+        # convert once, and again only if the CSV was modified after the conversion
+        if csv_exists and (not parquet_exists or os.path.getmtime(self.file_path) > os.path.getmtime(parquet_path)):
+            self.convert_to_columnar()
+            parquet_exists = True
+        if not parquet_exists:
+            self.logger.warning(f"File {self.file_path} does not exist. Initialized empty DataFrame.")
+            return pd.DataFrame()
+        df = pd.read_parquet(parquet_path, columns=columns)
+        self.logger.info(f"DataFrame loaded from {parquet_path} (columns: {columns or 'all'})")
+        return df
+
+    def convert_to_columnar(self) -> str:
+        """Convert the CSV at file path into a compact parquet file and return its path."""
+        parquet_path = self.columnar_path(self.file_path)
+        self.logger.info(f"Converting {self.file_path} to columnar format")
+        df = self.compact_dtypes(pd.read_csv(self.file_path))
+        self._write_parquet(df, parquet_path)
+        self.logger.info(f"Converted {self.file_path} to {parquet_path}. Memory usage: {df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+        return parquet_path
+
+    def _write_parquet(self, df: pd.DataFrame, parquet_path: str):
+        # write to a temporary file and rename so readers never see a partial file
+        tmp_path = parquet_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+
     def save_dataframe(self, df: pd.DataFrame, file_path: str):
         """Save a DataFrame to the specified file path."""
-        df.to_csv(file_path, index=False)
+        if self.storage == "parquet":
+            parquet_path = self.columnar_path(file_path)
+            self._write_parquet(self.compact_dtypes(df.copy()), parquet_path)
+            self.logger.info(f"DataFrame saved to {parquet_path}")
+            return
+        tmp_path = file_path + ".tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, file_path)
         self.logger.info(f"DataFrame saved to {file_path}")
 
     def delete_dataframe(self, df: pd.DataFrame):
         """Delete a DataFrame from memory."""
         del df
-        self.logger.info("DataFrame deleted from memory")
\ No newline at end of file
+        self.logger.info("DataFrame deleted from memory")
@@ -0,0 +1,167 @@
+import os
+import time
+from dotenv import load_dotenv
+import numpy as np
+import scipy.sparse as sp
+from logging_custom.logger import Logger
+
+load_dotenv()
+CMF_INCREMENTAL_SWEEPS = int(os.getenv('CMF_INCREMENTAL_SWEEPS', 3))
+# rows with at most this many ratings are solved in batches, heavier rows one by one
+LIGHT_ROW_RATINGS = 200
+
+class IncrementalCMF:
+    """
+    Warm-start update of a fitted cmfrec CMF model with new ratings.
+    New users and items are appended to A_/B_ (small random init, zero bias) and the mappings;
+    then a few ALS sweeps re-solve only the touched rows: users with new ratings, then items
+    with new ratings, each from all of its ratings against the other side's current factors.
+    Every row update is the closed-form ridge step of cmfrec's ALS (factor and bias solved jointly),
+    so rows that are not touched keep exactly their trained values.
+    """
+    def __init__(self, model, sweeps: int = CMF_INCREMENTAL_SWEEPS, seed: int = 42):
+        self.logger = Logger("IncrementalCMF").get_logger()
+        self.model = model
+        self.sweeps = sweeps
+        self.rng = np.random.default_rng(seed)
+        # rows of A_/B_ changed by the last update(), new rows included
+        self.updated_user_rows = np.empty(0, dtype=np.int64)
+        self.updated_item_rows = np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def supports(model) -> bool:
+        """Only plain explicit-feedback ALS models: no side information, implicit features or constraints."""
+        try:
+            return (getattr(model, 'method', 'als') == 'als'
+                    and not getattr(model, 'k_user', 0) and not getattr(model, 'k_item', 0) and not getattr(model, 'k_main', 0)
+                    and not getattr(model, 'add_implicit_features', False) and not getattr(model, 'NA_as_zero', False)
+                    and not getattr(model, 'nonneg', False) and not getattr(model, 'scale_bias_const', False)
+                    and not np.any(getattr(model, 'l1_lambda', 0.0))
+                    and getattr(model, 'C_', np.empty((0, 0))).size == 0 and getattr(model, 'D_', np.empty((0, 0))).size == 0
+                    and np.asarray(model.A_).shape[1] == np.asarray(model.B_).shape[1] == model.k)
+        except AttributeError:
+            return False
+
+    def _lambdas(self, side):
+        """(factor, bias) regularization of 'user' or 'item' rows."""
+        lambda_ = getattr(self.model, 'lambda_', 1.0)
+        if isinstance(lambda_, np.ndarray):
+            # cmfrec's array order: user bias, item bias, user factors, item factors, ...
+            return (float(lambda_[2]), float(lambda_[0])) if side == 'user' else (float(lambda_[3]), float(lambda_[1]))
+        return float(lambda_), float(lambda_)
+
+    def _extend(self, mapping, factors, bias, ids):
+        new_ids = np.setdiff1d(np.unique(ids), mapping)
+        if len(new_ids):
+            init = self.rng.normal(0, 0.1, (len(new_ids), factors.shape[1])).astype(factors.dtype)
+            mapping = np.concatenate([mapping, new_ids.astype(mapping.dtype)])
+            factors = np.vstack([factors, init])
+            if bias is not None:
+                bias = np.concatenate([bias, np.zeros(len(new_ids), dtype=bias.dtype)])
+        return mapping, factors, bias, new_ids
+
+    def _solve_rows(self, side, rows, matrix, factors, bias, other_factors, other_bias, with_bias):
+        """ALS step for the given 'user' or 'item' rows of `factors`: matrix is the (rows x other) CSR rating matrix."""
+        lambda_factors, lambda_bias = self._lambdas(side)
+        scale_lam = getattr(self.model, 'scale_lam', False)
+        glob_mean = float(getattr(self.model, 'glob_mean_', 0.0) or 0.0)
+        k = factors.shape[1]
+        penalty = np.full(k + 1 if with_bias else k, lambda_factors)
+        if with_bias:
+            penalty[-1] = lambda_bias
+        # the other side's factors do not change during the half sweep: upcast them once
+        other = np.hstack([other_factors, np.ones((len(other_factors), 1))]) if with_bias else np.asarray(other_factors, dtype=np.float64)
+        offset = glob_mean + (other_bias if other_bias is not None else 0.0)
+        counts = np.diff(matrix.indptr)[rows]
+        # rows with few ratings are solved together: sorted by rating count so that each chunk
+        # pads its (rows x ratings x width) stack to a similar length; zero padding adds nothing to X'X or X'y
+        light = rows[(counts > 0) & (counts <= LIGHT_ROW_RATINGS)]
+        light = light[np.argsort(np.diff(matrix.indptr)[light], kind='stable')]
+        for chunk_start in range(0, len(light), 1024):
+            chunk = light[chunk_start:chunk_start + 1024]
+            chunk_counts = np.diff(matrix.indptr)[chunk]
+            owners = np.repeat(np.arange(len(chunk)), chunk_counts)
+            slots = np.arange(len(owners)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            positions = matrix.indptr[chunk][owners] + slots
+            cols = matrix.indices[positions]
+            padded = np.zeros((len(chunk), chunk_counts.max(), other.shape[1]))
+            padded[owners, slots] = other[cols]
+            targets = np.zeros((len(chunk), chunk_counts.max(), 1))
+            targets[owners, slots, 0] = matrix.data[positions] - (offset[cols] if other_bias is not None else offset)
+            transposed = padded.transpose(0, 2, 1)
+            gram = transposed @ padded
+            gram[:, np.arange(len(penalty)), np.arange(len(penalty))] += penalty * (chunk_counts[:, None] if scale_lam else 1)
+            solution = np.linalg.solve(gram, transposed @ targets)[:, :, 0]
+            factors[chunk] = solution[:, :k]
+            if with_bias:
+                bias[chunk] = solution[:, k]
+        for row in rows[counts > LIGHT_ROW_RATINGS]:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            cols = matrix.indices[start:end]
+            X = other[cols]
+            y = matrix.data[start:end] - (offset[cols] if other_bias is not None else offset)
+            gram = X.T @ X
+            gram[np.diag_indices_from(gram)] += penalty * (len(cols) if scale_lam else 1)
+            solution = np.linalg.solve(gram, X.T @ y)
+            factors[row] = solution[:k]
+            if with_bias:
+                bias[row] = solution[k]
+
+    def update(self, users, items, ratings, touched_users, touched_items=None):
+        """
+        users/items/ratings: the whole current rating table. touched_users/touched_items: ids whose
+        ratings changed since the model was trained (touched_items defaults to every item rated by a
+        touched user). Unknown ids are added to the model. Returns the updated model (the same object).
+        """
+        start = time.perf_counter()
+        model = self.model
+        users = np.asarray(users, dtype=np.int64)
+        items = np.asarray(items, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        user_bias = None if getattr(model, 'user_bias_', None) is None else np.array(model.user_bias_)
+        item_bias = None if getattr(model, 'item_bias_', None) is None else np.array(model.item_bias_)
+        user_mapping, A, user_bias, new_users = self._extend(np.asarray(model.user_mapping_), np.array(model.A_), user_bias, users)
+        item_mapping, B, item_bias, new_items = self._extend(np.asarray(model.item_mapping_), np.array(model.B_), item_bias, items)
+        touched_users = np.union1d(np.asarray(touched_users, dtype=np.int64), new_users)
+        if touched_items is None:
+            touched_items = items[np.isin(users, touched_users)]
+        touched_items = np.union1d(np.asarray(touched_items, dtype=np.int64), new_items)
+
+        # rows of the ratings in the extended mappings
+        user_order, item_order = np.argsort(user_mapping, kind='stable'), np.argsort(item_mapping, kind='stable')
+        user_rows = user_order[np.searchsorted(user_mapping, users, sorter=user_order)]
+        item_rows = item_order[np.searchsorted(item_mapping, items, sorter=item_order)]
+        by_user = sp.csr_matrix((ratings, (user_rows, item_rows)), shape=(len(user_mapping), len(item_mapping)))
+        by_item = by_user.T.tocsr()
+        touched_user_rows = user_order[np.searchsorted(user_mapping, touched_users, sorter=user_order)]
+        touched_item_rows = item_order[np.searchsorted(item_mapping, touched_items, sorter=item_order)]
+
+        for _ in range(self.sweeps):
+            self._solve_rows('user', touched_user_rows, by_user, A, user_bias, B, item_bias, user_bias is not None)
+            self._solve_rows('item', touched_item_rows, by_item, B, item_bias, A, user_bias, item_bias is not None)
+
+        self.updated_user_rows = np.sort(touched_user_rows).astype(np.int64)
+        self.updated_item_rows = np.sort(touched_item_rows).astype(np.int64)
+        # the fitted attributes cmfrec reads at prediction time, in its own dtype
+        dtype = np.asarray(model.A_).dtype
+        model.A_ = np.ascontiguousarray(A, dtype=dtype)
+        model.B_ = np.ascontiguousarray(B, dtype=dtype)
+        if user_bias is not None:
+            model.user_bias_ = user_bias.astype(dtype)
+        if item_bias is not None:
+            model.item_bias_ = item_bias.astype(dtype)
+        model.user_mapping_ = user_mapping
+        model.item_mapping_ = item_mapping
+        model._A_pred = model.A_
+        model._B_pred = model.B_
+        model._n_orig = model.B_.shape[0]
+        model.reindex_ = True
+        if getattr(model, 'produce_dicts', False):
+            model.user_dict_ = {user_mapping[i]: i for i in range(len(user_mapping))}
+            model.item_dict_ = {item_mapping[i]: i for i in range(len(item_mapping))}
+        if getattr(model, 'precompute_for_predictions', False) and hasattr(model, 'force_precompute_for_predictions'):
+            model.force_precompute_for_predictions()
+        self.logger.info(f"Incremental update: {len(touched_user_rows)} users ({len(new_users)} new), "
+                         f"{len(touched_item_rows)} items ({len(new_items)} new), {self.sweeps} sweeps "
+                         f"in {time.perf_counter() - start:.2f}s")
+        return model
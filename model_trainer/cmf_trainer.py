@@ -1,24 +1,98 @@
 import os
+import math
+import time
 import pickle
 from dotenv import load_dotenv
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse as sp
 from cmfrec import CMF
 from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import mean_squared_error as mse
 from logging_custom.logger import Logger
 from utils.ratings_helper import RatingsHelper
+from recommenders.ann_index import IVFIndex
+from recommenders.cmf_recommender import CMFRecommender
+from recommenders.quantized_factors import QuantizedFactors
+from model_trainer.topn_batch import TopNBatch, CMF_TOPN_TABLE
+from model_trainer.cmf_incremental import IncrementalCMF
 
 load_dotenv()
-CMF_MODEL_PATH = os.getenv('CMF_MODEL_PATH')
-CMF_USER_KNN = os.getenv('CMF_USER_KNN')
-CMF_ITEM_KNN = os.getenv('CMF_ITEM_KNN')
+# directory served by the recommenders; the artifact paths below live inside it
+CMF_MODEL_DIR = os.getenv('CMF_MODEL_DIR', "models/cmfrec_model")
+CMF_MODEL_PATH = os.getenv('CMF_MODEL_PATH', "models/cmfrec_model/cmf_full.pkl")
+CMF_USER_KNN = os.getenv('CMF_USER_KNN', "models/cmfrec_model/cmf_user_kneighbors.pkl")
+CMF_ITEM_KNN = os.getenv('CMF_ITEM_KNN', "models/cmfrec_model/cmf_item_kneighbors.pkl")
+CMF_USER_ANN = os.getenv('CMF_USER_ANN', "models/cmfrec_model/cmf_user_ann")
+CMF_ITEM_ANN = os.getenv('CMF_ITEM_ANN', "models/cmfrec_model/cmf_item_ann")
+CMF_QUANTIZED_FACTORS = os.getenv('CMF_QUANTIZED_FACTORS', "models/cmfrec_model/cmf_factors")
+# (user, movie) pairs and ratings the model was trained on, incremental updates refit what differs from it
+CMF_TRAINED_RATINGS = os.getenv('CMF_TRAINED_RATINGS', "models/cmfrec_model/cmf_trained_ratings.npz")
+# hyperparameter search: worker processes x cmfrec threads per fit should not exceed the cores, and the
+# workers' fits together should fit in CMF_SEARCH_MEMORY_MB (default: half of the available memory)
+CMF_SEARCH_NTHREADS = int(os.getenv('CMF_SEARCH_NTHREADS', 1))
+CMF_SEARCH_WORKERS = os.getenv('CMF_SEARCH_WORKERS')
+CMF_SEARCH_MEMORY_MB = os.getenv('CMF_SEARCH_MEMORY_MB')
+CMF_VALIDATION_FRACTION = float(os.getenv('CMF_VALIDATION_FRACTION', 0.1))
+# successive halving: each rung keeps the best 1/eta configurations and fits them with eta times more ALS iterations
+CMF_SEARCH_ETA = int(os.getenv('CMF_SEARCH_ETA', 3))
+CMF_SEARCH_NITER = int(os.getenv('CMF_SEARCH_NITER', 10))
+# incremental updates are used until the last full retrain is older than this
+CMF_FULL_RETRAIN_DAYS = float(os.getenv('CMF_FULL_RETRAIN_DAYS', 7))
+# share of the reported progress taken by the parameter search, the rest is refit and artifacts
+SEARCH_SHARE = 0.8
+
+# validation split of the search, attached once per worker process
+_split = {}
+
+def _share(arrays):
+    blocks, descriptors = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        descriptors[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, descriptors
+
+def _attach_split(descriptors, matrix_shape):
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        arrays[name].setflags(write=False)
+    _split['blocks'] = blocks
+    # COO over the shared buffers: row/col are int32 user/item codes and the ratings float32, the types
+    # cmfrec works with, so fits read the shared memory instead of copying the split into each worker
+    _split['train'] = sp.coo_matrix((arrays['train_ratings'], (arrays['train_users'], arrays['train_items'])), shape=matrix_shape)
+    _split['valid'] = (arrays['valid_users'], arrays['valid_items'], arrays['valid_ratings'])
+
+def _fit_and_score(params, niter, nthreads):
+    start = time.perf_counter()
+    model = CMF(k=params['k'], lambda_=params['lambda_'], niter=niter, nthreads=nthreads, use_float=True)
+    model.fit(_split['train'])
+    users, items, ratings = _split['valid']
+    preds = model.predict(users, items)
+    known = ~np.isnan(preds)
+    score = mse(ratings[known], preds[known]) if known.any() else float('inf')
+    return params, niter, score, time.perf_counter() - start
 
 class CMFTrainer:
-    def __init__(self):
+    def __init__(self, output_dir=None, progress=None):
         self.logger = Logger("CMFTrainer").get_logger()
+        # artifacts go to output_dir (same layout as CMF_MODEL_DIR) instead of the served files
+        self.output_dir = output_dir
+        # progress(stage, fraction) callback
+        self.progress = progress
+        # fail before the search when an artifact cannot go to output_dir, not after it
+        for path in (CMF_MODEL_PATH, CMF_USER_KNN, CMF_ITEM_KNN, CMF_USER_ANN, CMF_ITEM_ANN,
+                     CMF_QUANTIZED_FACTORS, CMF_TRAINED_RATINGS, CMF_TOPN_TABLE):
+            self._artifact(path)
         ratings_helper = RatingsHelper()
-        self.ratings_df = ratings_helper.ratings_df
-        self.ratings_df = self.ratings_df.drop(columns=['timestamp'])
+        self.ratings_df = ratings_helper.ratings_df.drop(columns=['timestamp'])
         self.ratings_df.columns = ['UserId', 'ItemId', 'Rating']
         self.logger.info(f"Initialized ratings data: {self.ratings_df.shape}")
         self.params_dist = {
@@ -30,6 +104,28 @@ class CMFTrainer:
         self.best_score = float('inf')
         self.best_model = None
 
+    def _artifact(self, path):
+        if self.output_dir is None:
+            return path
+        relative = os.path.relpath(path, CMF_MODEL_DIR)
+        if relative.startswith(os.pardir):
+            self.logger.error(f"Artifact {path} is outside {CMF_MODEL_DIR}")
+            raise ValueError(f"Artifact {path} is outside CMF_MODEL_DIR {CMF_MODEL_DIR}, it cannot be written to {self.output_dir}")
+        return os.path.join(self.output_dir, relative)
+
+    def _report(self, stage, fraction):
+        if self.progress is not None:
+            self.progress(stage, fraction)
+
+    def _atomic_pickle(self, obj, path):
+        # running servers may read the file at any time: write a temp file, then swap it in
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
 
     def _save_kneighbors(self, cmf_model):
         self.logger.info(f"Saving NNeighbors model for user and item..")
@@ -42,43 +138,233 @@ class CMFTrainer:
         nn_movie = NearestNeighbors(n_neighbors=n_neighbors, metric=metric, algorithm=algorithm)
         self.logger.info(f"Initialized Nearest Neighbors")
 
-        self.logger.info(f"Fitting NN models")
-        nn_user.fit(cmf_model.A_)
-        nn_movie.fit(cmf_model.B_)
+        # brute force only keeps the fitted matrix, and CMFRecommender.load_kneighbors fits it with the
+        # served factors: the pickles hold the configuration only instead of another copy of A_ and B_
         self.logger.info(f"Saving NN models")
-        with open("models/cmfrec_model/cmf_user_kneighbors.pkl", 'wb') as f:
-            pickle.dump(nn_user, f)
-            self.logger.info(f"Saving user NN models")
-        with open("models/cmfrec_model/cmf_item_kneighbors.pkl", 'wb') as f:
-            pickle.dump(nn_movie, f)
-            self.logger.info(f"Saving movie NN models")
+        self._atomic_pickle(nn_user, self._artifact(CMF_USER_KNN))
+        self.logger.info(f"Saving user NN models")
+        self._atomic_pickle(nn_movie, self._artifact(CMF_ITEM_KNN))
+        self.logger.info(f"Saving movie NN models")
+
+    def _save_ann_indexes(self, cmf_model, updated_rows=None):
+        """updated_rows: (user rows, item rows) changed by an incremental update, to refresh the served indexes."""
+        self.logger.info(f"Building approximate NN (IVF) indexes for user and item factors")
+        for factors, path, changed in ((cmf_model.A_, CMF_USER_ANN, None if updated_rows is None else updated_rows[0]),
+                                       (cmf_model.B_, CMF_ITEM_ANN, None if updated_rows is None else updated_rows[1])):
+            previous = IVFIndex.load(path) if changed is not None and os.path.exists(os.path.join(path, "meta.json")) else None
+            if previous is not None and len(previous.rows) <= len(factors):
+                index = previous.refresh(factors, changed)
+            else:
+                index = IVFIndex.build(factors)
+            index.save(self._artifact(path))
+        self.logger.info(f"ANN indexes saved at {self._artifact(CMF_USER_ANN)} and {self._artifact(CMF_ITEM_ANN)}")
+
+    def _save_quantized_factors(self, cmf_model):
+        factors = CMFRecommender.scoring_factors(cmf_model)
+        for dtype in QuantizedFactors.DTYPES:
+            directory = os.path.join(self._artifact(CMF_QUANTIZED_FACTORS), dtype)
+            QuantizedFactors.from_factors(factors, cmf_model.user_mapping_, cmf_model.item_mapping_, dtype).save(directory)
+            # servers using the export load this instead of the full model
+            self._atomic_pickle(CMFRecommender.strip_factors(cmf_model), os.path.join(directory, "stripped_model.pkl"))
+        self.logger.info(f"Quantized serving factors saved at {self._artifact(CMF_QUANTIZED_FACTORS)}")
+
+    def _validation_split(self, fraction, seed=42):
+        """Random holdout of the ratings; users and items that would be left without training ratings stay in train."""
+        rng = np.random.default_rng(seed)
+        users = self.ratings_df['UserId'].to_numpy(dtype=np.int64)
+        items = self.ratings_df['ItemId'].to_numpy(dtype=np.int64)
+        ratings = self.ratings_df['Rating'].to_numpy(dtype=np.float64)
+        valid = rng.random(len(ratings)) < fraction
+        # moving rows back to train never takes training ratings away, so one pass per id column is enough
+        for ids in (users, items):
+            valid &= np.isin(ids, ids[~valid])
+        return users, items, ratings, valid
+
+    def _search_workers(self, n_ratings, n_users, n_items):
+        """CMF_SEARCH_WORKERS, or as many workers as there are cores and memory for their fits."""
+        if CMF_SEARCH_WORKERS:
+            return max(int(CMF_SEARCH_WORKERS), 1)
+        workers = max((os.cpu_count() or 1) // CMF_SEARCH_NTHREADS, 1)
+        if CMF_SEARCH_MEMORY_MB:
+            budget = float(CMF_SEARCH_MEMORY_MB) * 2 ** 20
+        else:
+            try:
+                budget = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2
+            except (AttributeError, ValueError, OSError):
+                # no sysconf (windows): cores only
+                return workers
+        # measured peak of one cmfrec ALS fit: ~16 bytes per rating (its CSR/CSC copies) and ~8 bytes per factor
+        per_worker = n_ratings * 16 + (n_users + n_items) * max(self.params_dist['k']) * 8
+        return max(1, min(workers, int(budget // per_worker)))
+
+    def _rungs(self, n_configs):
+        n_rungs = 1 + int(math.log(n_configs, CMF_SEARCH_ETA)) if n_configs > 1 and CMF_SEARCH_ETA > 1 else 1
+        return [max(1, round(CMF_SEARCH_NITER * CMF_SEARCH_ETA ** (rung - n_rungs + 1))) for rung in range(n_rungs)]
 
     def search_best_param(self):
         self.logger.info("Searching for best parameters.")
         param_names = list(self.params_dist.keys())
         param_values = list(self.params_dist.values())
+        configs = [dict(zip(param_names, combo)) for combo in product(*param_values)]
 
-        for combo in product(*param_values):
-            params = dict(zip(param_names, combo))
-            self.logger.info(f"Testing parameters: {params}")
-            model = CMF(k=params['k'], lambda_=params['lambda_'])
-            model.fit(self.ratings_df)
-            preds = model.predict(self.ratings_df['UserId'].values, self.ratings_df['ItemId'].values)
-            score = mse(self.ratings_df['Rating'].values, preds)
-            self.logger.info(f"MSE for parameters {params}: {score}")
-            if score < self.best_score:
-                self.best_score = score
-                self.best_param = params
-                self.best_model = model
-        self.logger.info(f"****Best parameters: {self.best_param} with MSE: {self.best_score}****")
-        if self.best_model is not None:
-            self.logger.info("Saving best model configuration in output path")
-            os.makedirs(os.path.dirname(CMF_MODEL_PATH), exist_ok=True)
-            with open("models/cmfrec_model/cmf_full.pkl", 'wb') as file:
-                pickle.dump(self.best_model, file)
-            self.logger.info(f"Best model saved at {self.best_model}. Saving NN models for user and item simmilarities")
-            self._save_kneighbors(self.best_model)
+        users, items, ratings, valid = self._validation_split(CMF_VALIDATION_FRACTION)
+        self.logger.info(f"Validation split: {valid.sum()} of {len(ratings)} ratings held out")
+        # every id keeps training ratings, so codes over all ratings index the train matrix
+        user_ids, user_codes = np.unique(users, return_inverse=True)
+        item_ids, item_codes = np.unique(items, return_inverse=True)
+        user_codes, item_codes, ratings = user_codes.astype(np.int32), item_codes.astype(np.int32), ratings.astype(np.float32)
+        matrix_shape = (len(user_ids), len(item_ids))
+        blocks, descriptors = _share({
+            'train_users': user_codes[~valid], 'train_items': item_codes[~valid], 'train_ratings': ratings[~valid],
+            'valid_users': user_codes[valid], 'valid_items': item_codes[valid], 'valid_ratings': ratings[valid],
+        })
+        workers = self._search_workers(int((~valid).sum()), *matrix_shape)
+        rungs = self._rungs(len(configs))
+        # progress is counted in ALS iterations: every rung fits fewer configurations for longer
+        total, n_configs, done = 0, len(configs), 0
+        for rung in range(len(rungs)):
+            total += n_configs * rungs[rung]
+            n_configs = max(1, n_configs // CMF_SEARCH_ETA)
+        self.logger.info(f"Successive halving over {len(configs)} configurations, niter per rung: {rungs}, "
+                         f"{workers} workers x {CMF_SEARCH_NTHREADS} threads")
+        try:
+            if workers > 1:
+                pool = ProcessPoolExecutor(max_workers=workers, initializer=_attach_split, initargs=(descriptors, matrix_shape))
+                run = pool.map
+            else:
+                pool = None
+                _attach_split(descriptors, matrix_shape)
+                run = map
+            try:
+                for rung, niter in enumerate(rungs):
+                    results = []
+                    for params, _, score, seconds in run(_fit_and_score, configs, [niter] * len(configs), [CMF_SEARCH_NTHREADS] * len(configs)):
+                        self.logger.info(f"Rung {rung} (niter={niter}) validation MSE for parameters {params}: {score} ({seconds:.1f}s)")
+                        results.append((params, niter, score, seconds))
+                        done += niter
+                        self._report(f"Parameter search, rung {rung + 1}/{len(rungs)}", SEARCH_SHARE * done / total)
+                    results.sort(key=lambda result: result[2])
+                    keep = max(1, len(configs) // CMF_SEARCH_ETA) if rung < len(rungs) - 1 else 1
+                    configs = [params for params, _, _, _ in results[:keep]]
+                    self.best_param, self.best_score = results[0][0], results[0][2]
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+                _split.clear()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        self.logger.info(f"****Best parameters: {self.best_param} with validation MSE: {self.best_score}****")
+
+        if self.best_param is not None:
+            self.logger.info("Refitting best parameters on all ratings")
+            self._report("Refitting the best parameters on all ratings", SEARCH_SHARE)
+            self.best_model = CMF(k=self.best_param['k'], lambda_=self.best_param['lambda_'], niter=CMF_SEARCH_NITER)
+            self.best_model.fit(self.ratings_df)
+            self.best_model.full_trained_at_ = time.time()
+            self._save_model(self.best_model)
             return True
-        
 
+    def _save_model(self, cmf_model, updated_rows=None):
+        """
+        Write the model and its serving artifacts. After an incremental update (updated_rows given) the
+        ANN indexes are refreshed for the changed rows only; the quantized export and the model pickle
+        are linear in the number of rows, and the top-N table is recomputed for every user since the
+        updated item factors change everybody's scores.
+        """
+        self.logger.info("Saving NN models for user and item simmilarities")
+        self._report("Saving nearest neighbour models", 0.9)
+        self._save_kneighbors(cmf_model)
+        self._report("Building ANN indexes", 0.92)
+        self._save_ann_indexes(cmf_model, updated_rows)
+        self._report("Saving quantized factors", 0.94)
+        self._save_quantized_factors(cmf_model)
+        self._save_trained_ratings()
+        # the model file goes last: servers reload when it changes and then find matching NN artifacts
+        self.logger.info("Saving best model configuration in output path")
+        self._report("Saving the model", 0.95)
+        self._atomic_pickle(cmf_model, self._artifact(CMF_MODEL_PATH))
+        self.logger.info(f"Best model saved at {self._artifact(CMF_MODEL_PATH)}")
+        self.logger.info("Precomputing top-N recommendations for all users")
+        self._report("Precomputing top-N recommendations", 0.96)
+        TopNBatch(model=cmf_model).run(path=self._artifact(CMF_TOPN_TABLE), model_path=self._artifact(CMF_MODEL_PATH))
+        self._report("Done", 1.0)
+
+    def _rating_keys(self):
+        # one sortable int64 per (user, movie) pair
+        users = self.ratings_df['UserId'].to_numpy(dtype=np.int64)
+        items = self.ratings_df['ItemId'].to_numpy(dtype=np.int64)
+        return (users << 32) | items
+
+    def _save_trained_ratings(self):
+        keys = self._rating_keys()
+        order = np.argsort(keys, kind='stable')
+        path = self._artifact(CMF_TRAINED_RATINGS)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=keys[order], ratings=self.ratings_df['Rating'].to_numpy(dtype=np.float32)[order])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.logger.info(f"Trained ratings snapshot saved at {path}")
+
+    def _changed_ratings(self):
+        """
+        Mask of the ratings that are new or changed since the current model was trained, compared
+        against its snapshot of trained ratings: event timestamps cannot tell, events logged before a
+        training run may be merged after it. None when there is no snapshot.
+        """
+        if not os.path.exists(CMF_TRAINED_RATINGS):
+            return None
+        with np.load(CMF_TRAINED_RATINGS) as trained:
+            trained_keys, trained_ratings = trained['keys'], trained['ratings']
+        keys = self._rating_keys()
+        if len(trained_keys) == 0:
+            return np.ones(len(keys), dtype=bool)
+        position = np.minimum(np.searchsorted(trained_keys, keys), len(trained_keys) - 1)
+        known = trained_keys[position] == keys
+        same = trained_ratings[position] == self.ratings_df['Rating'].to_numpy(dtype=np.float32)
+        return ~(known & same)
+
+    def _load_current_model(self):
+        if not os.path.exists(CMF_MODEL_PATH):
+            return None
+        with open(CMF_MODEL_PATH, 'rb') as f:
+            return pickle.load(f)
+
+    def incremental_update(self, model=None):
+        """
+        Warm-start the current model with the ratings added since it was trained (see IncrementalCMF).
+        Falls back to the full search when there is no usable model.
+        """
+        model = model if model is not None else self._load_current_model()
+        new = self._changed_ratings() if model is not None else None
+        if new is None or not IncrementalCMF.supports(model):
+            self.logger.warning("No model that can be updated incrementally, running the full search")
+            return self.search_best_param()
+        if not new.any():
+            self.logger.info("No ratings since the last training, the model is up to date")
+            return False
+        self.logger.info(f"Incremental update with {new.sum()} new ratings")
+        self._report(f"Incremental update with {new.sum()} new ratings", 0.1)
+        incremental = IncrementalCMF(model)
+        incremental.update(self.ratings_df['UserId'].values, self.ratings_df['ItemId'].values,
+                           self.ratings_df['Rating'].values,
+                           touched_users=self.ratings_df['UserId'].values[new],
+                           touched_items=self.ratings_df['ItemId'].values[new])
+        self.best_model = model
+        self._save_model(model, updated_rows=(incremental.updated_user_rows, incremental.updated_item_rows))
+        return True
 
+    def train(self, full: bool = False):
+        """Incremental update, or the full search when asked for or when the last one is older than CMF_FULL_RETRAIN_DAYS."""
+        model = None
+        if not full:
+            model = self._load_current_model()
+            full_trained_at = getattr(model, 'full_trained_at_', None) if model is not None else None
+            full = full_trained_at is None or time.time() - full_trained_at > CMF_FULL_RETRAIN_DAYS * 86400
+            if full:
+                self.logger.info(f"Last full retrain is missing or older than {CMF_FULL_RETRAIN_DAYS} days")
+        return self.search_best_param() if full else self.incremental_update(model)
@@ -0,0 +1,143 @@
+import os
+import time
+import pickle
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import numpy as np
+import scipy.sparse as sp
+from logging_custom.logger import Logger
+from utils.id_index import IdIndex
+from utils.ratings_helper import RatingsHelper
+from recommenders.cmf_recommender import CMFRecommender
+from recommenders.topn_table import TopNTable
+
+load_dotenv()
+CMF_MODEL_PATH = os.getenv('CMF_MODEL_PATH', "models/cmfrec_model/cmf_full.pkl")
+CMF_TOPN_TABLE = os.getenv('CMF_TOPN_TABLE', "models/cmfrec_model/cmf_topn.npz")
+CMF_TOPN_SIZE = int(os.getenv('CMF_TOPN_SIZE', 50))
+# memory for the score tiles of all workers together; the tile size follows from it and the catalog size
+CMF_TOPN_MEMORY_MB = int(os.getenv('CMF_TOPN_MEMORY_MB', 512))
+CMF_TOPN_MAX_TILE = 1024
+CMF_TOPN_WORKERS = int(os.getenv('CMF_TOPN_WORKERS', min(os.cpu_count() or 1, 4)))
+
+class TopNBatch:
+    """
+    Scores users against the whole catalog with the CMF factors and keeps the N best unseen
+    movies of each. Users are processed in tiles: one (tile x items) matrix product, seen
+    items masked from a sparse user x item matrix, argpartition for the top-N. Scores are float32
+    and each tile holds a float32 score and an int64 argpartition index per item, so the tile
+    size is chosen to keep all workers' tiles within memory_mb. Tiles run on a thread pool,
+    NumPy releases the GIL inside the matrix products.
+    """
+    def __init__(self, model=None, ratings_df=None, N: int = CMF_TOPN_SIZE, tile_size: int = None,
+                 workers: int = CMF_TOPN_WORKERS, memory_mb: int = CMF_TOPN_MEMORY_MB, factors=None):
+        self.logger = Logger("TopNBatch").get_logger()
+        if model is None:
+            with open(CMF_MODEL_PATH, 'rb') as f:
+                model = pickle.load(f)
+        self.model = model
+        self.ratings_df = ratings_df if ratings_df is not None else RatingsHelper().ratings_df
+        self.N = N
+        self.workers = max(1, workers)
+        # factors: scoring_factors() of the model, e.g. CMFRecommender.serving_factors() of a stripped model
+        factors = CMFRecommender.scoring_factors(model) if factors is None else factors
+        # upcast/downcast once, every tile product then runs in float32
+        self.A = np.ascontiguousarray(factors['A'], dtype=np.float32)
+        # 'A' may hold only some users (serving_factors(user_ids)): position of each model user row in it
+        self.a_positions = None
+        if factors.get('user_rows') is not None:
+            self.a_positions = np.full(len(model.user_mapping_), -1, dtype=np.int64)
+            self.a_positions[factors['user_rows']] = np.arange(len(factors['user_rows']))
+        self.B = np.ascontiguousarray(factors['B'], dtype=np.float32)
+        self.user_bias = (np.asarray(factors['user_bias'], dtype=np.float32) + factors['glob_mean']).astype(np.float32)
+        self.item_bias = np.asarray(factors['item_bias'], dtype=np.float32)
+        self.user_ids = np.asarray(model.user_mapping_, dtype=np.int64)
+        self.item_ids = np.asarray(model.item_mapping_, dtype=np.int64)
+        if tile_size is None:
+            bytes_per_user = max(1, len(self.item_ids)) * (np.float32().itemsize + np.int64().itemsize)
+            tile_size = min(CMF_TOPN_MAX_TILE, max(1, memory_mb * 2 ** 20 // (bytes_per_user * self.workers)))
+        self.tile_size = tile_size
+        self.logger.info(f"Top-N batch ready. Users: {len(self.user_ids)}, items: {len(self.item_ids)}, N: {N}, "
+                         f"tile: {tile_size}, workers: {self.workers}")
+
+    def _seen_matrix(self, rows):
+        """CSR matrix (the given model user rows x model item columns) of rated movies."""
+        # only the ratings of the requested users get converted to item columns
+        positions = IdIndex(self.user_ids[rows]).rows(self.ratings_df['userId'].to_numpy())
+        wanted = positions >= 0
+        item_cols = IdIndex(self.item_ids).rows(self.ratings_df['movieId'].to_numpy()[wanted])
+        positions = positions[wanted]
+        known = item_cols >= 0
+        data = np.ones(int(known.sum()), dtype=bool)
+        return sp.csr_matrix((data, (positions[known], item_cols[known])), shape=(len(rows), len(self.item_ids)))
+
+    def _score_tile(self, tile):
+        rows, seen = tile
+        scores = self.A[rows if self.a_positions is None else self.a_positions[rows]] @ self.B.T
+        scores += self.item_bias
+        scores += self.user_bias[rows][:, None]
+        # negated in place so that argpartition needs no second copy; seen items go last
+        scores *= -1
+        scores[np.repeat(np.arange(len(rows)), np.diff(seen.indptr)), seen.indices] = np.inf
+        n = min(self.N, scores.shape[1])
+        top = np.argpartition(scores, n - 1, axis=1)[:, :n] if n < scores.shape[1] else np.tile(np.arange(n), (len(rows), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = -np.take_along_axis(top_scores, order, axis=1)
+        items = np.full((len(rows), self.N), -1, dtype=np.int32)
+        scores_out = np.full((len(rows), self.N), np.nan, dtype=np.float32)
+        valid = np.isfinite(top_scores)
+        items[:, :n] = np.where(valid, self.item_ids[top], -1)
+        scores_out[:, :n] = np.where(valid, top_scores, np.nan)
+        return items, scores_out
+
+    def compute(self, rows=None):
+        """(items, scores) for the given model user rows (all users by default)."""
+        rows = np.arange(len(self.user_ids)) if rows is None else np.asarray(rows, dtype=np.int64)
+        start = time.perf_counter()
+        seen = self._seen_matrix(rows)
+        tiles = [(rows[i:i + self.tile_size], seen[i:i + self.tile_size]) for i in range(0, len(rows), self.tile_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._score_tile, tiles))
+        items = np.vstack([r[0] for r in results]) if results else np.empty((0, self.N), dtype=np.int32)
+        scores = np.vstack([r[1] for r in results]) if results else np.empty((0, self.N), dtype=np.float32)
+        self.logger.info(f"Scored {len(rows)} users in {len(tiles)} tiles in {time.perf_counter() - start:.2f}s")
+        return items, scores
+
+    def run(self, path: str = CMF_TOPN_TABLE, user_ids=None, model_path: str = CMF_MODEL_PATH):
+        """
+        Write the top-N table. With user_ids, only those users are recomputed and merged into
+        the existing table, provided it was built from the same model with the same N.
+        """
+        signature = TopNTable.model_file_signature(model_path) if model_path and os.path.exists(model_path) else None
+        existing = TopNTable.load(path) if user_ids is not None else None
+        if existing is not None and existing.model_signature == signature and existing.N == self.N \
+                and np.array_equal(existing.user_ids, self.user_ids):
+            rows = IdIndex(self.user_ids).rows(np.unique(np.asarray(user_ids, dtype=np.int64)))
+            rows = rows[rows >= 0]
+            self.logger.info(f"Refreshing top-N of {len(rows)} users")
+            items, scores = existing.items.copy(), existing.scores.copy()
+            items[rows], scores[rows] = self.compute(rows)
+        else:
+            if user_ids is not None:
+                self.logger.info("No top-N table for the current model, computing all users")
+            if self.a_positions is not None:
+                self.logger.warning("Factors of only some users were given, cannot compute all users")
+                return None
+            items, scores = self.compute()
+        table = TopNTable(self.user_ids, items, scores, signature)
+        table.save(path)
+        return table
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute CMF top-N recommendations for all users.")
+    parser.add_argument("--users", type=int, nargs='*', default=None, help="only refresh these userIds")
+    parser.add_argument("--n", type=int, default=CMF_TOPN_SIZE)
+    parser.add_argument("--workers", type=int, default=CMF_TOPN_WORKERS)
+    args = parser.parse_args()
+    TopNBatch(N=args.n, workers=args.workers).run(user_ids=args.users)
+
+if __name__ == "__main__":
+    main()
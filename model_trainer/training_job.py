@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import subprocess
+from dotenv import load_dotenv
+from logging_custom.logger import Logger
+from model_trainer.cmf_trainer import CMFTrainer
+
+try:
+    import fcntl
+except ImportError:  # windows: no advisory locks, concurrent starts are not serialized
+    fcntl = None
+
+load_dotenv()
+CMF_MODEL_DIR = os.getenv('CMF_MODEL_DIR', "models/cmfrec_model")
+# every training run writes a new version here; CMF_MODEL_DIR is a symlink to the published one
+CMF_MODEL_VERSIONS = os.getenv('CMF_MODEL_VERSIONS', "models/cmfrec_versions")
+CMF_KEEP_VERSIONS = int(os.getenv('CMF_KEEP_VERSIONS', 3))
+TRAINING_JOBS_DIR = os.getenv('TRAINING_JOBS_DIR', "models/training_jobs")
+# held by the running job process for its whole lifetime, and holds its job_id
+TRAINING_LOCK = os.path.join(TRAINING_JOBS_DIR, "training.lock")
+
+ACTIVE_STATES = ('queued', 'running')
+
+class TrainingJob:
+    """
+    CMF training in a detached process. The job writes its state, stage, progress and ETA
+    to TRAINING_JOBS_DIR/<job_id>.json; the trainer writes all artifacts into a new version
+    directory, which is published by atomically replacing the CMF_MODEL_DIR symlink. Servers
+    keep answering from the old files until the swap and reload on their next registry check.
+    Only one job trains at a time: the job process inherits an exclusive flock on TRAINING_LOCK
+    from the start() that spawned it and holds it until it exits, so the lock also tells
+    whether the job is alive.
+    """
+    def __init__(self, job_id: str):
+        self.logger = Logger("TrainingJob").get_logger()
+        self.job_id = job_id
+        self.status_path = os.path.join(TRAINING_JOBS_DIR, f"{job_id}.json")
+        self.version_dir = os.path.join(CMF_MODEL_VERSIONS, job_id)
+
+    @staticmethod
+    def _lock():
+        """fd of TRAINING_LOCK with an exclusive lock, or None if a job holds it."""
+        os.makedirs(TRAINING_JOBS_DIR, exist_ok=True)
+        fd = os.open(TRAINING_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+        return fd
+
+    @classmethod
+    def holder(cls):
+        """job_id of the job holding the training lock, None if no job is running."""
+        fd = cls._lock()
+        if fd is not None:
+            # closing the fd releases the lock again
+            os.close(fd)
+            return None
+        try:
+            with open(TRAINING_LOCK) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    @classmethod
+    def start(cls, full: bool = False):
+        """Launch a training job, or return the one already running: only one job trains at a time."""
+        fd = cls._lock()
+        if fd is None:
+            running = cls.running() or cls.latest()
+            running.logger.info(f"Training job {running.job_id} is already running")
+            return running
+        try:
+            job = cls(f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+            os.ftruncate(fd, 0)
+            os.write(fd, job.job_id.encode())
+            log_path = os.path.join(TRAINING_JOBS_DIR, f"{job.job_id}.log")
+            job._write(state='queued', mode='full' if full else 'auto', stage="Waiting to start", progress=0.0,
+                       created_at=time.time(), log=log_path)
+            command = [sys.executable, "-m", "model_trainer.training_job", "--job-id", job.job_id] + (["--full"] if full else [])
+            with open(log_path, 'ab') as log:
+                # own session: the job survives the Streamlit script run (and server restarts) that started it.
+                # It inherits the locked fd and keeps the lock until it exits.
+                process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                           start_new_session=True, pass_fds=(fd,) if fcntl else ())
+            job._write(pid=process.pid)
+        finally:
+            os.close(fd)
+        job.logger.info(f"Started training job {job.job_id} (pid {process.pid})")
+        return job
+
+    @classmethod
+    def latest(cls):
+        if not os.path.isdir(TRAINING_JOBS_DIR):
+            return None
+        job_ids = sorted(name[:-len(".json")] for name in os.listdir(TRAINING_JOBS_DIR) if name.endswith(".json"))
+        return cls(job_ids[-1]) if job_ids else None
+
+    @classmethod
+    def running(cls):
+        job_id = cls.holder()
+        return cls(job_id) if job_id is not None else None
+
+    def status(self) -> dict:
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def alive(self) -> bool:
+        pid = self.status().get('pid')
+        if pid is not None:
+            try:
+                # reap the job if this process started it, it would stay a zombie otherwise
+                os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+        if fcntl is None:
+            return True
+        return self.holder() == self.job_id
+
+    def _write(self, **fields):
+        status = self.status()
+        status.update(fields, job_id=self.job_id, updated_at=time.time())
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self.status_path)
+
+    def _progress(self, stage, fraction):
+        status = self.status()
+        started_at = status.get('started_at', time.time())
+        elapsed = time.time() - started_at
+        eta = elapsed / fraction * (1 - fraction) if fraction > 0 else None
+        self._write(stage=stage, progress=round(fraction, 4), eta_seconds=eta)
+
+    def _carry_over(self):
+        """Files of the published version that this run did not write (e.g. added by hand) stay available."""
+        if not os.path.isdir(CMF_MODEL_DIR):
+            return
+        for name in os.listdir(CMF_MODEL_DIR):
+            source, target = os.path.join(CMF_MODEL_DIR, name), os.path.join(self.version_dir, name)
+            if not os.path.exists(target):
+                if os.path.isdir(source):
+                    shutil.copytree(source, target)
+                else:
+                    shutil.copy2(source, target)
+
+    @staticmethod
+    def migrate():
+        """
+        Turn a plain CMF_MODEL_DIR directory into a symlink to a version of its own. The path is
+        missing between the rename and the symlink, so this runs once per server process before
+        anything is loaded from it (get_model_registry); publishing then only ever swaps links.
+        """
+        live = os.path.normpath(CMF_MODEL_DIR)
+        if os.path.islink(live) or not os.path.isdir(live):
+            return
+        os.makedirs(CMF_MODEL_VERSIONS, exist_ok=True)
+        version_dir = os.path.join(CMF_MODEL_VERSIONS, f"unversioned-{time.strftime('%Y%m%d-%H%M%S')}")
+        try:
+            os.rename(live, version_dir)
+        except FileNotFoundError:
+            # another server process migrated it first
+            return
+        os.symlink(os.path.relpath(version_dir, os.path.dirname(live) or "."), live)
+        Logger("TrainingJob").get_logger().info(f"Moved {live} to {version_dir} and linked it")
+
+    def _publish(self):
+        live = os.path.normpath(CMF_MODEL_DIR)
+        # no-op once the servers have migrated; only a trainer run without a server still has the plain directory
+        self.migrate()
+        tmp_link = f"{live}.tmp-{os.getpid()}"
+        os.symlink(os.path.relpath(self.version_dir, os.path.dirname(live) or "."), tmp_link)
+        # rename over the old link: readers see either the old version or the new one, never a mix
+        os.replace(tmp_link, live)
+        self.logger.info(f"Published {self.version_dir} as {live}")
+
+    def _prune(self):
+        live_target = os.path.realpath(CMF_MODEL_DIR)
+        versions = [os.path.join(CMF_MODEL_VERSIONS, name) for name in os.listdir(CMF_MODEL_VERSIONS)]
+        versions = sorted((path for path in versions if os.path.isdir(path)), key=os.path.getmtime, reverse=True)
+        # old versions may still be memory-mapped by servers that have not reloaded yet; keep a few
+        for path in versions[CMF_KEEP_VERSIONS:]:
+            if os.path.realpath(path) != live_target:
+                shutil.rmtree(path, ignore_errors=True)
+                self.logger.info(f"Removed old model version {path}")
+
+    def run(self, full: bool = False):
+        self._write(state='running', pid=os.getpid(), started_at=time.time(), stage="Loading ratings", progress=0.0)
+        try:
+            os.makedirs(self.version_dir, exist_ok=True)
+            trainer = CMFTrainer(output_dir=self.version_dir, progress=self._progress)
+            if trainer.train(full=full):
+                self._carry_over()
+                self._publish()
+                self._prune()
+                self._write(state='succeeded', stage="Published", progress=1.0, eta_seconds=0.0,
+                            version=self.version_dir, finished_at=time.time())
+            else:
+                shutil.rmtree(self.version_dir, ignore_errors=True)
+                self._write(state='unchanged', stage="No new ratings since the last training", progress=1.0,
+                            eta_seconds=0.0, finished_at=time.time())
+        except Exception as e:
+            self.logger.error(f"Training job {self.job_id} failed: {e}", exc_info=True)
+            shutil.rmtree(self.version_dir, ignore_errors=True)
+            self._write(state='failed', error=str(e), finished_at=time.time())
+            raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a CMF training job (started by TrainingJob.start).")
+    parser.add_argument("--job-id", required=True)
+    parser.add_argument("--full", action='store_true', help="full parameter search instead of an incremental update")
+    args = parser.parse_args()
+    TrainingJob(args.job_id).run(full=args.full)
+
+if __name__ == "__main__":
+    main()
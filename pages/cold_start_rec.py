@@ -1,4 +1,3 @@
-import os
 from dotenv import load_dotenv
 from datetime import datetime
 import streamlit as st
@@ -6,7 +5,9 @@ import pandas as pd
 from logging_custom.logger import Logger
 from utils import links_helper, user_helper, movie_helper
 from utils.get_poster import get_image, get_random_image
+from utils.rating_log import get_rating_log
 from recommenders.cold_start import ColdStartRecommender
+from recommenders.model_registry import get_cmf_recommender
 
 movie_helper = movie_helper.MovieHelper()
 links_helper = links_helper.LinksHelper()
@@ -14,7 +15,6 @@ user_helper = user_helper.UserHelper()
 cold_start = ColdStartRecommender(movie_helper)
 
 load_dotenv()
-NEW_RATINGS_DATA = os.getenv("NEW_RATINGS_DATA")
 
 logger = Logger("Cold_Start_rec").get_logger()
 
@@ -36,7 +36,11 @@ def predict_recommendation(user_data, model_option):
     try:
         if model_option == 'User Genre Similarity Based':
             recommendation, user_vector = cold_start.recommend_from_liked(user_data['movieId'], top_n=8, threshold=0.8)
-            recommendation = [(mid, links_helper.get_imdb_id(mid)) for mid in recommendation]
+            recommendation = list(zip(recommendation, links_helper.imdb_ids_for(recommendation)))
+        elif model_option == 'CMF Recommender (fold-in)':
+            # user factors solved from these ratings against the trained movie factors
+            recommendation = get_cmf_recommender().topN_fold_in(int(userId), user_data['movieId'], user_data['rating'], N=20)
+            user_vector = cold_start.get_user_preference_vector(user_data['movieId'], user_data['rating'])
         else:
             recommendation = cold_start.xgb_cold_start(pd.DataFrame(user_data))
             user_vector = cold_start.get_user_preference_vector(user_data['movieId'], user_data['rating'])
@@ -47,7 +51,7 @@ def predict_recommendation(user_data, model_option):
         raise e
 
 with st.sidebar:
-    model_option = st.selectbox("Choose Recommendation Model", ("XGBoost Recommender", "User Genre Similarity Based"))
+    model_option = st.selectbox("Choose Recommendation Model", ("XGBoost Recommender", "CMF Recommender (fold-in)", "User Genre Similarity Based"))
 # prediction as per model chosen
 recommendation, user_vector = predict_recommendation(new_ratings, model_option)
 
@@ -56,10 +60,8 @@ col_1, col_2 = st.columns([4, 1])
 with col_2:
     st.write("To update your ratings and get model predictions, go to Home and **Update Model**")
     if st.button("Home", key="home"):
-        # update new ratings csv
-        df_new_ratings = pd.read_csv(NEW_RATINGS_DATA)
-        df_new_ratings = pd.concat([df_new_ratings, pd.DataFrame(new_ratings)], ignore_index=True)
-        df_new_ratings.to_csv(NEW_RATINGS_DATA, index=False)
+        # append new ratings to the ratings event log
+        get_rating_log().append_many(new_ratings)
         logger.info(f"New ratings data updated")
 
         # Clear session state variables
@@ -74,12 +76,13 @@ with col_2:
 with col_1:
     st.subheader(f"Movies similar to user {userId}'s preference:: **{model_option}**")
 
+    movie_titles = movie_helper.titles_for([movieId for movieId, _ in recommendation[:20]])
     for i, (movieId, imdb_id) in enumerate(recommendation[:20]):
         if i % 4 == 0:
             cols = st.columns(4)
 
         with cols[i % 4]:
-            movie_title = movie_helper.movies_df[movie_helper.movies_df['movieId'] == movieId]['title'].values[0]
+            movie_title = movie_titles[i]
             # st.image(get_random_image(location="H:/mobile_backup/Download"), width=150, caption=f"**{movie_title}** (Movie ID: {movieId})")
             st.image("content/poster-placeholder.webp", width=150, caption=f"**{movie_title}** ({movieId})")
             # if st.button(":star: Like", key=f"like{movieId}"):
@@ -39,6 +39,8 @@ def predict_recommendations(userId, model_option, N=10):
         preds = prediction.predict_xgboost(int(userId), N=N)
     elif model_option == "CMF Recommender":
         preds = prediction.predict_cmf_topN(int(userId), N=N)
+    elif model_option == "Hybrid (CMF + XGBoost)":
+        preds = prediction.predict_hybrid(int(userId), N=N)
     elif model_option == "User Similarity Based":
         preds = prediction.cmf_similar_users_optimized(int(userId))[:N]
     else:
@@ -46,11 +48,13 @@ def predict_recommendations(userId, model_option, N=10):
         raise ValueError(f"Model option {model_option} not recognized.")
     # get imdb ids
     logger.info("Fetching IMDb IDs for recommended movies.")
-    preds = [(movieId, score, links_helper.get_imdb_id(movieId)) for movieId, score in preds]
+    imdb_ids = links_helper.imdb_ids_for([movieId for movieId, _ in preds])
+    preds = [(movieId, score, imdb_id) for (movieId, score), imdb_id in zip(preds, imdb_ids)]
     return preds
 # Search movies
-def search_movies(search_query):
-    return movie_helper.movies_df[movie_helper.movies_df['title'].str.contains(search_query, case=False, na=False)]
+def search_movies(search_query, k=20):
+    movie_ids = movie_helper.search_titles(search_query, k=k)
+    return list(zip(movie_ids, movie_helper.titles_for(movie_ids)))
 
 col1, col2 = st.columns([4, 1])
 with col2:
@@ -59,7 +63,7 @@ with col2:
     # user profile
     st.write("User Profile")
     # get ratings data for user
-    user_profile = ratings_helper.ratings_df[ratings_helper.ratings_df['userId'] == int(userId)][['movieId', 'rating']]
+    user_profile = ratings_helper.get_user_ratings(int(userId))
     # seperate movie and ratings
     likes_ids = user_profile['movieId'].values.tolist()
     ratings = user_profile['rating'].values.tolist()
@@ -78,13 +82,15 @@ with st.sidebar:
     search = st.text_input("Search movies", key='search_movies', placeholder='Avengers...')
     if search:
         results = search_movies(search)
-        for _, row in results.iterrows():
-            if st.button(row['title'], key=f"search_{row['movieId']}"):
-                st.session_state['movieId'] = int(row['movieId'])
-                st.session_state['imdb'] = links_helper.get_imdb_id(row['movieId'])
+        for movieId, title in results:
+            if st.button(title, key=f"search_{movieId}"):
+                st.session_state['movieId'] = int(movieId)
+                st.session_state['imdb'] = links_helper.get_imdb_id(movieId)
                 st.switch_page('pages/movie_page.py')
     st.title("Settings :gear:")
-    model_option = st.selectbox("Choose Recommendation Model", ("CMF Recommender", "XGBoost Recommender", "User Similarity Based"))
+    model_option = st.selectbox("Choose Recommendation Model", ("CMF Recommender", "XGBoost Recommender", "Hybrid (CMF + XGBoost)", "User Similarity Based"))
+    with st.expander("Recommendation cache"):
+        st.json(prediction.result_cache.stats())
 
 with col1:
     st.image("https://streamlit.io/images/brand/streamlit-mark-color.png", width=100)
@@ -96,15 +102,17 @@ with col1:
     try:
         recommendations = predict_recommendations(userId, model_option, N=10)
         st.subheader("Top Movie Recommendations for You:")
+        movie_titles = movie_helper.titles_for([movieId for movieId, _, _ in recommendations])
 
         for i, (movieId, score, imdb) in enumerate(recommendations):
             if i % 5 == 0:
                 cols = st.columns(5)
 
             with cols[i % 5]:
-                movie_title = movie_helper.movies_df[movie_helper.movies_df['movieId'] == movieId]['title'].values[0]
+                movie_title = movie_titles[i]
+                score_text = "not scored" if np.isnan(score) else f"{score:.2f}"
                 # st.write(f"**{movie_title}** (Movie ID: {movieId}) - Predicted Score: {score:.2f}")
-                st.image(get_image(imdb, movieId, links_helper), width=150, caption=f"**{movie_title}** (Movie ID: {movieId}) - Predicted Score: {score:.2f}")
+                st.image(get_image(imdb, movieId, links_helper), width=150, caption=f"**{movie_title}** (Movie ID: {movieId}) - Predicted Score: {score_text}")
                 # st.badge(movie_title)
                 if st.button(f"View Details", key=f"details_{movieId}"):
                     st.session_state['logged_in'] = True
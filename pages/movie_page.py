@@ -1,12 +1,12 @@
-import os
 from dotenv import load_dotenv
 from datetime import datetime
 from collections import defaultdict
-import pandas as pd
 import streamlit as st
 from utils.get_poster import get_image, get_description
 from utils import links_helper, movie_helper, ratings_helper, user_helper
+from utils.rating_log import get_rating_log
 from recommenders.prediction import Prediction
+from recommenders.result_cache import get_result_cache
 
 from logging_custom.logger import Logger
 
@@ -57,21 +57,12 @@ def on_rating_change():
     # save directly in dataset
     if rating is not None and movieId is not None and userId is not None:
         ts = datetime.timestamp(datetime.now())
-        ratings_path = "datasets/ml-latest/new_ratings.csv"
-        new_row = {
-            'userId': userId,
-            'movieId': movieId,
-            'rating': rating,
-            'timestamp': int(ts)
-        }
         try:
-            if os.path.exists(ratings_path):
-                df = pd.read_csv(ratings_path)
-                df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            else:
-                df = pd.DataFrame([new_row])
-            df.to_csv(ratings_path, index=False)
-            logger.info(f"Saved new rating to {ratings_path}")
+            get_rating_log().append(userId, movieId, rating, int(ts))
+            logger.info(f"Saved new rating to {get_rating_log().file_path}")
+            # recommendations computed before this rating are stale
+            get_result_cache().invalidate_user(userId)
+            return True
         except Exception as e:
             logger.error(f"Error saving rating: {e}")
             st.error("Failed to save rating.")
@@ -104,9 +95,9 @@ with col1:
 
     with col1_2:
         st.write(f"Movie ID: {movieId}")
-        st.write(f"{movie_helper.movies_df[movie_helper.movies_df['movieId'] == movieId]['title'].values[0]}")
+        st.write(f"{movie_helper.get_title(movieId)}")
         st.text(get_description(imdb))
-        st.write(f"Genres: {movie_helper.movies_df[movie_helper.movies_df['movieId'] == movieId]['genres'].values[0]}")
+        st.write(f"Genres: {movie_helper.get_genres(movieId)}")
         
         # st.selectbox("Rate this movie", options=[1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0], key="rating_input", on_change=on_rating_change)
         cols = st.columns(4)
@@ -137,26 +128,29 @@ with col1:
         # user rating
         with cols[1]:
             try:
-                user_rating = ratings_helper.ratings_df[(ratings_helper.ratings_df['userId'] == int(userId)) & (ratings_helper.ratings_df['movieId'] == int(movieId))]['rating'].values[0]
+                user_rating = ratings_helper.get_user_movie_rating(int(userId), int(movieId))
             except Exception as e:
                 user_rating = "You haven't rated this movie yet."
             st.write(f"**Your Rating: {user_rating}**")
         # average rating
         with cols[2]:
-            st.write(f"**Average Rating: {ratings_helper.ratings_df[ratings_helper.ratings_df['movieId'] == int(movieId)]['rating'].mean()}**")
+            st.write(f"**Average Rating: {ratings_helper.get_movie_avg_rating(int(movieId))}**")
 
     st.subheader("Movies similar to this one:")
     try:
         similar_movies = get_similar_movies_cached(movieId)
         logger.info(f"Number of similar movies found: {len(similar_movies)}")
-        similar_movies = [(movieId, similarity, links_helper.get_imdb_id(movieId)) for movieId, similarity in similar_movies]
+        similar_movies = similar_movies[:10]
+        imdb_ids = links_helper.imdb_ids_for([movieId for movieId, _ in similar_movies])
+        movie_titles = movie_helper.titles_for([movieId for movieId, _ in similar_movies])
+        similar_movies = [(movieId, similarity, imdb_id) for (movieId, similarity), imdb_id in zip(similar_movies, imdb_ids)]
 
-        for i, (movieId, similarity, imdb_id) in enumerate(similar_movies[:10]):
+        for i, (movieId, similarity, imdb_id) in enumerate(similar_movies):
             if i % 5 == 0:
                 cols = st.columns(5)
 
             with cols[i % 5]:
-                movie_title = movie_helper.movies_df[movie_helper.movies_df['movieId'] == movieId]['title'].values[0]
+                movie_title = movie_titles[i]
                 st.image(get_image(imdb_id, movieId, links_helper), width=150, caption=f"**{movie_title}** (Movie ID: {movieId}) - Similarity: {similarity:.2f}")
                 # st.badge(movie_title)
                 # movie to show
@@ -61,6 +61,7 @@ with col_1:
         st.subheader("Please like at least 3 movies to get recommendations :heart:")
         rand_state = st.session_state.get('random_state', 42)
         random_movies = movie_helper.get_random_movies(40, rand_state)
+        random_movies['imdb'] = links_helper.imdb_ids_for(random_movies['movieId'].values)
         userId = st.session_state['userId']
 
         for i, (_, row) in enumerate(random_movies.iterrows()):
@@ -69,7 +70,7 @@ with col_1:
 
             with cols[i % 4]:
                 movie_id, movie_title = row['movieId'], row['title']
-                imdb_id = links_helper.get_imdb_id(movie_id)
+                imdb_id = row['imdb']
                 # st.image(get_image(imdb_id, movie_id, links_helper), width=150, caption=f"**{movie_title}** (Movie ID: {movie_id})")
                 # st.image(get_random_image("H:/mobile_backup/Download"), width=150, caption=f"**{movie_title}** (Movie ID: {movie_id})")
                 st.image("content/poster-placeholder.webp", width=150, caption=f"**{movie_title}** ({movie_id})")
@@ -35,7 +35,7 @@ with col1:
     st.write("Top 5 Genres as per your ratings:")
     try:
         # get ratings data for user
-        user_profile = ratings_helper.ratings_df[ratings_helper.ratings_df['userId'] == int(userId)][['movieId', 'rating']]
+        user_profile = ratings_helper.get_user_ratings(int(userId))
         # seperate movie and ratings
         likes_ids = user_profile['movieId'].values.tolist()
         ratings = user_profile['rating'].values.tolist()
@@ -60,7 +60,8 @@ with col1:
         # top rated movies
         user_profile_top_10 = user_profile.sort_values(by='rating', ascending=False).head(10).reset_index(drop=True)
         # get imdb ids of the movies
-        user_profile_top_10['imdbId'] = [links_helper.get_imdb_id(movieId) for movieId in user_profile_top_10['movieId'].values]
+        user_profile_top_10['imdbId'] = links_helper.imdb_ids_for(user_profile_top_10['movieId'].values)
+        user_profile_top_10['title'] = movie_helper.titles_for(user_profile_top_10['movieId'].values)
         st.write("Top 10 movies rated by you")
         for j, row in user_profile_top_10.iterrows():
             if j % 5 == 0:
@@ -68,7 +69,7 @@ with col1:
             
             with cols_j[j % 5]:
                 # get movies title
-                movie_title = movie_helper.movies_df[movie_helper.movies_df['movieId'] == row['movieId']]['title'].values[0]
+                movie_title = row['title']
                 # show movie
                 st.image(get_image(row['imdbId'], row['movieId'], links_helper), width=150, caption=f"**{movie_title}** (Movie ID: {row['movieId']}) - Your Rating: {row['rating']:.2f}")
                 # view movie details
@@ -82,14 +83,15 @@ with col1:
             # See all movies rated by user
             user_profile_rest = user_profile.sort_values(by='rating', ascending=False).reset_index(drop=True)
             user_profile_rest = user_profile_rest.loc[10:]
-            user_profile_rest['imdbId'] = [links_helper.get_imdb_id(movieId) for movieId in user_profile_rest['movieId'].values]
+            user_profile_rest['imdbId'] = links_helper.imdb_ids_for(user_profile_rest['movieId'].values)
+            user_profile_rest['title'] = movie_helper.titles_for(user_profile_rest['movieId'].values)
             for j, row in user_profile_rest.iterrows():
                 if j % 5 == 0:
                     cols_j = st.columns(5)
                 
                 with cols_j[j % 5]:
                     # get movies title
-                    movie_title = movie_helper.movies_df[movie_helper.movies_df['movieId'] == row['movieId']]['title'].values[0]
+                    movie_title = row['title']
                     # show movie
                     st.image("content/poster-placeholder.webp", width=150, caption=f"**{movie_title}** (Movie ID: {row['movieId']}) - Your Rating: {row['rating']:.2f}")
                     # view movie details
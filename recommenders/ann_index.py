@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import numpy as np
+from logging_custom.logger import Logger
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest neighbour index for cosine similarity, pure NumPy.
+    Rows are normalized and clustered with spherical k-means; each row is stored in the list
+    of its closest centroid. A query scans only the nprobe closest lists, so n_lists and
+    nprobe trade recall for latency. Arrays are saved as .npy files and loaded memory-mapped.
+    """
+    FILES = ('centroids', 'vectors', 'rows', 'offsets')
+
+    def __init__(self, centroids, vectors, rows, offsets, nprobe: int = 8):
+        self.logger = Logger("IVFIndex").get_logger()
+        self.centroids = centroids
+        self.vectors = vectors
+        self.rows = rows
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @staticmethod
+    def _normalize(X):
+        X = np.asarray(X, dtype=np.float32)
+        norms = np.linalg.norm(X, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return X / norms
+
+    @staticmethod
+    def _assign(X, centroids, block_size=65536):
+        return np.concatenate([np.argmax(X[i:i + block_size] @ centroids.T, axis=1)
+                               for i in range(0, len(X), block_size)]) if len(X) else np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def build(cls, factors, n_lists: int = None, n_iter: int = 10, sample_size: int = 50000,
+              nprobe: int = 8, seed: int = 42):
+        logger = Logger("IVFIndex").get_logger()
+        start = time.perf_counter()
+        X = cls._normalize(factors)
+        n = len(X)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = X[rng.choice(n, size=min(n, sample_size), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)].copy()
+        # spherical k-means on a sample
+        for _ in range(n_iter):
+            assign = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=len(centroids)) == 0
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = cls._normalize(sums)
+        assign = cls._assign(X, centroids)
+        rows = np.argsort(assign, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        logger.info(f"IVF index built for {n} rows, {len(centroids)} lists in {time.perf_counter() - start:.2f}s")
+        return cls(centroids, X[rows], rows.astype(np.int64), offsets, nprobe=nprobe)
+
+    def refresh(self, factors, changed_rows):
+        """
+        Index of factors that differ from the indexed ones only in changed_rows and in rows appended
+        after them (an incremental model update): those rows are assigned to the existing centroids,
+        every other row keeps its list. Centroids are only re-fitted by build().
+        """
+        start = time.perf_counter()
+        X = self._normalize(factors)
+        centroids = np.array(self.centroids)
+        assign = np.empty(len(X), dtype=np.int64)
+        assign[np.asarray(self.rows)] = np.repeat(np.arange(len(centroids)), np.diff(self.offsets))
+        changed = np.union1d(np.asarray(changed_rows, dtype=np.int64), np.arange(len(self.rows), len(X)))
+        assign[changed] = self._assign(X[changed], centroids)
+        rows = np.argsort(assign, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        self.logger.info(f"IVF index refreshed for {len(changed)} of {len(X)} rows in {time.perf_counter() - start:.2f}s")
+        return IVFIndex(centroids, X[rows], rows.astype(np.int64), offsets, nprobe=self.nprobe)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        # files are replaced, never rewritten in place: servers may have the old ones memory-mapped
+        for name in self.FILES:
+            path = os.path.join(directory, f"{name}.npy")
+            with open(f"{path}.tmp", 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(f"{path}.tmp", path)
+        meta_path = os.path.join(directory, "meta.json")
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump({'n_rows': int(len(self.rows)), 'n_lists': int(len(self.centroids)), 'nprobe': self.nprobe}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self.logger.info(f"IVF index saved to {directory}")
+
+    @classmethod
+    def load(cls, directory: str, nprobe: int = None, mmap: bool = True):
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None) for name in cls.FILES}
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(nprobe=nprobe or meta['nprobe'], **arrays)
+
+    def search(self, query, k: int = 20, nprobe: int = None):
+        """Return (rows, similarities) of the k nearest rows to query, best first."""
+        q = self._normalize(query).reshape(-1)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_sims = self.centroids @ q
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probe])
+        sims = self.vectors[candidates] @ q
+        k = min(k, len(candidates))
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        top = top[np.argsort(-sims[top], kind='stable')]
+        return np.asarray(self.rows[candidates[top]]), sims[top]
+
+    def kneighbors(self, X, n_neighbors: int = 20, nprobe: int = None):
+        """Same output as sklearn NearestNeighbors(metric='cosine').kneighbors: (distances, indices)."""
+        results = [self.search(query, n_neighbors, nprobe) for query in np.atleast_2d(X)]
+        # lists may hold fewer rows than requested when nprobe is small
+        width = min(len(rows) for rows, _ in results)
+        distances = np.array([1 - sims[:width] for _, sims in results], dtype=np.float32)
+        indices = np.array([rows[:width] for rows, _ in results], dtype=np.int64)
+        return distances, indices
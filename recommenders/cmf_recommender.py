@@ -1,26 +1,51 @@
 import os
 from dotenv import load_dotenv
+import copy
+import time
 import pickle
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import OrderedDict
 from logging_custom.logger import Logger
-import streamlit as st
+from recommenders.similarity import SimilarityEngine
+from recommenders.ann_index import IVFIndex
+from recommenders.quantized_factors import QuantizedFactors
+from utils.id_index import IdIndex
 
 load_dotenv()
 
 MODEL_PATH = os.getenv("CMF_MODEL_PATH")
 CMF_USER_KNN = os.getenv("CMF_USER_KNN")
 CMF_ITEM_KNN = os.getenv("CMF_ITEM_KNN")
+CMF_USER_ANN = os.getenv("CMF_USER_ANN", "models/cmfrec_model/cmf_user_ann")
+CMF_ITEM_ANN = os.getenv("CMF_ITEM_ANN", "models/cmfrec_model/cmf_item_ann")
+CMF_ANN_NPROBE = int(os.getenv("CMF_ANN_NPROBE", 8))
+# folded-in users kept per model
+CMF_FOLD_IN_CACHE = int(os.getenv("CMF_FOLD_IN_CACHE", 10000))
+# "float64" serves from the pickled model; "int8" serves scoring, similarity and KNN queries from the
+# quantized export and loads the model pickle without its factor matrices (stripped_model.pkl of the export)
+CMF_FACTOR_PRECISION = os.getenv("CMF_FACTOR_PRECISION", "float64")
+CMF_QUANTIZED_FACTORS = os.getenv("CMF_QUANTIZED_FACTORS", "models/cmfrec_model/cmf_factors")
 
 class CMFRecommender:
     def __init__(self):
         self.logger = Logger("CMFRecommender").get_logger()
-        self.model = self.load_model()
+        self.quantized, self.model = self.load_serving_model(CMF_FACTOR_PRECISION)
         self.similarity_threshold = 0.5
+        # derived structures are built lazily and live as long as this model
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+        # userId -> (ratings signature, factor, bias) of users folded into the model
+        self._folded = OrderedDict()
+        # ANN indexes are opened with the model so both always come from the same training run
+        self.user_ann = self.load_ann_index(CMF_USER_ANN)
+        self.item_ann = self.load_ann_index(CMF_ITEM_ANN)
+        # brute-force KNN models are only needed when there is no ANN index
+        self.user_knn = self.load_kneighbors(CMF_USER_KNN, 'user') if self.user_ann is None else None
+        self.item_knn = self.load_kneighbors(CMF_ITEM_KNN, 'item') if self.item_ann is None else None
         self.logger.info("CMF Recommender initialized.")
 
     @staticmethod
-    @st.cache_data
     def load_model():
         if MODEL_PATH and os.path.exists(MODEL_PATH):
             # self.logger.info(f"Loading CMF model from {MODEL_PATH}")
@@ -31,10 +56,78 @@ class CMFRecommender:
             # self.logger.error(f"Model path {MODEL_PATH} does not exist.")
             raise FileNotFoundError(f"Model path {MODEL_PATH} does not exist.")
     
+    @staticmethod
+    def scoring_factors(model):
+        """
+        Terms of the CMF prediction glob_mean_ + user_bias_ + item_bias_ + A_ . B_ for the
+        rating matrix only (side-information columns of A_/B_ are dropped). Missing biases are zeros.
+        """
+        k_user, k_item = getattr(model, 'k_user', 0) or 0, getattr(model, 'k_item', 0) or 0
+        A = np.asarray(model.A_)[:, k_user:]
+        B = np.asarray(model.B_)[:, k_item:]
+        width = min(A.shape[1], B.shape[1])
+        user_bias = getattr(model, 'user_bias_', None)
+        item_bias = getattr(model, 'item_bias_', None)
+        return {
+            'A': A[:, :width],
+            'B': B[:, :width],
+            'user_bias': np.zeros(len(A), dtype=A.dtype) if user_bias is None else np.asarray(user_bias, dtype=A.dtype),
+            'item_bias': np.zeros(len(B), dtype=B.dtype) if item_bias is None else np.asarray(item_bias, dtype=B.dtype),
+            'glob_mean': float(getattr(model, 'glob_mean_', 0.0) or 0.0),
+        }
+
+    @staticmethod
+    def strip_factors(model):
+        """
+        Copy of the model without its per-user and per-item factor matrices (A_, B_ and cmfrec's
+        precomputed products), for processes that score from the quantized export. Mappings,
+        biases and hyperparameters are kept.
+        """
+        stripped = copy.copy(model)
+        sizes = (len(model.user_mapping_), len(model.item_mapping_))
+        for name, value in vars(model).items():
+            if isinstance(value, np.ndarray) and value.ndim == 2 and value.shape[0] in sizes:
+                setattr(stripped, name, np.empty((0, value.shape[1]), dtype=value.dtype))
+        return stripped
+
+    def factors(self, side, rows=None):
+        """Factor rows of 'user' (A_) or 'item' (B_), dequantized when serving from the quantized export."""
+        if self.quantized is not None:
+            return self.quantized.dequantize(side, rows)
+        factors = self.model.A_ if side == 'user' else self.model.B_
+        return factors if rows is None else factors[rows]
+
+    def serving_factors(self, user_ids=None):
+        """
+        scoring_factors() of the served model, from the quantized export when serving from it.
+        With user_ids, 'A' holds only the factors of those users, at the model rows in 'user_rows'.
+        """
+        if self.quantized is None:
+            factors = self._get_derived("scoring_factors", lambda: self.scoring_factors(self.model))
+            if user_ids is None:
+                return factors
+            rows = IdIndex(self.model.user_mapping_).rows(np.asarray(user_ids, dtype=np.int64))
+            rows = rows[rows >= 0]
+            return {**factors, 'A': factors['A'][rows], 'user_rows': rows}
+        factors = {
+            'B': self.quantized.dequantize('item'),
+            'user_bias': self.quantized.user_bias,
+            'item_bias': self.quantized.item_bias,
+            'glob_mean': self.quantized.glob_mean,
+        }
+        if user_ids is None:
+            return {**factors, 'A': self.quantized.dequantize('user')}
+        rows = self.quantized.user_index.rows(np.asarray(user_ids, dtype=np.int64))
+        rows = rows[rows >= 0]
+        return {**factors, 'A': self.quantized.dequantize('user', rows), 'user_rows': rows}
+
     def predict(self, userId, movieId):
         self.logger.info("Making predictions.")
         try:
-            preds = self.model.predict(userId, movieId)
+            if self.quantized is not None:
+                preds = self.quantized.predict(np.atleast_1d(userId), np.atleast_1d(movieId))
+            else:
+                preds = self.model.predict(userId, movieId)
         except Exception as e:
             self.logger.error(f"Error in prediction: {e}")
             raise e
@@ -61,6 +154,9 @@ class CMFRecommender:
         except AttributeError:
             self.logger.warning("Could not check user mapping. Model object might not have this attribute.")
 
+        if self.quantized is not None:
+            return self.quantized.topN(userId, N, exclude=seen_movies)
+
         try:
             preds = self.model.topN(userId, N, exclude=seen_movies, output_score=True)
             self.logger.info("TopN prediction completed successfully.")
@@ -73,75 +169,226 @@ class CMFRecommender:
             self.logger.error(f"Error in topN prediction: {e}", exc_info=True)
             raise e
         # --- Enhanced Debugging Ends Here ---
-    def user_user_sim(self, user_to_check: int):
+
+    def load_serving_model(self, precision):
+        """(quantized factors, model): the stripped model with its export, or (None, full model)."""
+        if precision == "float64":
+            return None, self.load_model()
+        if precision not in QuantizedFactors.DTYPES:
+            self.logger.error(f"Unsupported CMF_FACTOR_PRECISION {precision}")
+            raise ValueError(f"Unsupported CMF_FACTOR_PRECISION {precision}, expected float64 or one of {QuantizedFactors.DTYPES}")
+        path = os.path.join(CMF_QUANTIZED_FACTORS, precision)
+        model_path = os.path.join(path, "stripped_model.pkl")
+        if not (os.path.exists(os.path.join(path, "meta.json")) and os.path.exists(model_path)):
+            self.logger.warning(f"No {precision} factors at {path}, serving from the full precision model")
+            return None, self.load_model()
+        quantized = QuantizedFactors.load(path)
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+        # an export left over from another training run must not be served with this model
+        if not (np.array_equal(quantized.user_ids, np.asarray(model.user_mapping_))
+                and np.array_equal(quantized.item_ids, np.asarray(model.item_mapping_))):
+            self.logger.warning(f"{precision} factors at {path} do not match the model, serving from the full precision model")
+            return None, self.load_model()
+        self.logger.info(f"Serving from {precision} factors ({quantized.nbytes / 1e6:.1f} MB)")
+        return quantized, model
+
+    def _get_derived(self, name, builder):
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                if name not in self._derived:
+                    self._derived[name] = builder()
+                value = self._derived[name]
+        return value
+
+    def has_user(self, userId) -> bool:
+        user_index = self._get_derived("user_index", lambda: IdIndex(self.model.user_mapping_))
+        return userId in user_index
+
+    def _item_terms(self, cols):
+        """(factors, biases, glob_mean) of the prediction terms of the items at the given rows."""
+        if self.quantized is not None:
+            return self.quantized.dequantize('item', cols), self.quantized.item_bias[cols], self.quantized.glob_mean
+        f = self._get_derived("scoring_factors", lambda: self.scoring_factors(self.model))
+        return f['B'][cols], f['item_bias'][cols], f['glob_mean']
+
+    def fold_in(self, userId, movieIds, ratings):
+        """
+        Factor and bias of a user that is not (or not up to date) in the model, from their ratings
+        against the fixed item factors: one closed-form ridge step, the same as an ALS user update.
+        Cached per user until their ratings change. Movies unknown to the model are ignored.
+        """
+        movieIds = np.asarray(movieIds, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        signature = hash((movieIds.tobytes(), ratings.tobytes()))
+        with self._derived_lock:
+            cached = self._folded.get(userId)
+            if cached is not None and cached[0] == signature:
+                self._folded.move_to_end(userId)
+                return cached[1], cached[2]
+        start = time.perf_counter()
+        item_index = self._get_derived("item_index", lambda: IdIndex(self.model.item_mapping_))
+        cols = item_index.rows(movieIds)
+        known = cols >= 0
+        if not known.any():
+            self.logger.error(f"None of the movies rated by user {userId} are in the model")
+            raise ValueError(f"None of the movies rated by user {userId} are in the model item mapping")
+        cols, ratings = cols[known], ratings[known]
+        lambda_ = getattr(self.model, 'lambda_', 1.0)
+        lambda_factors, lambda_bias = (float(lambda_[2]), float(lambda_[0])) if isinstance(lambda_, np.ndarray) else (float(lambda_), float(lambda_))
+        if getattr(self.model, 'scale_lam', False):
+            lambda_factors, lambda_bias = lambda_factors * len(cols), lambda_bias * len(cols)
+        item_factors, item_bias, glob_mean = self._item_terms(cols)
+        X = item_factors.astype(np.float64)
+        y = ratings - glob_mean - item_bias
+        user_bias = getattr(self.model, 'user_bias_', None) is not None
+        if user_bias:
+            # solve the bias jointly, as an extra column of ones
+            X = np.hstack([X, np.ones((len(X), 1))])
+        penalty = np.full(X.shape[1], lambda_factors)
+        if user_bias:
+            penalty[-1] = lambda_bias
+        solution = np.linalg.solve(X.T @ X + np.diag(penalty), X.T @ y)
+        factor, bias = (solution[:-1], solution[-1]) if user_bias else (solution, 0.0)
+        factor = factor.astype(item_factors.dtype)
+        with self._derived_lock:
+            self._folded[userId] = (signature, factor, float(bias))
+            self._folded.move_to_end(userId)
+            while len(self._folded) > CMF_FOLD_IN_CACHE:
+                self._folded.popitem(last=False)
+        self.logger.info(f"Folded in user {userId} from {len(cols)} ratings in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return factor, float(bias)
+
+    def topN_fold_in(self, userId, movieIds, ratings, N=10):
+        """topN for a folded-in user, excluding the movies they rated: [(movieId, score)] best first."""
+        factor, bias = self.fold_in(userId, movieIds, ratings)
+        item_index = self._get_derived("item_index", lambda: IdIndex(self.model.item_mapping_))
+        if self.quantized is not None:
+            scores = self.quantized.vector_scores(factor, bias)
+        else:
+            f = self._get_derived("scoring_factors", lambda: self.scoring_factors(self.model))
+            scores = f['B'] @ factor + f['item_bias'] + (f['glob_mean'] + bias)
+        rated = item_index.rows(np.asarray(movieIds, dtype=np.int64))
+        scores[rated[rated >= 0]] = -np.inf
+        candidates = np.flatnonzero(np.isfinite(scores))
+        n = min(N, len(candidates))
+        if n == 0:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], n - 1)[:n]] if n < len(candidates) else candidates
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return list(zip(self.model.item_mapping_[top].tolist(), scores[top].tolist()))
+
+    def user_user_sim_fold_in(self, userId, movieIds, ratings, k=10):
+        """user_user_sim() for a folded-in user."""
+        factor, _ = self.fold_in(userId, movieIds, ratings)
+        engine = self.user_similarity_engine()
+        # side information columns of A_ (if any) are not part of the folded factor
+        vector = np.concatenate([np.zeros(engine.normalized.shape[1] - len(factor), dtype=factor.dtype), factor])
+        user_ids, similarities = engine.query_vector(vector, k=k, threshold=self.similarity_threshold)
+        return dict(zip(user_ids.tolist(), similarities.tolist()))
+
+    def user_similarity_engine(self):
+        return self._get_derived("user_similarity", lambda: SimilarityEngine(self.factors('user'), self.model.user_mapping_))
+
+    def item_similarity_engine(self):
+        return self._get_derived("item_similarity", lambda: SimilarityEngine(self.factors('item'), self.model.item_mapping_))
+
+    def user_user_sim(self, user_to_check: int, k=None):
         self.logger.info(f"Checking for similar users in the database for {user_to_check}")
         try:
             if user_to_check:
-                user_to_check_index = np.squeeze(np.where(self.model.user_mapping_ == user_to_check))
-                user_to_check_vector = self.model.A_[user_to_check_index]
-                sim_user_dict = {}
-                
-                for i, u_vec in enumerate(self.model.A_):
-                    
-                    u_id = int(self.model.user_mapping_[i])
-                    if u_id != user_to_check:
-                        similarity = cosine_similarity(user_to_check_vector.reshape(1, -1), u_vec.reshape(1, -1))[0][0]
-                        if similarity > self.similarity_threshold:
-                            sim_user_dict[u_id] = similarity
-                
-                sim_user_dict = dict(sorted(sim_user_dict.items(), key=lambda x: x[1], reverse=True))
-                
+                user_ids, similarities = self.user_similarity_engine().query(user_to_check, k=k, threshold=self.similarity_threshold)
+                sim_user_dict = dict(zip(user_ids.tolist(), similarities.tolist()))
                 return sim_user_dict
         except Exception as e:
             self.logger.error(f"Error in users similarity search: {str(e)}")
             raise e
     
-    def item_item_sim(self, item_to_check: int):
+    def item_item_sim(self, item_to_check: int, k=None):
         self.logger.info(f"Checking for similar movies in the database for {item_to_check}")
         try:
             if item_to_check:
-                item_to_check_index = np.squeeze(np.where(self.model.item_mapping_ == item_to_check))
-                item_to_check_vector = self.model.B_[item_to_check_index]
-                sim_item_dict = {}
-                
-                for i, i_vec in enumerate(self.model.B_):
-                    
-                    i_id = int(self.model.item_mapping_[i])
-                    if i_id != item_to_check:
-                        similarity = cosine_similarity(item_to_check_vector.reshape(1, -1), i_vec.reshape(1, -1))[0][0]
-                        if similarity > self.similarity_threshold:
-                            sim_item_dict[i_id] = similarity
-                
-                sim_item_dict = dict(sorted(sim_item_dict.items(), key=lambda x: x[1], reverse=True))
+                item_ids, similarities = self.item_similarity_engine().query(item_to_check, k=k, threshold=self.similarity_threshold)
+                sim_item_dict = dict(zip(item_ids.tolist(), similarities.tolist()))
                 self.logger.info(f"Number of similar movies found: {len(sim_item_dict)}")
                 return sim_item_dict
         except Exception as e:
             self.logger.error(f"Error in movies similarity search: {str(e)}")
             raise e
+
+    def user_user_sim_batch(self, users_to_check, k=None):
+        self.logger.info(f"Checking for similar users in the database for {len(users_to_check)} users")
+        results = self.user_similarity_engine().query_batch(users_to_check, k=k, threshold=self.similarity_threshold)
+        return [dict(zip(user_ids.tolist(), similarities.tolist())) for user_ids, similarities in results]
+
+    def item_item_sim_batch(self, items_to_check, k=None):
+        self.logger.info(f"Checking for similar movies in the database for {len(items_to_check)} movies")
+        results = self.item_similarity_engine().query_batch(items_to_check, k=k, threshold=self.similarity_threshold)
+        return [dict(zip(item_ids.tolist(), similarities.tolist())) for item_ids, similarities in results]
         
+    def load_ann_index(self, path):
+        """Memory-mapped IVF index of the factors, None if it has not been built."""
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            self.logger.info(f"No ANN index at {path}, brute-force KNN will be used")
+            return None
+        return IVFIndex.load(path, nprobe=CMF_ANN_NPROBE)
+
+    def load_kneighbors(self, path, side):
+        """Fitted NearestNeighbors model, unpickled once per loaded CMF model."""
+        if not path or not os.path.exists(path):
+            self.logger.warning(f"KNN model {path} does not exist.")
+            return None
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            nn_model = pickle.load(f)
+        if getattr(nn_model, 'algorithm', None) == 'brute':
+            # brute force only keeps the fitted matrix: share the model's factors instead of a second copy
+            nn_model.fit(self.factors(side))
+        self.logger.info(f"Loaded KNN model {path} in {time.perf_counter() - start:.2f}s")
+        return nn_model
+
+    def _kneighbors(self, index, side, rows, n_neighbors=None):
+        if index is None:
+            self.logger.error("No nearest neighbors index loaded.")
+            raise FileNotFoundError("No ANN index or KNN model found for the current CMF model.")
+        start = time.perf_counter()
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        queries = self.factors(side, rows)
+        if n_neighbors is None:
+            distances, indices = index.kneighbors(queries)
+        else:
+            distances, indices = index.kneighbors(queries, n_neighbors=n_neighbors)
+        self.logger.info(f"KNN query for {len(rows)} rows took {(time.perf_counter() - start) * 1000:.1f} ms")
+        return distances, indices
+
+    def users_kneighbors_batch(self, user_idxs, n_neighbors=None):
+        """(distances, indices) of the nearest users for many user indices in one call."""
+        try:
+            return self._kneighbors(self.user_ann if self.user_ann is not None else self.user_knn, 'user', user_idxs, n_neighbors)
+        except Exception as e:
+            self.logger.error(f"Error KNeighbors prediction: {e}")
+            raise e
+
+    def item_kneighbors_batch(self, item_idxs, n_neighbors=None):
+        """(distances, indices) of the nearest items for many item indices in one call."""
+        try:
+            return self._kneighbors(self.item_ann if self.item_ann is not None else self.item_knn, 'item', item_idxs, n_neighbors)
+        except Exception as e:
+            self.logger.error(f"Error KNeighbors prediction: {e}")
+            raise e
+
     def users_kneighbors(self, user_idx):
         self.logger.info(f"get Nearest Neighbors for user index {user_idx}")
-        if user_idx:
-            try:
-                with open(CMF_USER_KNN, 'rb') as f:
-                    nn_user = pickle.load(f)
-                return nn_user.kneighbors(self.model.A_[user_idx].reshape(1, -1))
-            except Exception as e:
-                self.logger.error(f"Error KNeighbors prediction: {e}")
-                raise e
+        if user_idx is not None:
+            return self.users_kneighbors_batch([user_idx])
         else:
             raise ValueError("No user indices to parse")
     
     def item_kneighbors(self, item_idx):
         self.logger.info(f"get Nearest Neighbors for item index {item_idx}")
-        if item_idx:
-            try:
-                with open(CMF_ITEM_KNN, 'rb') as f:
-                    nn_item = pickle.load(f)
-                return nn_item.kneighbors(self.model.B_[item_idx].reshape(1, -1))
-            except Exception as e:
-                self.logger.error(f"Error KNeighbors prediction: {e}")
-                raise e
+        if item_idx is not None:
+            return self.item_kneighbors_batch([item_idx])
         else:
             raise ValueError("Failed to parse item indices")
 
@@ -163,6 +410,35 @@ class CMFRecommender:
         self.logger.info(f"top similar users predicted {top_similar_users}")
         return top_similar_users[:10]
     
+    def user_user_sim_optimized_batch(self, users_to_check):
+        """user_user_sim_optimized() for many users with one batched KNN query."""
+        self.logger.info(f"Finding similar users to {len(users_to_check)} users")
+        user_index = self._get_derived("user_index", lambda: IdIndex(self.model.user_mapping_))
+        rows = user_index.rows(users_to_check)
+        if np.any(rows < 0):
+            missing = np.asarray(users_to_check)[rows < 0].tolist()
+            self.logger.error(f"No user found in user mapping for users {missing}")
+            raise ValueError(f"Users {missing} not exist in model user mapping")
+        distances, users_idx = self.users_kneighbors_batch(rows)
+        results = []
+        for user_distances, user_idx in zip(distances, users_idx):
+            top_similar_users = list(zip(self.model.user_mapping_[user_idx], user_distances))
+            # same ordering as user_user_sim_optimized
+            results.append(sorted(top_similar_users, key=lambda x: x[1], reverse=True)[:10])
+        return results
+
+    def item_neighbours_batch(self, movieIds, n_neighbors=None):
+        """Nearest movieIds of each movie, closest first, without the movie itself. Unknown movies get none."""
+        item_index = self._get_derived("item_index", lambda: IdIndex(self.model.item_mapping_))
+        rows = item_index.rows(movieIds)
+        neighbours = [np.empty(0, dtype=np.int64) for _ in rows]
+        known = np.flatnonzero(rows >= 0)
+        if len(known):
+            distances, items_idx = self.item_kneighbors_batch(rows[known], n_neighbors)
+            for pos, row, idx in zip(known, rows[known], items_idx):
+                neighbours[pos] = self.model.item_mapping_[idx[idx != row]]
+        return neighbours
+
     def item_item_sim_optimized(self, item_to_check: int):
         self.logger.info(f"Finding similar item to item {item_to_check}")
         # item index from model user mapping
@@ -1,17 +1,18 @@
 import numpy as np
 import pandas as pd
-from datetime import datetime
 from logging_custom.logger import Logger
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import MinMaxScaler
-from recommenders.xgboost_recommender import XGBoostRecommender
+from recommenders.model_registry import get_xgboost_recommender
+from recommenders.xgboost_recommender import XGB_SCORING
+from utils.user_features import timestamp_hours
 
 class ColdStartRecommender:
     def __init__(self, movie_helper):
         self.logger = Logger("cold_start").get_logger()
         self.movie_helper = movie_helper
-        # Pivoted genre DataFrame: index=movieId, columns=genres, values=0/1
-        self.movie_genre_pivot = self.movie_helper.pivot_genres()
+        # Shared genre matrix: rows=movies (ascending movieId), columns=genres, values=0/1
+        self.genre_matrix = self.movie_helper.genre_matrix
 
     def recommend(self, new_user_vector, liked_movies, top_n=20, threshold=0.8):
         """
@@ -24,20 +25,19 @@ class ColdStartRecommender:
         Returns:
             List of movieIds
         """
-        top_movies = []
-        # Randomize order for diversity
-        for mid in np.random.choice(self.movie_genre_pivot.index, size=len(self.movie_genre_pivot.index), replace=False):
-            if mid in liked_movies:
-                continue
-            movie_vector = np.array(self.movie_genre_pivot.loc[mid]).reshape(1, -1)
-            similarity = cosine_similarity(new_user_vector.reshape(1, -1), movie_vector)[0][0]
-            if similarity >= threshold:
-                top_movies.append(mid)
-                if len(top_movies) == top_n:
-                    self.logger.info(f"found top {top_n} movies.")
-                    break
+        signatures, inverse = self.genre_matrix.signatures
+        # one similarity per distinct genre signature instead of one per movie
+        similarities = cosine_similarity(signatures, new_user_vector.reshape(1, -1)).ravel()
+        candidates = np.flatnonzero((similarities >= threshold)[inverse])
+        liked_rows = self.genre_matrix.index.rows(np.fromiter(liked_movies, dtype=np.int64, count=len(liked_movies)))
+        candidates = candidates[~np.isin(candidates, liked_rows)]
+        # random pick among qualifying movies for diversity, same as walking a random permutation
+        picked = np.random.choice(candidates, size=min(top_n, len(candidates)), replace=False)
+        top_movies = self.genre_matrix.movie_ids[picked].tolist()
+        self.logger.info(f"found {len(top_movies)} of {top_n} movies among {len(candidates)} candidates from "
+                         f"{int((similarities >= threshold).sum())} of {len(signatures)} genre signatures.")
         # also return a user vector to check user preferences
-        new_user_vector = pd.DataFrame(new_user_vector.reshape(1, -1), columns=self.movie_genre_pivot.columns.tolist())
+        new_user_vector = pd.DataFrame(new_user_vector.reshape(1, -1), columns=self.genre_matrix.genres)
         new_user_vector = new_user_vector.T
         new_user_vector.columns = ['Genre score']
 
@@ -45,7 +45,7 @@ class ColdStartRecommender:
 
     def get_movie_vector(self, movie_id):
         """Get the genre vector for a given movie_id."""
-        return np.array(self.movie_genre_pivot.loc[movie_id])
+        return self.genre_matrix.vector(movie_id)
     
     def recommend_from_liked(self, liked_movie_ids, top_n=20, threshold=0.8):
         """
@@ -61,25 +61,29 @@ class ColdStartRecommender:
             raise ValueError("No liked movies provided.")
         self.logger.info(f"Similarity search using genres. num results requested: {top_n}, similarity threshold: {threshold}")
         # Build new user vector by averaging genre vectors of liked movies
-        liked_vectors = [self.get_movie_vector(mid) for mid in liked_movie_ids if mid in self.movie_genre_pivot.index]
+        liked_vectors = [self.get_movie_vector(mid) for mid in liked_movie_ids if mid in self.genre_matrix.index]
         if not liked_vectors:
-            raise ValueError("None of the liked movies found in genre pivot table.")
+            raise ValueError("None of the liked movies found in genre matrix.")
         new_user_vector = np.mean(liked_vectors, axis=0)
         self.logger.info(f"New user vector:::: {new_user_vector}")
         # Use recommend method to get top movies
         return self.recommend(new_user_vector, set(liked_movie_ids), top_n=top_n, threshold=threshold)
     
-    def xgb_cold_start(self, new_user_info: pd.DataFrame):
+    def xgb_cold_start(self, new_user_info: pd.DataFrame, top_n=20):
         self.logger.info(f"Predicting movies for new user using XGB Recommender")
         seen_movies = new_user_info['movieId'].values.tolist()
-        new_user_info['hour'] = new_user_info['timestamp'].apply(lambda x: datetime.fromtimestamp(x).hour)
+        new_user_info['hour'] = timestamp_hours(new_user_info['timestamp'].values)
         # convert user infos
         avg_rating = new_user_info.groupby('userId')['rating'].mean()
         avg_hour = new_user_info.groupby('userId')['hour'].mean()
+        if XGB_SCORING == "catalog":
+            xgb = get_xgboost_recommender()
+            user_vector = xgb.preprocess(pd.DataFrame({'avg_rating': avg_rating, 'avg_hour': avg_hour}))
+            return xgb.rank_catalog(user_vector[0], self.genre_matrix, seen_movies, top_n)
         # get random movies
         movie_ids, movie_vectors = self.movie_helper.get_random_movie_vectors(n=100)
-        # initialize xgb recommender
-        xgb = XGBoostRecommender()
+        # shared xgb recommender
+        xgb = get_xgboost_recommender()
         # preprocess user data
         user_vector = xgb.preprocess(pd.DataFrame({'avg_rating': avg_rating, 'avg_hour': avg_hour}))
         # create user vector repeated for each movie
@@ -98,13 +102,13 @@ class ColdStartRecommender:
             self.logger.error(f"Movie Ids or Ratings are missing. {liked_movie_ids}, {ratings}")
             raise ValueError(f"Movie Ids or Ratings are missing. {liked_movie_ids}, {ratings}")
         # get movie genre vectors
-        liked_vectors = [self.get_movie_vector(mid) for mid in liked_movie_ids if mid in self.movie_genre_pivot.index]
+        liked_vectors = [self.get_movie_vector(mid) for mid in liked_movie_ids if mid in self.genre_matrix.index]
         self.logger.info(f"liked vector: {liked_vectors}")
         # multiply movie genre vectors with ratings
         new_user_vector = [rating*movie_vector for rating, movie_vector in zip(ratings, liked_vectors)]
         new_user_vector = np.mean(new_user_vector, axis=0)
         self.logger.info(f"New user vector: {new_user_vector}")
-        new_user_vector = pd.DataFrame(new_user_vector.reshape(1, -1), columns=self.movie_genre_pivot.columns.tolist())
+        new_user_vector = pd.DataFrame(new_user_vector.reshape(1, -1), columns=self.genre_matrix.genres)
         new_user_vector = new_user_vector.T
         new_user_vector.columns = ['Genre score']
         new_user_vector['Genre score'] = MinMaxScaler().fit_transform(new_user_vector)
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+import streamlit as st
+from logging_custom.logger import Logger
+from recommenders.cmf_recommender import CMFRecommender, MODEL_PATH as CMF_MODEL_PATH
+from recommenders.xgboost_recommender import XGBoostRecommender, MODEL_PATH as XGBOOST_MODEL_PATH, SCALER_PATH
+from recommenders.topn_table import TopNTable
+from model_trainer.training_job import TrainingJob
+
+load_dotenv()
+
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", 5))
+CMF_TOPN_TABLE = os.getenv("CMF_TOPN_TABLE", "models/cmfrec_model/cmf_topn.npz")
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded recommenders (model + everything derived from it).
+    Each entry is built once from its artifact files and shared by every session. The files'
+    (mtime, size) are checked at most every check_interval seconds; when they change the entry
+    is rebuilt and swapped in as a whole, so callers holding the old one finish with a
+    consistent model. Trainers must replace artifacts atomically (write + os.replace).
+    """
+    def __init__(self, check_interval: float = MODEL_RELOAD_INTERVAL):
+        self.logger = Logger("ModelRegistry").get_logger()
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(paths):
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except (OSError, TypeError):
+                signature.append(None)
+        return tuple(signature)
+
+    def get(self, name: str, paths, loader):
+        """Return the entry built by loader(), rebuilding it if the artifact files changed."""
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and now - entry['checked'] < self.check_interval:
+            return entry['value']
+        signature = self._signature(paths)
+        if entry is not None and entry['signature'] == signature:
+            entry['checked'] = now
+            return entry['value']
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry['signature'] != signature:
+                start = time.perf_counter()
+                value = loader()
+                version = entry['version'] + 1 if entry else 1
+                self._entries[name] = {'value': value, 'signature': signature, 'version': version, 'checked': now}
+                self.logger.info(f"{'Reloaded' if entry else 'Loaded'} {name} (version {version}) in {time.perf_counter() - start:.2f}s")
+            return self._entries[name]['value']
+
+    def version(self, name: str) -> int:
+        entry = self._entries.get(name)
+        return entry['version'] if entry else 0
+
+    def refresh(self):
+        """Force a file check on the next get() of every entry, e.g. right after training."""
+        with self._lock:
+            for entry in self._entries.values():
+                entry['checked'] = float('-inf')
+        self.logger.info("Model registry marked for refresh")
+
+@st.cache_resource
+def get_model_registry() -> ModelRegistry:
+    """The model registry of this server process."""
+    # before any model file is opened: published models are swapped in through a symlink
+    TrainingJob.migrate()
+    return ModelRegistry()
+
+def get_cmf_recommender():
+    """Shared CMFRecommender of the current CMF model, rebuilt when the model file is replaced."""
+    return get_model_registry().get("cmf", [CMF_MODEL_PATH], CMFRecommender)
+
+def get_xgboost_recommender():
+    """Shared XGBoostRecommender, rebuilt when the model or the scaler file is replaced."""
+    return get_model_registry().get("xgboost", [XGBOOST_MODEL_PATH, SCALER_PATH], XGBoostRecommender)
+
+def _load_topn_table():
+    table = TopNTable.load(CMF_TOPN_TABLE)
+    if table is not None and CMF_MODEL_PATH and os.path.exists(CMF_MODEL_PATH) \
+            and table.model_signature != TopNTable.model_file_signature(CMF_MODEL_PATH):
+        table.logger.warning(f"Top-N table {CMF_TOPN_TABLE} was computed for another model, ignoring it")
+        return None
+    return table
+
+def get_topn_table():
+    """Precomputed CMF top-N table of the current model, None if missing or stale."""
+    return get_model_registry().get("cmf_topn", [CMF_TOPN_TABLE, CMF_MODEL_PATH], _load_topn_table)
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.sparse as sp
+
+def aggregate_neighbour_ratings(ratings_index, user_ids, neighbours, k=None):
+    """
+    User-similarity recommendations for many users in one sparse product.
+    neighbours[q] is the [(userId, weight)] list of user_ids[q]. Every movie rated by a
+    neighbour scores sum(weight * rating) over the neighbours that rated it; movies already
+    rated by the user are dropped. Returns one [(movieId, score)] list per user, best first,
+    at most k long (all candidates if k is None).
+    """
+    index_users, index_items, matrix = ratings_index.rating_matrix()
+    # sparse (queries x users) weight matrix
+    q_rows, u_cols, weights = [], [], []
+    for q, (userId, user_neighbours) in enumerate(zip(user_ids, neighbours)):
+        for neighbour, weight in user_neighbours:
+            if neighbour != userId:
+                q_rows.append(q)
+                u_cols.append(neighbour)
+                weights.append(weight)
+    u_cols = np.asarray(u_cols, dtype=np.int64)
+    pos = np.searchsorted(index_users, u_cols)
+    pos = np.minimum(pos, max(len(index_users) - 1, 0))
+    known = (index_users[pos] == u_cols) if len(index_users) else np.zeros(len(u_cols), dtype=bool)
+    weight_matrix = sp.csr_matrix((np.asarray(weights, dtype=np.float32)[known], (np.asarray(q_rows, dtype=np.int64)[known], pos[known])),
+                                  shape=(len(user_ids), len(index_users)))
+    scores = (weight_matrix @ matrix).tocsr()
+    scores.sort_indices()
+    # rows of the queried users, for their seen mask
+    query_ids = np.asarray(user_ids, dtype=np.int64)
+    query_pos = np.minimum(np.searchsorted(index_users, query_ids), max(len(index_users) - 1, 0))
+    results = []
+    for q in range(len(user_ids)):
+        start, end = scores.indptr[q], scores.indptr[q + 1]
+        columns, values = scores.indices[start:end], scores.data[start:end]
+        if len(index_users) and index_users[query_pos[q]] == query_ids[q]:
+            seen = matrix.indices[matrix.indptr[query_pos[q]]:matrix.indptr[query_pos[q] + 1]]
+            keep = ~np.isin(columns, seen, assume_unique=True)
+            columns, values = columns[keep], values[keep]
+        if k is not None and k < len(values):
+            top = np.argpartition(-values, k - 1)[:k]
+        else:
+            top = np.arange(len(values))
+        top = top[np.argsort(-values[top], kind='stable')]
+        results.append(list(zip(index_items[columns[top]].tolist(), values[top].tolist())))
+    return results
@@ -1,9 +1,20 @@
-import streamlit as st
+import os
+import time
+from dotenv import load_dotenv
 import numpy as np
-from collections import defaultdict
 from logging_custom.logger import Logger
-from recommenders.cmf_recommender import CMFRecommender
-from recommenders.xgboost_recommender import XGBoostRecommender
+from recommenders.model_registry import get_model_registry, get_cmf_recommender, get_xgboost_recommender, get_topn_table
+from recommenders.xgboost_recommender import XGB_SCORING
+from recommenders.result_cache import get_result_cache
+from recommenders.neighbourhood import aggregate_neighbour_ratings
+
+load_dotenv()
+# hybrid pipeline: candidate sources and per-stage budgets (ms)
+HYBRID_CMF_CANDIDATES = int(os.getenv("HYBRID_CMF_CANDIDATES", 200))
+HYBRID_ITEM_SEEDS = int(os.getenv("HYBRID_ITEM_SEEDS", 10))
+HYBRID_ITEM_NEIGHBOURS = int(os.getenv("HYBRID_ITEM_NEIGHBOURS", 20))
+HYBRID_CANDIDATE_BUDGET_MS = float(os.getenv("HYBRID_CANDIDATE_BUDGET_MS", 100))
+HYBRID_RERANK_BUDGET_MS = float(os.getenv("HYBRID_RERANK_BUDGET_MS", 50))
 
 class Prediction:
     def __init__(self, user_helper, movie_helper, links_helper, ratings_helper):
@@ -13,81 +24,95 @@ class Prediction:
         self.movie_helper = movie_helper
         self.links_helper = links_helper
         self.ratings_helper = ratings_helper
+        self.result_cache = get_result_cache()
 
         self.logger.info("Prediction class initialized.")
+
+    def _cached(self, model, registry_names, userId, N, compute):
+        # cache key carries the registry versions: a reloaded model never serves old results
+        version = tuple(get_model_registry().version(name) for name in registry_names)
+        return self.result_cache.get_or_compute((model, version, int(userId), N), compute)
     
     def predict_cmf_user_movie_score(self, userId, movieId):
         self.logger.info(f"Predicting score for userId {userId} and movieId {movieId} using CMF Recommender.")
-        cmf_recommender = CMFRecommender()
+        cmf_recommender = get_cmf_recommender()
         score = cmf_recommender.predict([userId], [movieId])[0][1]
         return score
     
     def predict_cmf_topN(self, userId, N=10):
+        # the getters check for retrained artifacts before the versions are read
+        get_cmf_recommender(), get_topn_table()
+        return self._cached("cmf_topN", ("cmf", "cmf_topn"), userId, N, lambda: self._predict_cmf_topN(userId, N))
+
+    def _predict_cmf_topN(self, userId, N=10):
         self.logger.info(f"Fetching top {N} recommendations for userId {userId} using CMF Recommender.")
-        cmf_recommender = CMFRecommender()
         seen_movies = self.ratings_helper.get_user_movie_seen(userId)
+        # precomputed table first, on-demand scoring for users it does not cover
+        table = get_topn_table()
+        preds = table.lookup(userId, N, exclude=seen_movies) if table is not None else None
+        if preds is not None:
+            self.logger.info(f"Serving top {N} for userId {userId} from the precomputed table.")
+            return preds
+        cmf_recommender = get_cmf_recommender()
+        if not cmf_recommender.has_user(userId):
+            # registered after the last training: fold the user in from their ratings
+            self.logger.info(f"UserId {userId} not in the model, folding in from ratings.")
+            user_ratings = self.ratings_helper.get_user_ratings(userId)
+            return cmf_recommender.topN_fold_in(userId, user_ratings['movieId'].values, user_ratings['rating'].values, N)
         preds = cmf_recommender.topN_predict(userId, seen_movies, N)
         return preds
     
     def cmf_simlar_movies(self, movieId):
         self.logger.info(f"Similar movies to movie {movieId} using CMF Recommender item matrix.")
-        cmf_recommender = CMFRecommender()
+        cmf_recommender = get_cmf_recommender()
         similar_movies = cmf_recommender.item_item_sim_optimized(movieId)
         return similar_movies
     
     def cmf_simlar_users(self, userId: int):
         self.logger.info(f"Similar users to user {userId} using CMF Recommender user matrix.")
-        cmf_recommender = CMFRecommender()
+        cmf_recommender = get_cmf_recommender()
+        if not cmf_recommender.has_user(userId):
+            user_ratings = self.ratings_helper.get_user_ratings(userId)
+            return cmf_recommender.user_user_sim_fold_in(userId, user_ratings['movieId'].values, user_ratings['rating'].values)
         similar_users = cmf_recommender.user_user_sim(userId)
         return similar_users
     
-    def _get_aggregated_movie_scores(self, candidate_movies: dict):
-        if candidate_movies:
-            scores = defaultdict(list)
-            for movies in candidate_movies.values():
-                for movie_id, w_scores in movies:
-                    scores[movie_id].append(w_scores)
-            # sum the scores for multiple occurence
-            aggregated_movie_scores = {movie_id: sum(w_scores) for movie_id, w_scores in scores.items()}
-            return aggregated_movie_scores
+    def cmf_similar_users_optimized(self, userId: int):
+        get_cmf_recommender()
+        return self._cached("cmf_similar_users", ("cmf",), userId, None, lambda: self._cmf_similar_users_optimized(userId))
 
-    @st.cache_data
-    def cmf_similar_users_optimized(_self, userId: int):
-        _self.logger.info(f"Attempting user similarity search for {userId}")
-        # # initialize cmf class
-        # cmf_recommender = CMFRecommender()
-        # find similar users
-        top_similar_users = CMFRecommender().user_user_sim_optimized(userId)
-        movies_seen_by_user = _self.ratings_helper.get_user_movie_seen(userId) # movies seen by current user
-        _self.logger.info(f"number of movies seen by user: {len(movies_seen_by_user)}")
-        # find top movies seen by similar users, user hasnt watched
-        candidate_movies = {}
-        for user_id, sim in top_similar_users:
-            if user_id != userId:
-                movies_seen_by_similar_user = _self.ratings_helper.get_user_movie_seen(user_id) # movies seen by similar users
-                _self.logger.info(f"number of movies seen by similar user: {len(movies_seen_by_similar_user)}")
-                # get rid of movies, current user already seen
-                recommendable_movies = list(set(movies_seen_by_similar_user) - set(movies_seen_by_user))
-                _self.logger.info(f"recommendable movies from user: {user_id} : {recommendable_movies}")
-                recommendable_movies = [(movie_id, _self.ratings_helper.get_user_movie_rating(user_id, movie_id)) for movie_id in recommendable_movies]
-                # add movie, ratings*similarity in candidate movie dict
-                candidate_movies[user_id] = [(movie_id, rating * sim) for movie_id, rating in recommendable_movies]
-        # aggregrate movies and scores (2 or more users may like the same movie)
-        aggregated_movie_scores = _self._get_aggregated_movie_scores(candidate_movies)
-        # return the sorted movie ids based on scores
-        return sorted(aggregated_movie_scores.items(), key=lambda x: x[1], reverse=True)
-                
-                
+    def _cmf_similar_users_optimized(self, userId: int):
+        self.logger.info(f"Attempting user similarity search for {userId}")
+        return self.cmf_similar_users_batch([userId])[0]
+
+    def cmf_similar_users_batch(self, userIds, k=None):
+        """
+        Movies rated by each user's nearest CMF neighbours and not by the user, scored by
+        sum(neighbour weight * rating), best first. One sparse product for the whole batch.
+        """
+        top_similar_users = get_cmf_recommender().user_user_sim_optimized_batch(userIds)
+        results = aggregate_neighbour_ratings(self.ratings_helper.ratings_index, userIds, top_similar_users, k=k)
+        self.logger.info(f"Neighbourhood recommendations computed for {len(userIds)} users")
+        return results
 
-    
     def predict_xgboost(self, userId, N=10):
+        get_xgboost_recommender()
+        return self._cached("xgboost", ("xgboost",), userId, N, lambda: self._predict_xgboost(userId, N))
+
+    def _predict_xgboost(self, userId, N=10):
         self.logger.info(f"Fetching top {N} recommendations for userId {userId} using XGBoost Recommender.")
+        if XGB_SCORING == "catalog":
+            xgb_recommender = get_xgboost_recommender()
+            user_vector = xgb_recommender.preprocess(self.user_helper.get_user_vector(userId))
+            seen_movies = self.ratings_helper.get_user_movie_seen(userId)
+            return xgb_recommender.rank_catalog(user_vector, self.movie_helper.genre_matrix, seen_movies, N)
+        # "sample": score a random draw of 100 movies
         # load movie and user vectors
         movie_ids, movie_vectors = self.movie_helper.get_random_movie_vectors(n=100)
         user_vector = self.user_helper.get_user_vector(userId)
         seen_movies = self.ratings_helper.get_user_movie_seen(userId)
         # load model
-        xgb_recommender = XGBoostRecommender()
+        xgb_recommender = get_xgboost_recommender()
         # scale user vector
         user_vector = xgb_recommender.preprocess(user_vector)
         # create user vector repeated for each movie
@@ -98,7 +123,53 @@ class Prediction:
         preds = xgb_recommender.predict(X_input, movie_ids, seen_movies)
         
         return preds[:N]
-    
-    
 
-        
+    def predict_hybrid(self, userId, N=10):
+        get_cmf_recommender(), get_topn_table(), get_xgboost_recommender()
+        return self._cached("hybrid", ("cmf", "cmf_topn", "xgboost"), userId, N, lambda: self._predict_hybrid(userId, N))
+
+    def hybrid_candidates(self, userId, budget_ms=HYBRID_CANDIDATE_BUDGET_MS):
+        """
+        Stage 1: CMF topN followed by the item neighbours of the user's best rated movies,
+        unseen and deduplicated, in that order. Sources left when the budget runs out are skipped.
+        Returns the candidates and the CMF scores of those that came from topN.
+        """
+        start = time.perf_counter()
+        seen_movies = set(self.ratings_helper.get_user_movie_seen(userId))
+        cmf_scores = dict(self._predict_cmf_topN(userId, HYBRID_CMF_CANDIDATES))
+        candidates = list(cmf_scores)
+        cmf_ms = (time.perf_counter() - start) * 1000
+        if cmf_ms < budget_ms and HYBRID_ITEM_SEEDS:
+            user_ratings = self.ratings_helper.get_user_ratings(userId)
+            seeds = user_ratings.nlargest(HYBRID_ITEM_SEEDS, 'rating')['movieId'].values
+            for neighbours in get_cmf_recommender().item_neighbours_batch(seeds, HYBRID_ITEM_NEIGHBOURS + 1):
+                candidates.extend(neighbours.tolist())
+        else:
+            self.logger.warning(f"Candidate budget of {budget_ms} ms used by CMF topN ({cmf_ms:.1f} ms), skipping item neighbours")
+        candidates = [movieId for movieId in dict.fromkeys(candidates) if movieId not in seen_movies]
+        self.logger.info(f"Hybrid stage 1: {len(candidates)} candidates in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return candidates, cmf_scores
+
+    def _predict_hybrid(self, userId, N=10):
+        """
+        Two-stage ranking: cheap CMF candidates, then an XGBoost re-rank of those only.
+        Candidates the re-rank budget did not reach come last with a NaN score.
+        """
+        self.logger.info(f"Fetching top {N} recommendations for userId {userId} using the hybrid pipeline.")
+        candidates, cmf_scores = self.hybrid_candidates(userId)
+        start = time.perf_counter()
+        try:
+            xgb_recommender = get_xgboost_recommender()
+            user_vector = xgb_recommender.preprocess(self.user_helper.get_user_vector(userId))
+        except ValueError as e:
+            self.logger.warning(f"No XGBoost features for user {userId} ({e}), keeping the CMF order")
+            return [(movieId, cmf_scores.get(movieId, float('nan'))) for movieId in candidates[:N]]
+        scores = xgb_recommender.score_movies(user_vector, self.movie_helper.genre_matrix, candidates,
+                                              budget_ms=HYBRID_RERANK_BUDGET_MS)
+        # scored candidates by XGBoost score, ties and unscored ones keep their stage 1 order
+        order = np.lexsort((np.arange(len(candidates)), -np.nan_to_num(scores, nan=-np.inf)))
+        # movies the re-rank did not reach get no score: their CMF rating is on another scale
+        preds = [(candidates[i], float(scores[i])) for i in order[:N]]
+        self.logger.info(f"Hybrid stage 2: re-ranked {int(np.isfinite(scores).sum())}/{len(candidates)} candidates "
+                         f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return preds
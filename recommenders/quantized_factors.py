@@ -0,0 +1,147 @@
+import os
+import json
+import numpy as np
+from logging_custom.logger import Logger
+from utils.id_index import IdIndex
+
+class QuantizedFactors:
+    """
+    Serving-only copy of the CMF prediction terms with reduced-precision factors.
+    "int8" stores each row as int8 with a float32 scale (max |value| / 127); item scores are
+    one dot product per item, rescaled by the two row scales. Biases stay float32.
+    Arrays are saved as .npy files and loaded memory-mapped, so worker processes share them.
+    (float16 is not offered: NumPy has no BLAS for it and upcasting every block made scoring
+    slower than the float64 model.)
+    """
+    DTYPES = ('int8',)
+    FILES = ('user_ids', 'item_ids', 'A', 'B', 'a_scale', 'b_scale', 'user_bias', 'item_bias')
+
+    def __init__(self, dtype, user_ids, item_ids, A, B, a_scale, b_scale, user_bias, item_bias, glob_mean,
+                 block_size: int = 4096):
+        self.logger = Logger("QuantizedFactors").get_logger()
+        self.dtype = dtype
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.A = A
+        self.B = B
+        self.a_scale = a_scale
+        self.b_scale = b_scale
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.glob_mean = float(glob_mean)
+        self.block_size = block_size
+        self.user_index = IdIndex(user_ids)
+        self.item_index = IdIndex(item_ids)
+
+    @staticmethod
+    def _quantize(X, dtype):
+        X = np.asarray(X, dtype=np.float32)
+        scale = np.abs(X).max(axis=1) / 127
+        scale[scale == 0] = 1.0
+        return np.rint(X / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+    @classmethod
+    def from_factors(cls, factors, user_ids, item_ids, dtype='int8'):
+        """factors as returned by CMFRecommender.scoring_factors."""
+        if dtype not in cls.DTYPES:
+            raise ValueError(f"Unsupported factor dtype {dtype}, expected one of {cls.DTYPES}")
+        A, a_scale = cls._quantize(factors['A'], dtype)
+        B, b_scale = cls._quantize(factors['B'], dtype)
+        return cls(dtype, np.asarray(user_ids, dtype=np.int64), np.asarray(item_ids, dtype=np.int64), A, B, a_scale, b_scale,
+                   np.asarray(factors['user_bias'], dtype=np.float32), np.asarray(factors['item_bias'], dtype=np.float32),
+                   factors['glob_mean'])
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, name).nbytes for name in self.FILES))
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        # replaced, never rewritten in place: servers may have the old files memory-mapped
+        for name in self.FILES:
+            path = os.path.join(directory, f"{name}.npy")
+            with open(f"{path}.tmp", 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(f"{path}.tmp", path)
+        meta_path = os.path.join(directory, "meta.json")
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump({'dtype': self.dtype, 'glob_mean': self.glob_mean}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self.logger.info(f"{self.dtype} factors saved to {directory} ({self.nbytes / 1e6:.1f} MB)")
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None) for name in cls.FILES}
+        return cls(meta['dtype'], glob_mean=meta['glob_mean'], **arrays)
+
+    def _user_row(self, userId):
+        row = self.user_index.row(userId)
+        if row is None:
+            self.logger.error(f"UserId {userId} not found in quantized factors")
+            raise ValueError(f"UserId {userId} not found in model's user mapping.")
+        return row
+
+    def dequantize(self, side, rows=None) -> np.ndarray:
+        """float32 factors of the 'user' or 'item' rows (all rows by default)."""
+        factors, scale = (self.A, self.a_scale) if side == 'user' else (self.B, self.b_scale)
+        if rows is not None:
+            factors, scale = factors[rows], scale[rows]
+        factors = factors.astype(np.float32)
+        factors *= scale[..., None]
+        return factors
+
+    def _item_dots(self, vector) -> np.ndarray:
+        """B . vector for every item, before the item scales."""
+        scores = np.empty(len(self.item_ids), dtype=np.float32)
+        # blocks are upcast into one small float32 buffer and scored with BLAS
+        buffer = np.empty((min(self.block_size, len(scores)), self.B.shape[1]), dtype=np.float32)
+        for start in range(0, len(scores), self.block_size):
+            block = self.B[start:start + self.block_size]
+            buffer[:len(block)] = block
+            np.dot(buffer[:len(block)], vector, out=scores[start:start + len(block)])
+        scores *= self.b_scale
+        return scores
+
+    def item_scores(self, userId) -> np.ndarray:
+        """Predicted rating of the user for every item (float32, item_ids order)."""
+        row = self._user_row(userId)
+        # int8 x int8 products summed over k stay below 2**24 for k < 1041, so float32 accumulation is exact
+        scores = self._item_dots(self.A[row].astype(np.float32))
+        scores *= self.a_scale[row]
+        scores += self.item_bias
+        scores += self.user_bias[row] + self.glob_mean
+        return scores
+
+    def vector_scores(self, factor, bias=0.0) -> np.ndarray:
+        """item_scores() for a user factor that is not in the export (e.g. a folded-in user)."""
+        scores = self._item_dots(np.asarray(factor, dtype=np.float32))
+        scores += self.item_bias
+        scores += bias + self.glob_mean
+        return scores
+
+    def predict(self, userIds, movieIds) -> np.ndarray:
+        """Predicted ratings for (user, movie) pairs, NaN where either is unknown."""
+        users = self.user_index.rows(userIds)
+        items = self.item_index.rows(movieIds)
+        preds = np.full(len(users), np.nan, dtype=np.float32)
+        known = (users >= 0) & (items >= 0)
+        u, i = users[known], items[known]
+        dots = np.einsum('ij,ij->i', self.A[u].astype(np.int32), self.B[i].astype(np.int32)) * self.a_scale[u] * self.b_scale[i]
+        preds[known] = dots + self.user_bias[u] + self.item_bias[i] + self.glob_mean
+        return preds
+
+    def topN(self, userId, N=10, exclude=None):
+        """[(movieId, score)] best first, excluding the given movieIds."""
+        scores = self.item_scores(userId)
+        if exclude is not None and len(exclude):
+            rows = self.item_index.rows(np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+            scores[rows[rows >= 0]] = -np.inf
+        n = min(N, len(scores))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(n)
+        top = top[np.isfinite(scores[top])]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return list(zip(self.item_ids[top].tolist(), scores[top].tolist()))
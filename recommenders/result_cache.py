@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+import streamlit as st
+from logging_custom.logger import Logger
+
+load_dotenv()
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 2048))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 600))
+
+class ResultCache:
+    """
+    Bounded LRU cache of recommendation results with a time to live.
+    Keys are (model, model version, userId, N): a new model version simply stops matching
+    the old entries (they are dropped on the next put), and invalidate_user() removes
+    everything computed for a user, e.g. after they submit a rating.
+    """
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.logger = Logger("ResultCache").get_logger()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._user_keys.get(key[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[2]]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if time.monotonic() > expires:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        model, version, userId, _ = key
+        with self._lock:
+            if self._versions.get(model, version) != version:
+                # model was swapped: entries of older versions can never hit again
+                for stale in [k for k in self._entries if k[0] == model and k[1] != version]:
+                    self._remove(stale)
+            self._versions[model] = version
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._user_keys.setdefault(userId, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate_user(self, userId):
+        with self._lock:
+            keys = list(self._user_keys.get(int(userId), ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        if keys:
+            self.logger.info(f"Invalidated {len(keys)} cached results of user {userId}")
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations}
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """Recommendation cache shared by every session of this server process."""
+    return ResultCache()
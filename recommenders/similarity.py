@@ -0,0 +1,68 @@
+import numpy as np
+from logging_custom.logger import Logger
+from utils.id_index import IdIndex
+
+class SimilarityEngine:
+    """
+    Cosine similarity search over a factor matrix (CMF A_ or B_).
+    Rows are L2-normalized once, so a query is one matrix-vector product followed by an
+    argpartition top-k; batches of queries become one matrix-matrix product per block.
+    """
+    def __init__(self, factors, ids, block_size: int = 256):
+        self.logger = Logger("SimilarityEngine").get_logger()
+        factors = np.asarray(factors, dtype=np.float32)
+        norms = np.linalg.norm(factors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.normalized = factors / norms
+        self.normalized.setflags(write=False)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.index = IdIndex(self.ids)
+        self.block_size = block_size
+        self.logger.info(f"Similarity engine built for {self.normalized.shape[0]} rows of {self.normalized.shape[1]} factors")
+
+    def _row(self, id_):
+        row = self.index.row(id_)
+        if row is None:
+            self.logger.error(f"Id {id_} not found in factor mapping")
+            raise ValueError(f"Id {id_} does not exist in the model mapping")
+        return row
+
+    @staticmethod
+    def _top(sims, k=None, threshold=None):
+        """Indices of sims above threshold, best first, at most k."""
+        candidates = np.flatnonzero(sims > threshold) if threshold is not None else np.flatnonzero(np.isfinite(sims))
+        if k is not None and k < len(candidates):
+            part = np.argpartition(-sims[candidates], k - 1)[:k]
+            candidates = candidates[part]
+        return candidates[np.argsort(-sims[candidates], kind='stable')]
+
+    def query(self, id_, k=None, threshold=None, exclude_self=True):
+        """Return (ids, similarities) of the rows most similar to id_, best first."""
+        row = self._row(id_)
+        sims = self.normalized @ self.normalized[row]
+        if exclude_self:
+            sims[row] = -np.inf
+        top = self._top(sims, k, threshold)
+        return self.ids[top], sims[top]
+
+    def query_vector(self, vector, k=None, threshold=None):
+        """query() for a factor vector that is not a row of the matrix (e.g. a folded-in user)."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        sims = self.normalized @ (vector / norm if norm else vector)
+        top = self._top(sims, k, threshold)
+        return self.ids[top], sims[top]
+
+    def query_batch(self, ids, k=None, threshold=None, exclude_self=True):
+        """query() for many ids at once, one matrix product per block of queries."""
+        rows = np.array([self._row(id_) for id_ in ids], dtype=np.int64)
+        results = []
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            sims = self.normalized[block] @ self.normalized.T
+            if exclude_self:
+                sims[np.arange(len(block)), block] = -np.inf
+            for block_sims in sims:
+                top = self._top(block_sims, k, threshold)
+                results.append((self.ids[top], block_sims[top]))
+        return results
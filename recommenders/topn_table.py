@@ -0,0 +1,58 @@
+import os
+import numpy as np
+from logging_custom.logger import Logger
+from utils.id_index import IdIndex
+
+class TopNTable:
+    """
+    Precomputed CMF top-N per user: row r holds the N best unseen movieIds of user_ids[r]
+    (-1 padded) and their predicted ratings, best first. Written by model_trainer.topn_batch.
+    model_signature is the (mtime_ns, size) of the model file the table was computed from.
+    """
+    def __init__(self, user_ids, items, scores, model_signature=None):
+        self.logger = Logger("TopNTable").get_logger()
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.items = np.asarray(items, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.model_signature = tuple(model_signature) if model_signature is not None else None
+        self.index = IdIndex(self.user_ids)
+
+    @property
+    def N(self) -> int:
+        return self.items.shape[1]
+
+    @staticmethod
+    def model_file_signature(model_path):
+        stat = os.stat(model_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, user_ids=self.user_ids, items=self.items, scores=self.scores,
+                 model_signature=np.asarray(self.model_signature or (0, 0), dtype=np.int64))
+        os.replace(tmp_path, path)
+        self.logger.info(f"Top-N table saved to {path}. Users: {len(self.user_ids)}, N: {self.N}")
+
+    @classmethod
+    def load(cls, path: str):
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['user_ids'], data['items'], data['scores'], data['model_signature'].tolist())
+
+    def lookup(self, userId, N=10, exclude=None):
+        """[(movieId, score)] best first, or None if the user is not in the table or N is too large."""
+        row = self.index.row(userId)
+        if row is None or N > self.N:
+            return None
+        items, scores = self.items[row], self.scores[row]
+        keep = items >= 0
+        if exclude is not None and len(exclude):
+            # ratings submitted after the table was computed
+            keep &= ~np.isin(items, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+        items, scores = items[keep], scores[keep]
+        if len(items) < N and np.all(self.items[row] >= 0):
+            # not enough left once newer ratings are excluded
+            return None
+        return list(zip(items[:N].tolist(), scores[:N].tolist()))
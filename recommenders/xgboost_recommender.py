@@ -1,5 +1,8 @@
 import os
+import time
+import threading
 from dotenv import load_dotenv
+import numpy as np
 from logging_custom.logger import Logger
 import xgboost as xgb
 
@@ -7,12 +10,23 @@ import xgboost as xgb
 load_dotenv()
 MODEL_PATH = os.getenv("XGBOOST_MODEL_PATH")
 SCALER_PATH = os.getenv("STD_SCALER_PATH")
+# "catalog" ranks every movie, "sample" only a random draw of 100
+XGB_SCORING = os.getenv("XGB_SCORING", "catalog")
+XGB_NTHREAD = int(os.getenv("XGB_NTHREAD", os.cpu_count() or 1))
+XGB_CHUNK_SIZE = int(os.getenv("XGB_CHUNK_SIZE", 16384))
+# optional per request scoring budget in ms, 0 scores the whole catalog
+XGB_LATENCY_BUDGET_MS = float(os.getenv("XGB_LATENCY_BUDGET_MS", 0))
 
 class XGBoostRecommender:
-    def __init__(self):
+    def __init__(self, model_path: str = MODEL_PATH, scaler_path: str = SCALER_PATH):
         self.logger = Logger("XGBoostRecommender").get_logger()
-        self.model = self.load_model(MODEL_PATH)
-        self.scaler = self.load_scaler(SCALER_PATH)
+        self.model = self.load_model(model_path)
+        self.scaler = self.load_scaler(scaler_path)
+        self.booster = self.model.get_booster()
+        self.booster.set_param({'nthread': XGB_NTHREAD})
+        # catalog feature matrix, built on first use for a genre matrix
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
         self.logger.info("XGBoost Recommender initialized.")
     def load_model(self, model_path):
         if model_path and os.path.exists(model_path):
@@ -43,6 +57,92 @@ class XGBoostRecommender:
         self.logger.info(f"Prediction complete. Sample view: {preds[:5]}. Shape: {preds.shape}")
         preds = sorted(zip(movie_ids, preds), key=lambda x: x[1], reverse=True)
         # exclude seen movies
+        seen_movies = set(seen_movies)
         preds = [(movie_id, pred) for movie_id, pred in preds if movie_id not in seen_movies]
 
-        return preds
\ No newline at end of file
+        return preds
+
+    def catalog_features(self, genre_matrix, n_user_features):
+        """
+        (features, inverse) for the catalog. The model only sees user and genre columns, so
+        movies sharing a genre signature share a score: features holds one float32 row per
+        distinct signature (user columns left at 0) and inverse maps movie rows to it.
+        """
+        def current(catalog):
+            return catalog is not None and catalog[0] is genre_matrix and catalog[1].shape[1] == n_user_features + len(genre_matrix.genres)
+        catalog = self._catalog
+        if not current(catalog):
+            with self._catalog_lock:
+                if current(self._catalog):
+                    return self._catalog[1], self._catalog[2]
+                signatures, inverse = genre_matrix.signatures
+                features = np.zeros((len(signatures), n_user_features + len(genre_matrix.genres)), dtype=np.float32)
+                features[:, n_user_features:] = signatures
+                features.setflags(write=False)
+                self._catalog = catalog = (genre_matrix, features, inverse)
+                self.logger.info(f"Catalog feature matrix built. Movies: {len(inverse)}, distinct genre signatures: {len(features)}")
+        return catalog[1], catalog[2]
+
+    def rank_catalog(self, user_vector, genre_matrix, seen_movies, N=10, chunk_size=XGB_CHUNK_SIZE,
+                     budget_ms=XGB_LATENCY_BUDGET_MS):
+        """
+        Score every movie of the genre matrix for one preprocessed user vector and return the
+        top N unseen [(movieId, score)]. Signatures are scored in chunks with inplace_predict;
+        with a budget, chunks left when it runs out are skipped (in a random chunk order).
+        """
+        start = time.perf_counter()
+        user_vector = np.asarray(user_vector, dtype=np.float32).reshape(-1)
+        features, inverse = self.catalog_features(genre_matrix, len(user_vector))
+        signature_scores = np.full(len(features), -np.inf, dtype=np.float32)
+        chunk_starts = np.arange(0, len(features), chunk_size)
+        if budget_ms:
+            np.random.shuffle(chunk_starts)
+        scored = 0
+        for chunk_start in chunk_starts:
+            block = features[chunk_start:chunk_start + chunk_size].copy()
+            # broadcast the user block over the chunk
+            block[:, :len(user_vector)] = user_vector
+            signature_scores[chunk_start:chunk_start + len(block)] = self.booster.inplace_predict(block)
+            scored += len(block)
+            if budget_ms and (time.perf_counter() - start) * 1000 > budget_ms:
+                self.logger.warning(f"XGBoost scoring budget of {budget_ms} ms reached after {scored}/{len(features)} signatures")
+                break
+        scores = signature_scores[inverse]
+        # seen mask
+        seen_rows = genre_matrix.index.rows(np.asarray(list(seen_movies), dtype=np.int64))
+        scores[seen_rows[seen_rows >= 0]] = -np.inf
+        candidates = np.flatnonzero(np.isfinite(scores))
+        n = min(N, len(candidates))
+        if n == 0:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], n - 1)[:n]] if n < len(candidates) else candidates
+        top = top[np.argsort(-scores[top], kind='stable')]
+        self.logger.info(f"Ranked {len(inverse)} movies ({scored} signatures) in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return list(zip(genre_matrix.movie_ids[top].tolist(), scores[top].tolist()))
+
+    def score_movies(self, user_vector, genre_matrix, movieIds, chunk_size=256, budget_ms=0):
+        """
+        Scores of the given movies for one preprocessed user vector, in input order. Genre
+        signatures are scored in order of first appearance, so with a budget the movies
+        listed first are the ones scored; the rest (and unknown movies) get NaN.
+        """
+        start = time.perf_counter()
+        user_vector = np.asarray(user_vector, dtype=np.float32).reshape(-1)
+        features, inverse = self.catalog_features(genre_matrix, len(user_vector))
+        rows = genre_matrix.index.rows(np.asarray(movieIds, dtype=np.int64))
+        signatures = np.full(len(rows), -1, dtype=np.int64)
+        signatures[rows >= 0] = inverse[rows[rows >= 0]]
+        unique, first = np.unique(signatures[signatures >= 0], return_index=True)
+        unique = unique[np.argsort(first)]
+        signature_scores = np.full(len(features), np.nan, dtype=np.float32)
+        for chunk_start in range(0, len(unique), chunk_size):
+            chunk = unique[chunk_start:chunk_start + chunk_size]
+            block = features[chunk].copy()
+            block[:, :len(user_vector)] = user_vector
+            signature_scores[chunk] = self.booster.inplace_predict(block)
+            if budget_ms and (time.perf_counter() - start) * 1000 > budget_ms and chunk_start + chunk_size < len(unique):
+                self.logger.warning(f"XGBoost re-rank budget of {budget_ms} ms reached after {chunk_start + len(chunk)}/{len(unique)} signatures")
+                break
+        scores = np.full(len(rows), np.nan, dtype=np.float32)
+        scores[signatures >= 0] = signature_scores[signatures[signatures >= 0]]
+        return scores
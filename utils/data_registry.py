@@ -0,0 +1,70 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+from logging_custom.logger import Logger
+
+class DataRegistry:
+    """
+    Process-wide registry of loaded datasets and derived structures.
+    Unlike st.cache_data, a hit hands back the very same object instead of an unpickled copy,
+    so every session shares one read-only ratings table, genre matrix, model... Callers must
+    not modify what they get; a new value is published with swap(), which bumps the version.
+    """
+    def __init__(self):
+        self.logger = Logger("DataRegistry").get_logger()
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        return value
+
+    @staticmethod
+    def _nbytes(value):
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        return int(sum(v.nbytes for v in vars(value).values() if isinstance(v, np.ndarray))) if hasattr(value, '__dict__') else 0
+
+    def get(self, name: str, loader):
+        """Return the entry, loading it with loader() the first time."""
+        value = self._entries.get(name)
+        if value is not None:
+            return value
+        with self._lock:
+            if name not in self._entries:
+                start = time.perf_counter()
+                value = self._freeze(loader())
+                self._entries[name] = value
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self.logger.info(f"Loaded {name} (version {self._versions[name]}) in {time.perf_counter() - start:.2f}s. "
+                                 f"Approx. size: {self._nbytes(value) / 1e6:.1f} MB")
+            return self._entries[name]
+
+    def version(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def swap(self, name: str, value) -> int:
+        """Publish a new value for the entry. Readers holding the old one keep using it."""
+        with self._lock:
+            self._entries[name] = self._freeze(value)
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self.logger.info(f"Swapped {name} to version {self._versions[name]}")
+            return self._versions[name]
+
+    def invalidate(self, name: str):
+        """Drop the entry, the next get() reloads it."""
+        with self._lock:
+            if self._entries.pop(name, None) is not None:
+                self.logger.info(f"Invalidated {name}")
+
+@st.cache_resource
+def get_data_registry() -> DataRegistry:
+    """The registry of this server process."""
+    return DataRegistry()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from logging_custom.logger import Logger
+from utils.id_index import IdIndex
+
+class GenreMatrix:
+    """
+    Binary movie x genre matrix (uint8) built once from the movies table.
+    Rows follow ascending movieId and columns the alphabetical genre order of the old
+    pivot table, so vectors are identical to what pivot_genres produced.
+    """
+    def __init__(self, movies_df: pd.DataFrame):
+        self.logger = Logger("GenreMatrix").get_logger()
+        movies_df = movies_df.sort_values('movieId')
+        dummies = movies_df['genres'].str.get_dummies(sep='|')
+        dummies = dummies.drop(columns=['(no genres listed)'], errors='ignore')
+        self.genres = dummies.columns.tolist()
+        self.movie_ids = movies_df['movieId'].to_numpy(dtype=np.int64)
+        self.matrix = dummies.to_numpy(dtype=np.uint8)
+        self.matrix.setflags(write=False)
+        self.index = IdIndex(self.movie_ids)
+        self._packed = None
+        self._signatures = None
+        self.logger.info(f"Genre matrix built. Shape: {self.matrix.shape}, genres: {self.genres}")
+
+    @property
+    def packed(self) -> np.ndarray:
+        """Genre rows packed into bits, one byte per 8 genres."""
+        if self._packed is None:
+            self._packed = np.packbits(self.matrix, axis=1)
+            self._packed.setflags(write=False)
+        return self._packed
+
+    @property
+    def signatures(self):
+        """(signatures, inverse): distinct genre rows and, for every movie row, its signature."""
+        if self._signatures is None:
+            signatures, inverse = np.unique(self.matrix, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1).astype(np.int32)
+            signatures.setflags(write=False)
+            inverse.setflags(write=False)
+            self._signatures = (signatures, inverse)
+            self.logger.info(f"Distinct genre signatures: {len(signatures)}")
+        return self._signatures
+
+    def vector(self, movieId) -> np.ndarray:
+        row = self.index.row(movieId)
+        if row is None:
+            raise KeyError(f"Movie {movieId} not found in genre matrix")
+        return self.matrix[row]
+
+    def vectors(self, movieIds) -> np.ndarray:
+        rows = self.index.rows(movieIds)
+        if (rows < 0).any():
+            missing = np.asarray(movieIds)[rows < 0].tolist()
+            raise KeyError(f"Movies {missing} not found in genre matrix")
+        return self.matrix[rows]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.matrix, index=pd.Index(self.movie_ids, name='movieId'), columns=self.genres)
@@ -5,7 +5,6 @@ import numpy as np
 from bs4 import BeautifulSoup
 from io import BytesIO
 from PIL import Image
-import base64
 
 from logging_custom.logger import Logger
 
@@ -39,20 +38,31 @@ def search_image_directory(movieId):
     else:
         return None
 
+def decode_image(image_bytes):
+    # fully decode the bytes, a truncated body or an html page returns None
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        img.load()
+        return img
+    except Exception as e:
+        logger.warning(f"Failed to decode image bytes: {e}")
+        return None
+
 def get_image(imdb_id, movieId, links_helper):
     try:
         search_img = search_image_directory(movieId)
         if search_img:
             return search_img
 
-        if links_helper.search_img_data(movieId):
-            logger.info(f"Image found for {movieId} in database. Skipping download.")
-            base64_str = links_helper.search_img_data(movieId)
-            image_bytes = BytesIO(base64.b64decode(base64_str))
-            img = Image.open(image_bytes)
-            if not save_poster_directory(img, movieId):
-                logger.error(f"Failed to save image for movie {movieId}")
-            return img
+        poster_bytes = links_helper.search_img_data(movieId)
+        if poster_bytes is not None:
+            img = decode_image(poster_bytes)
+            if img is not None:
+                logger.info(f"Image found for {movieId} in poster store. Skipping download.")
+                if not save_poster_directory(img, movieId):
+                    logger.error(f"Failed to save image for movie {movieId}")
+                return img
+            logger.warning(f"Stored poster for movie {movieId} could not be decoded. Downloading again.")
         # if image not in links_helper, fetch from web
         logger.info(f"Fetching image for IMDb ID {imdb_id}")
         # get image url
@@ -62,14 +72,14 @@ def get_image(imdb_id, movieId, links_helper):
 
         # get image
         response = requests.get(img_url, headers=headers)
-        # convert image to base64
-        # base64_str = base64.b64encode(response.content).decode('utf-8')
-        # # update links_helper
-        # links_helper.update_links_img_data(movieId, base64_str)
-        
-        # read image in a numpy array
-        image_bytes = BytesIO(response.content)
-        img = Image.open(image_bytes)
+        response.raise_for_status()
+        img = decode_image(response.content)
+        if img is None:
+            logger.error(f"Downloaded poster for movie {movieId} is not a valid image")
+            return None
+        # keep a copy in the poster store, only once the bytes are known to decode
+        links_helper.update_poster(movieId, response.content)
+
         # save image in poster directory
         if not save_poster_directory(img, movieId):
             logger.error(f"Failed to save image for movie {movieId}")
@@ -0,0 +1,31 @@
+import numpy as np
+
+class IdIndex:
+    """Dense id -> row lookup array for non-negative integer ids (movieId, userId...)."""
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        size = int(self.ids.max()) + 1 if len(self.ids) else 0
+        self.lookup = np.full(size, -1, dtype=np.int32)
+        self.lookup[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+        self.lookup.setflags(write=False)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return self.row(id_) is not None
+
+    def rows(self, ids) -> np.ndarray:
+        """Rows of the given ids, -1 where an id is unknown."""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.full(ids.shape, -1, dtype=np.int32)
+        valid = (ids >= 0) & (ids < len(self.lookup))
+        rows[valid] = self.lookup[ids[valid]]
+        return rows
+
+    def row(self, id_):
+        """Row of a single id, or None if unknown."""
+        id_ = int(id_)
+        if 0 <= id_ < len(self.lookup) and self.lookup[id_] >= 0:
+            return int(self.lookup[id_])
+        return None
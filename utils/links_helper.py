@@ -1,10 +1,13 @@
 import os
+import base64
 from dotenv import load_dotenv
-import pandas as pd
-import streamlit as st
+import numpy as np
 from logging_custom.logger import Logger
 
 from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.id_index import IdIndex
+from utils.poster_store import PosterStore, get_poster_store
+from utils.data_registry import get_data_registry
 
 load_dotenv()
 LINKS_DATA = os.getenv("LINKS_DATA")
@@ -13,42 +16,78 @@ class LinksHelper:
     def __init__(self):
         self.logger = Logger("LinksHelper").get_logger()
         self.links_df = self.load_links_data_cached(LINKS_DATA)
+        self.links_index = self.build_links_index_cached(LINKS_DATA)
+        self.poster_store = get_poster_store()
         self.logger.info(f"Links dataframe loaded from {LINKS_DATA}")
 
     @staticmethod
-    @st.cache_data
     def load_links_data_cached(file_path):
+        # shared, read-only copy for the whole process
+        return get_data_registry().get(f"links:{file_path}", lambda: LinksHelper.load_links_data(file_path))
+
+    @staticmethod
+    def load_links_data(file_path):
         if file_path and os.path.exists(file_path):
-            return DataFrameManager(file_path).load_dataframe()
+            links_df = DataFrameManager(file_path).load_dataframe()
+            if 'base64_image' in links_df.columns:
+                links_df = LinksHelper.migrate_posters(links_df, file_path)
+            # formatted imdb ids ('tt' + 7 digit zero padded id), computed once
+            links_df['imdb'] = 'tt' + links_df['imdbId'].astype(str).str.zfill(7)
+            return links_df
         else:
             raise FileNotFoundError(f"Links data path {file_path} does not exist.")
+
+    @staticmethod
+    def migrate_posters(links_df, file_path):
+        """Move base64 posters from the links table into the poster store and drop the column."""
+        logger = Logger("LinksHelper").get_logger()
+        poster_store = PosterStore()
+        has_image = links_df['base64_image'].notna() & (links_df['base64_image'] != '')
+        for movieId, base64_str in zip(links_df.loc[has_image, 'movieId'], links_df.loc[has_image, 'base64_image']):
+            if movieId not in poster_store:
+                poster_store.put(movieId, base64.b64decode(base64_str))
+        links_df = links_df.drop(columns=['base64_image'])
+        DataFrameManager(file_path).save_dataframe(links_df, file_path)
+        logger.info(f"Moved {int(has_image.sum())} posters into {poster_store.pack_path}. Links data saved to {file_path}")
+        return links_df
+
+    @staticmethod
+    def build_links_index_cached(file_path):
+        # movieId -> row of links_df
+        return get_data_registry().get(f"links_index:{file_path}",
+                                       lambda: IdIndex(LinksHelper.load_links_data_cached(file_path)['movieId'].values))
+
+    def _rows(self, movieIds):
+        rows = self.links_index.rows(movieIds)
+        if (rows < 0).any():
+            missing = np.asarray(movieIds)[rows < 0].tolist()
+            self.logger.error(f"Movies {missing} not found in links data.")
+            raise KeyError(f"Movies {missing} not found in links data.")
+        return rows
+
+    def imdb_ids_for(self, movieIds):
+        return self.links_df['imdb'].values[self._rows(movieIds)]
+
+    def tmdb_ids_for(self, movieIds):
+        return self.links_df['tmdbId'].values[self._rows(movieIds)]
     
     def get_imdb_id(self, movieId):
         # self.logger.info(f"Fetching IMDb ID for movieId {movieId}")
-        imdb_id = str(self.links_df[self.links_df['movieId'] == movieId]['imdbId'].values[0])
-        # condition to match id
-        zero_prefix = 0
-        if len(imdb_id) < 7:
-            zero_prefix = 7 - len(imdb_id)
-        imdb_id = 'tt' + '0' * zero_prefix + imdb_id
-        
-        return imdb_id if len(imdb_id) > 0 else None
+        return self.imdb_ids_for([movieId])[0]
     
     def get_tmdb_id(self, movieId):
         self.logger.info(f"Fetching TMDb ID for movieId {movieId}")
-        tmdb_id = self.links_df[self.links_df['movieId'] == movieId]['tmdbId'].values
+        tmdb_id = self.tmdb_ids_for([movieId])
         return tmdb_id
     
     def search_img_data(self, movieId):
+        """Raw poster bytes (memoryview) of the movie from the poster store, or None."""
         self.logger.info(f"Searching image data for movieId {movieId}")
-        base64_str = self.links_df[self.links_df['movieId'] == movieId]['base64_image'].values[0]
-        if pd.notna(base64_str) and base64_str != '':
-            return base64_str
-        else:
-            return None
+        return self.poster_store.get(movieId)
     
+    def update_poster(self, movieId, image_bytes):
+        self.logger.info(f"Storing poster for movieId {movieId}.")
+        self.poster_store.put(movieId, image_bytes)
+
     def update_links_img_data(self, movieId, base64_str):
-        self.logger.info("Updating links data.")
-        self.links_df.loc[self.links_df['movieId'] == movieId, 'base64_image'] = base64_str
-        self.links_df.to_csv(LINKS_DATA, index=False)
-        self.logger.info(f"Links data updated and saved to {LINKS_DATA}.")
\ No newline at end of file
+        self.update_poster(movieId, base64.b64decode(base64_str))
@@ -1,10 +1,13 @@
 import os
 from dotenv import load_dotenv
 from logging_custom.logger import Logger
-import streamlit as st
 import numpy as np
 
 from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.genre_matrix import GenreMatrix
+from utils.id_index import IdIndex
+from utils.title_search import TitleSearchIndex
+from utils.data_registry import get_data_registry
 
 load_dotenv()
 
@@ -14,15 +17,62 @@ class MovieHelper:
     def __init__(self):
         self.logger = Logger("MovieHelper").get_logger()
         self.movies_df = self.load_movies_data_cached(MOVIES_DATA)
+        self.genre_matrix = self.build_genre_matrix_cached(MOVIES_DATA)
+        self.movie_index = self.build_movie_index_cached(MOVIES_DATA)
         self.logger.info(f"Movies dataframe loaded from {MOVIES_DATA}")
 
     @staticmethod
-    @st.cache_data
     def load_movies_data_cached(file_path):
+        # shared, read-only copy for the whole process
+        return get_data_registry().get(f"movies:{file_path}", lambda: MovieHelper.load_movies_data(file_path))
+
+    @staticmethod
+    def load_movies_data(file_path):
         if file_path and os.path.exists(file_path):
             return DataFrameManager(file_path).load_dataframe()
         else:
             raise FileNotFoundError(f"Movies data path {file_path} does not exist.")
+
+    @staticmethod
+    def build_genre_matrix_cached(file_path):
+        # one matrix per process, shared by every session
+        return get_data_registry().get(f"genre_matrix:{file_path}",
+                                       lambda: GenreMatrix(MovieHelper.load_movies_data_cached(file_path)))
+
+    @staticmethod
+    def build_movie_index_cached(file_path):
+        # movieId -> row of movies_df
+        return get_data_registry().get(f"movie_index:{file_path}",
+                                       lambda: IdIndex(MovieHelper.load_movies_data_cached(file_path)['movieId'].values))
+
+    @staticmethod
+    def build_title_index_cached(file_path):
+        return get_data_registry().get(f"title_index:{file_path}",
+                                       lambda: TitleSearchIndex(MovieHelper.load_movies_data_cached(file_path)))
+
+    def search_titles(self, query, k=20, min_year=None, max_year=None, genres=None):
+        self.logger.info(f"Searching titles for '{query}'")
+        return self.build_title_index_cached(MOVIES_DATA).search(query, k=k, min_year=min_year, max_year=max_year, genres=genres)
+
+    def _rows(self, movieIds):
+        rows = self.movie_index.rows(movieIds)
+        if (rows < 0).any():
+            missing = np.asarray(movieIds)[rows < 0].tolist()
+            self.logger.error(f"Movies {missing} not found in movies data.")
+            raise KeyError(f"Movies {missing} not found in movies data.")
+        return rows
+
+    def titles_for(self, movieIds):
+        return self.movies_df['title'].values[self._rows(movieIds)]
+
+    def genres_for(self, movieIds):
+        return self.movies_df['genres'].values[self._rows(movieIds)]
+
+    def get_title(self, movieId):
+        return self.titles_for([movieId])[0]
+
+    def get_genres(self, movieId):
+        return self.genres_for([movieId])[0]
     
     def explode_genres(self):
         self.logger.info("Exploding genres into separate rows.")
@@ -37,23 +87,18 @@ class MovieHelper:
     
     def pivot_genres(self):
         self.logger.info("Pivoting genres into binary vector format.")
-        exploded_df = self.explode_genres()
-        pivoted_df = exploded_df.pivot(index='movieId', columns='genres', values='title')
-        self.logger.info(f"Pivoted df shape: {pivoted_df.shape}, Columns: {pivoted_df.columns}")
-        pivoted_df = pivoted_df.notnull().astype(int)
-        pivoted_df = pivoted_df.drop(columns=['(no genres listed)'], errors='ignore')
+        pivoted_df = self.genre_matrix.to_frame()
         self.logger.info(f"Pivoted df shape: {pivoted_df.shape}, Columns: {pivoted_df.columns}")
         return pivoted_df
     
     def get_movie_vector(self, movieId):
         self.logger.info("Generating movie genre vector.")
-        genre_vector_df = self.pivot_genres()
-        movie_vector = np.array(genre_vector_df.loc[movieId]).reshape(1, -1)
+        movie_vector = self.genre_matrix.vector(movieId).reshape(1, -1)
         return movie_vector
     
     def get_choice_movie_vectors(self, movieIds):
         self.logger.info("Generating choice movie genre vectors.")
-        choice_movie_vectors = np.array([self.get_movie_vector(mid).flatten() for mid in movieIds])
+        choice_movie_vectors = self.genre_matrix.vectors(movieIds)
         return choice_movie_vectors
     
     def get_random_movies(self, n=10, rand_state=42):
@@ -63,14 +108,8 @@ class MovieHelper:
     
     def get_random_movie_vectors(self, n=100):
         self.logger.info(f"Generating genre vectors for {n} random movies.")
-        pivoted_df = self.pivot_genres()
-        self.logger.info(f"Pivoted df columns (genres): {pivoted_df.columns}")
-        random_movies = pivoted_df.sample(n=n)
-        self.logger.info(f"Random movies shape: {random_movies.shape}")
-        movieIds = random_movies.index.tolist()
-        random_movie_vectors = random_movies.values
+        rows = np.random.choice(len(self.genre_matrix.movie_ids), size=n, replace=False)
+        movieIds = self.genre_matrix.movie_ids[rows].tolist()
+        random_movie_vectors = self.genre_matrix.matrix[rows]
+        self.logger.info(f"Random movies shape: {random_movie_vectors.shape}")
         return movieIds, random_movie_vectors
-        
-
-
-    
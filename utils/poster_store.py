@@ -0,0 +1,112 @@
+import os
+import mmap
+import threading
+from dotenv import load_dotenv
+import numpy as np
+import streamlit as st
+from logging_custom.logger import Logger
+
+try:
+    import fcntl
+except ImportError:  # windows: single writer process assumed
+    fcntl = None
+
+load_dotenv()
+
+LINKS_DATA = os.getenv("LINKS_DATA")
+POSTER_PACK = os.getenv("POSTER_PACK") or os.path.join(os.path.dirname(LINKS_DATA or ""), "posters.pack")
+
+class PosterStore:
+    """
+    Poster images packed into one append-only file, with a fixed-slot index file.
+    Slot movieId of the index holds (offset, length) of the poster in the pack, so a lookup is
+    one slot read and a zero-copy slice of the memory-mapped pack. Writes append the image and
+    then fill the slot, readers never see a slot pointing past the data.
+    """
+    SLOT = np.dtype([('offset', '<u8'), ('length', '<u8')])
+
+    def __init__(self, pack_path: str = POSTER_PACK):
+        self.logger = Logger("PosterStore").get_logger()
+        self.pack_path = pack_path
+        self.index_path = os.path.splitext(pack_path)[0] + ".idx"
+        self._lock = threading.Lock()
+        # (slots, pack map) swapped as one tuple, readers never pair an index with the wrong map
+        self._mapped = (np.zeros(0, dtype=self.SLOT), None)
+        self._mapped_sizes = (0, 0)
+        self._remap()
+        self.logger.info(f"Poster store at {self.pack_path}. Indexed slots: {len(self._mapped[0])}")
+
+    @staticmethod
+    def _map(path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _file_sizes(self):
+        return tuple(os.path.getsize(path) if os.path.exists(path) else 0 for path in (self.pack_path, self.index_path))
+
+    def _remap(self):
+        # old maps are left to the garbage collector, memoryviews handed out may still use them
+        self._mapped_sizes = self._file_sizes()
+        pack_map = self._map(self.pack_path)
+        index_map = self._map(self.index_path)
+        if index_map is None:
+            slots = np.zeros(0, dtype=self.SLOT)
+        else:
+            slots = np.frombuffer(index_map, dtype=self.SLOT, count=len(index_map) // self.SLOT.itemsize)
+        self._mapped = (slots, pack_map)
+
+    @staticmethod
+    def _slot(slots, movieId):
+        movieId = int(movieId)
+        if movieId < 0 or movieId >= len(slots):
+            return 0, 0
+        slot = slots[movieId]
+        return int(slot['offset']), int(slot['length'])
+
+    def get(self, movieId):
+        """Poster bytes of the movie as a memoryview into the pack, or None."""
+        slots, pack_map = self._mapped
+        offset, length = self._slot(slots, movieId)
+        if length == 0 and self._file_sizes() != self._mapped_sizes:
+            # written by another process since the files were mapped
+            with self._lock:
+                self._remap()
+                slots, pack_map = self._mapped
+            offset, length = self._slot(slots, movieId)
+        if length == 0:
+            return None
+        return memoryview(pack_map)[offset:offset + length]
+
+    def __contains__(self, movieId):
+        return self._slot(self._mapped[0], movieId)[1] > 0
+
+    def put(self, movieId, data: bytes):
+        """Append a poster and point the movie's slot at it."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.pack_path)), exist_ok=True)
+        with self._lock:
+            index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT, 0o644)
+            pack_fd = os.open(self.pack_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(index_fd, fcntl.LOCK_EX)
+                offset = os.fstat(pack_fd).st_size
+                os.write(pack_fd, data)
+                os.fsync(pack_fd)
+                slot = np.array([(offset, len(data))], dtype=self.SLOT).tobytes()
+                os.lseek(index_fd, int(movieId) * self.SLOT.itemsize, os.SEEK_SET)
+                os.write(index_fd, slot)
+                os.fsync(index_fd)
+            finally:
+                if fcntl:
+                    fcntl.flock(index_fd, fcntl.LOCK_UN)
+                os.close(pack_fd)
+                os.close(index_fd)
+            self._remap()
+        self.logger.info(f"Poster for movie {movieId} stored ({len(data)} bytes at offset {offset})")
+
+@st.cache_resource
+def get_poster_store(pack_path: str = POSTER_PACK) -> PosterStore:
+    """Process-wide poster store shared by every session."""
+    return PosterStore(pack_path)
@@ -0,0 +1,189 @@
+import io
+import os
+import queue
+import struct
+import threading
+import time
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+import streamlit as st
+from logging_custom.logger import Logger
+
+try:
+    import fcntl
+except ImportError:  # windows: no advisory locks, rely on O_APPEND only
+    fcntl = None
+
+load_dotenv()
+
+RATINGS_DATA = os.getenv("RATINGS_DATA")
+NEW_RATINGS_DATA = os.getenv("NEW_RATINGS_DATA") or os.path.join(os.path.dirname(RATINGS_DATA or ""), "new_ratings.csv")
+# "csv" appends plain lines to new_ratings.csv, "binary" appends fixed 16 byte records to new_ratings.bin
+RATINGS_LOG_FORMAT = os.getenv("RATINGS_LOG_FORMAT", "csv").lower()
+
+class RatingEventLog:
+    """
+    Append-only log of rating events.
+    Writers hand events to a background thread that groups everything queued within
+    commit_interval into a single append + fsync, so the cost of a rating is independent of
+    the log size. Appends use O_APPEND under an exclusive file lock, which keeps records from
+    several sessions and server processes whole.
+    """
+    COLUMNS = ['userId', 'movieId', 'rating', 'timestamp']
+    RECORD = struct.Struct('<iifI')
+    RECORD_DTYPE = np.dtype([('userId', '<i4'), ('movieId', '<i4'), ('rating', '<f4'), ('timestamp', '<u4')])
+
+    def __init__(self, file_path: str = NEW_RATINGS_DATA, log_format: str = RATINGS_LOG_FORMAT,
+                 commit_interval: float = 0.05, max_batch: int = 1024):
+        self.logger = Logger("RatingEventLog").get_logger()
+        if log_format not in ("csv", "binary"):
+            self.logger.error(f"Unknown ratings log format {log_format}")
+            raise ValueError(f"Unknown ratings log format {log_format}. Use 'csv' or 'binary'.")
+        self.log_format = log_format
+        self.file_path = os.path.splitext(file_path)[0] + ".bin" if log_format == "binary" else file_path
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.logger.info(f"Rating event log at {self.file_path} ({self.log_format})")
+
+    def append(self, userId, movieId, rating, timestamp=None, wait=True):
+        """Queue a single rating event. With wait=True, block until it is durable on disk."""
+        if timestamp is None:
+            timestamp = int(time.time())
+        return self._submit([(int(userId), int(movieId), float(rating), int(timestamp))], wait)
+
+    def append_many(self, ratings, wait=True):
+        """Queue several events given as a DataFrame or a dict of lists with the log columns."""
+        ratings = pd.DataFrame(ratings)
+        if ratings.empty:
+            return True
+        records = list(zip(ratings['userId'].astype(int), ratings['movieId'].astype(int),
+                           ratings['rating'].astype(float), ratings['timestamp'].astype(int)))
+        return self._submit(records, wait)
+
+    def _submit(self, records, wait):
+        self._ensure_writer()
+        done = threading.Event()
+        result = {}
+        self._queue.put((records, done, result))
+        if not wait:
+            return True
+        done.wait()
+        if 'error' in result:
+            raise result['error']
+        return True
+
+    def _ensure_writer(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="RatingEventLogWriter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # group commit: collect whatever else arrives within the commit interval
+            deadline = time.monotonic() + self.commit_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            records = [record for records, _, _ in batch for record in records]
+            try:
+                self._write(records)
+                self.logger.info(f"Committed {len(records)} rating events from {len(batch)} writers")
+            except Exception as e:
+                self.logger.error(f"Failed to commit rating events: {e}")
+                for _, _, result in batch:
+                    result['error'] = e
+            for _, done, _ in batch:
+                done.set()
+
+    def _encode(self, records) -> bytes:
+        if self.log_format == "binary":
+            return b"".join(self.RECORD.pack(*record) for record in records)
+        return "".join(f"{u},{m},{r},{t}\n" for u, m, r, t in records).encode()
+
+    def _write(self, records):
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            data = self._encode(records)
+            if self.log_format == "csv" and os.fstat(fd).st_size == 0:
+                data = (",".join(self.COLUMNS) + "\n").encode() + data
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def truncate_if_consumed(self, offset: int) -> bool:
+        """Empty the log if nothing was appended after offset. Returns True if it was truncated."""
+        if not os.path.exists(self.file_path):
+            return False
+        fd = os.open(self.file_path, os.O_RDWR)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != offset:
+                return False
+            os.ftruncate(fd, 0)
+            os.fsync(fd)
+            self.logger.info(f"Rating event log {self.file_path} fully consumed and truncated")
+            return True
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def tail(self, offset: int, length: int = 64):
+        """The length bytes ending at offset, or None if the log is shorter than offset."""
+        if offset > self.size():
+            return None
+        with open(self.file_path, 'rb') as f:
+            f.seek(max(offset - length, 0))
+            return f.read(offset - max(offset - length, 0))
+
+    def size(self) -> int:
+        return os.path.getsize(self.file_path) if os.path.exists(self.file_path) else 0
+
+    def read(self, offset: int = 0):
+        """
+        Read the events stored after byte offset.
+        Returns (DataFrame, end_offset); end_offset is the position after the last complete record.
+        """
+        empty = pd.DataFrame(columns=self.COLUMNS)
+        if not os.path.exists(self.file_path):
+            return empty, offset
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        if self.log_format == "binary":
+            complete = len(data) - len(data) % self.RECORD.size
+            events = pd.DataFrame(np.frombuffer(data[:complete], dtype=self.RECORD_DTYPE))
+            return (events if len(events) else empty), offset + complete
+        # only consume up to the last full line, a writer may be mid-append
+        complete = data.rfind(b"\n") + 1
+        if complete == 0:
+            return empty, offset
+        chunk = data[:complete]
+        if offset == 0:
+            events = pd.read_csv(io.BytesIO(chunk))
+        else:
+            events = pd.read_csv(io.BytesIO(chunk), header=None, names=self.COLUMNS)
+        return events, offset + complete
+
+@st.cache_resource
+def get_rating_log(file_path: str = NEW_RATINGS_DATA, log_format: str = RATINGS_LOG_FORMAT) -> RatingEventLog:
+    """Process-wide rating log writer shared by every session."""
+    return RatingEventLog(file_path, log_format)
@@ -1,74 +1,256 @@
 import os
+import json
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import numpy as np
 import pandas as pd
-import streamlit as st
 from logging_custom.logger import Logger
+from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.ratings_index import RatingsIndex
+from utils.rating_log import get_rating_log
+from utils.data_registry import get_data_registry
+
+try:
+    import fcntl
+except ImportError:  # windows: no advisory locks, merges are not serialized
+    fcntl = None
 
 load_dotenv()
 
 RATINGS_DATA = os.getenv("RATINGS_DATA")
+# number of delta segments after which they are folded back into the base ratings file
+RATINGS_COMPACT_SEGMENTS = int(os.getenv("RATINGS_COMPACT_SEGMENTS", 10))
+
+@contextmanager
+def _merge_lock(file_path):
+    """
+    Exclusive lock on the merge state (ratings_state.json, delta segments and the log watermark)
+    of file_path, shared by every server process and thread.
+    """
+    fd = os.open(os.path.join(os.path.dirname(file_path), "ratings_state.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
 
 class RatingsHelper:
     def __init__(self):
         self.logger = Logger("RatingsHelper").get_logger()
         self.ratings_df = self.load_ratings_data_cached(RATINGS_DATA)
+        self.ratings_index = self.build_ratings_index_cached(RATINGS_DATA)
+        # users touched by the last update_ratings_from_new_ratings
+        self.updated_users = np.empty(0, dtype=np.int64)
         self.logger.info(f"Ratings data loaded from {RATINGS_DATA}")
 
     @staticmethod
-    @st.cache_data
     def load_ratings_data_cached(file_path):
+        # shared, read-only copy for the whole process
+        return get_data_registry().get(f"ratings:{file_path}", lambda: RatingsHelper.load_ratings_data(file_path))
+
+    @staticmethod
+    def load_ratings_data(file_path):
         if file_path and os.path.exists(file_path):
-            return pd.read_csv(file_path)
+            ratings_df = DataFrameManager(file_path).load_dataframe()
+            # apply delta segments not yet compacted, later segments win
+            state = RatingsHelper.load_merge_state(file_path)
+            segments = state['segments']
+            if segments:
+                deltas = [DataFrameManager(os.path.join(os.path.dirname(file_path), segment)).load_dataframe() for segment in segments]
+                ratings_df = pd.concat([ratings_df, *deltas], ignore_index=True)
+                ratings_df = ratings_df.drop_duplicates(subset=['userId', 'movieId'], keep='last').reset_index(drop=True)
+            # merges this table includes, to notice merges done by other server processes
+            ratings_df.attrs['merge_generation'] = state['next_segment']
+            return ratings_df
         else:
             raise FileNotFoundError(f"Ratings data path {file_path} does not exist.")
+
+    @staticmethod
+    def _merge_state_path(file_path):
+        return os.path.join(os.path.dirname(file_path), "ratings_state.json")
+
+    @staticmethod
+    def load_merge_state(file_path):
+        """Watermark of the rating log and the delta segments written since the last compaction."""
+        state_path = RatingsHelper._merge_state_path(file_path)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                return json.load(f)
+        return {'log_offset': 0, 'segments': [], 'next_segment': 0}
+
+    @staticmethod
+    def _save_merge_state(file_path, state):
+        state_path = RatingsHelper._merge_state_path(file_path)
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def _recover_log_truncation(file_path, state):
+        """
+        Finish a log truncation interrupted by a crash. The pending marker keeps the consumed offset
+        and the bytes before it: if the log still holds them it was not truncated and the offset
+        stays, otherwise it was and reading restarts from the beginning.
+        """
+        pending = state.pop('log_truncation', None)
+        if pending is None:
+            return state
+        if get_rating_log().tail(pending['offset']) != bytes.fromhex(pending['tail']):
+            state['log_offset'] = 0
+        RatingsHelper._save_merge_state(file_path, state)
+        return state
+
+    @staticmethod
+    def build_ratings_index_cached(file_path):
+        return get_data_registry().get(f"ratings_index:{file_path}",
+                                       lambda: RatingsIndex(RatingsHelper.load_ratings_data_cached(file_path)))
     
     def update_ratings(self, userId, movieId, rating, timestamp):
         self.logger.info(f"Updating rating for movie {movieId} by user {userId}: {rating}")
         # Check if the user-movie pair already exists
-        mask = (self.ratings_df['userId'] == userId) & (self.ratings_df['movieId'] == movieId)
-        if self.ratings_df[mask].empty:
+        if self.ratings_index.rating(userId, movieId) is None:
             # Insert new rating
             new_row = {'userId': [userId], 'movieId': [movieId], 'rating': [rating], 'timestamp': [timestamp]}
             self.ratings_df = pd.concat([self.ratings_df, pd.DataFrame(new_row)], ignore_index=True)
+            # private copy of the index too: its rows point into this session's ratings_df
+            self.ratings_index = self.ratings_index.copy()
+            self.ratings_index.upsert(userId, movieId, rating, row=len(self.ratings_df) - 1)
             self.logger.info("Inserted new rating.")
         else:
-            # Update existing rating
+            # Update existing rating on a private copy, the loaded table is shared
+            self.ratings_df = self.ratings_df.copy()
+            mask = (self.ratings_df['userId'] == userId) & (self.ratings_df['movieId'] == movieId)
             self.ratings_df.loc[mask, 'rating'] = rating
             self.ratings_df.loc[mask, 'timestamp'] = int(np.datetime64('now').astype('int64') // 1e9)
+            self.ratings_index = self.ratings_index.copy()
+            self.ratings_index.upsert(userId, movieId, rating)
             self.logger.info("Updated existing rating.")
         return True
     
     def get_user_movie_seen(self, userId):
         self.logger.info(f"Fetching movies seen by userId {userId}")
-        seen_movies = self.ratings_df[self.ratings_df['userId'] == userId]['movieId'].values.tolist()
+        seen_movies = self.ratings_index.seen(userId).tolist()
         return seen_movies
     
     def get_user_movie_rating(self, userId, movieId):
-        rating = self.ratings_df.loc[(self.ratings_df['userId'] == userId) & (self.ratings_df['movieId'] == movieId)]['rating'].values[0]
+        rating = self.ratings_index.rating(userId, movieId)
+        if rating is None:
+            raise ValueError(f"User {userId} has not rated movie {movieId}")
         # self.logger.info(f"Rating by user {userId} to movie {movieId}: {rating}")
         return rating
+
+    def get_user_ratings(self, userId):
+        movie_ids, ratings = self.ratings_index.user_ratings_of(userId)
+        return pd.DataFrame({'movieId': movie_ids, 'rating': ratings})
+
+    def get_movie_ratings(self, movieId):
+        user_ids, ratings = self.ratings_index.item_ratings_of(movieId)
+        return pd.DataFrame({'userId': user_ids, 'rating': ratings})
+
+    def get_movie_avg_rating(self, movieId):
+        return self.ratings_index.item_mean(movieId)
     
+    def _upsert_ratings(self, new_ratings_df):
+        """
+        Upsert new ratings into ratings_df and the index.
+        Returns the deduplicated delta and the rows it replaced (previous values).
+        """
+        columns = ['userId', 'movieId', 'rating', 'timestamp']
+        # latest event wins inside the delta
+        delta_df = new_ratings_df[columns].sort_values('timestamp', kind='stable')
+        delta_df = delta_df.drop_duplicates(subset=['userId', 'movieId'], keep='last').reset_index(drop=True)
+        delta_df = delta_df.astype(self.ratings_df[columns].dtypes.to_dict())
+        rows = np.array([self.ratings_index.locate(u, m) for u, m in zip(delta_df['userId'], delta_df['movieId'])], dtype=object)
+        existing = np.array([row is not None for row in rows], dtype=bool)
+        existing_rows = rows[existing].astype(np.int64)
+        replaced_df = self.ratings_df.iloc[existing_rows][columns].copy()
+        updates = delta_df[existing]
+        inserts = delta_df[~existing]
+        first_row = len(self.ratings_df)
+        # build a new table (the loaded one is shared): append new pairs, then update existing pairs
+        ratings_df = pd.concat([self.ratings_df, inserts], ignore_index=True)
+        for column in ['rating', 'timestamp']:
+            ratings_df.iloc[existing_rows, ratings_df.columns.get_loc(column)] = updates[column].values
+        self.ratings_df = ratings_df
+        # same for the index: the shared one keeps matching the shared table until both are swapped
+        ratings_index = self.ratings_index.copy()
+        for row, (u, m, r) in enumerate(zip(updates['userId'], updates['movieId'], updates['rating'])):
+            ratings_index.upsert(u, m, r, row=int(existing_rows[row]))
+        for row, (u, m, r) in enumerate(zip(inserts['userId'], inserts['movieId'], inserts['rating'])):
+            ratings_index.upsert(u, m, r, row=first_row + row)
+        self.ratings_index = ratings_index
+        self.logger.info(f"Upserted {len(delta_df)} ratings: {len(updates)} updated, {len(inserts)} inserted")
+        return delta_df, replaced_df
+
     def update_ratings_from_new_ratings(self, users_helper):
-        new_ratings_path = os.path.join(os.path.dirname(RATINGS_DATA), "new_ratings.csv")
-        if os.path.exists(new_ratings_path):
-            new_ratings_df = pd.read_csv(new_ratings_path)
-            self.logger.info(f"Ratings shape before concat: {self.ratings_df.shape}")
-            combined_df = pd.concat([self.ratings_df, new_ratings_df], ignore_index=True)
-            self.logger.info(f"Combined df shape after concat: {combined_df.shape}")
-            if combined_df.shape[0] == self.ratings_df.shape[0] + new_ratings_df.shape[0]:
-                # Keep only the last occurrence for each userId-movieId pair
-                combined_df = combined_df.sort_values('timestamp').drop_duplicates(subset=['userId', 'movieId'], keep='last')
-                self.ratings_df = combined_df
-                self.logger.info(f"Final Ratings shape after concat and dropping duplicates: {self.ratings_df.shape}")
-                self.ratings_df.to_csv(RATINGS_DATA, index=False)
-                self.logger.info(f"Ratings data updated and saved to {RATINGS_DATA}")
-                # also update the users data
-                users_helper.update_user_data_from_ratings(combined_df)
+        rating_log = get_rating_log()
+        new_ratings_path = rating_log.file_path
+        if not os.path.exists(new_ratings_path):
+            self.logger.warning(f"New ratings log not found at {new_ratings_path}")
+            return
+        with _merge_lock(RATINGS_DATA):
+            state = self._recover_log_truncation(RATINGS_DATA, self.load_merge_state(RATINGS_DATA))
+            reloaded = self.ratings_df.attrs.get('merge_generation') != state['next_segment']
+            if reloaded:
+                # another server process merged segments this table does not have
+                self.logger.info("Ratings were merged by another process, reloading them")
+                self.ratings_df = self.load_ratings_data(RATINGS_DATA)
+                self.ratings_index = RatingsIndex(self.ratings_df)
+            # only events appended after the high-water mark
+            new_ratings_df, end_offset = rating_log.read(state['log_offset'])
+            self.logger.info(f"Read {len(new_ratings_df)} new ratings from offset {state['log_offset']} to {end_offset}")
+            if new_ratings_df.empty:
+                self.logger.info("No new ratings since last merge.")
+                if reloaded:
+                    get_data_registry().swap(f"ratings:{RATINGS_DATA}", self.ratings_df)
+                    get_data_registry().swap(f"ratings_index:{RATINGS_DATA}", self.ratings_index.freeze())
                 return True
-            else:
-                self.logger.error("Before and after ratings shape are not correct.")
-                raise ValueError("Mistmatch in num ratings and combined dataframe. Please try again.")
-        else:
-            self.logger.warning(f"new_ratings.csv not found at {new_ratings_path}")
-    
\ No newline at end of file
+            delta_df, replaced_df = self._upsert_ratings(new_ratings_df)
+            self.updated_users = delta_df['userId'].unique()
+            # persist the delta as a new segment, then move the watermark
+            segment = f"ratings_delta_{state['next_segment']:05d}.csv"
+            DataFrameManager(RATINGS_DATA).save_dataframe(delta_df, os.path.join(os.path.dirname(RATINGS_DATA), segment))
+            state['segments'].append(segment)
+            state['next_segment'] += 1
+            state['log_offset'] = end_offset
+            self._save_merge_state(RATINGS_DATA, state)
+            self.ratings_df.attrs['merge_generation'] = state['next_segment']
+            self.logger.info(f"Delta segment {segment} written. Pending segments: {len(state['segments'])}")
+            if len(state['segments']) >= RATINGS_COMPACT_SEGMENTS:
+                self.compact_ratings(state)
+        # publish the merged table and index to every session
+        get_data_registry().swap(f"ratings:{RATINGS_DATA}", self.ratings_df)
+        get_data_registry().swap(f"ratings_index:{RATINGS_DATA}", self.ratings_index.freeze())
+        # also update the users data
+        users_helper.update_user_data_from_ratings(delta_df, replaced_df, self.ratings_df)
+        return True
+
+    def compact_ratings(self, state=None):
+        """Fold delta segments into the base ratings file and truncate the consumed rating log."""
+        state = state or self._recover_log_truncation(RATINGS_DATA, self.load_merge_state(RATINGS_DATA))
+        self.logger.info(f"Compacting {len(state['segments'])} delta segments into {RATINGS_DATA}")
+        data_manager = DataFrameManager(RATINGS_DATA)
+        data_manager.save_dataframe(self.ratings_df, RATINGS_DATA)
+        segments = state['segments']
+        state['segments'] = []
+        # the reset of log_offset must survive a crash right after the truncation: persist a pending
+        # marker first, then truncate, then save the reset offset without it
+        rating_log = get_rating_log()
+        if state['log_offset'] > 0:
+            state['log_truncation'] = {'offset': state['log_offset'], 'tail': rating_log.tail(state['log_offset']).hex()}
+            self._save_merge_state(RATINGS_DATA, state)
+        if rating_log.truncate_if_consumed(state['log_offset']):
+            state['log_offset'] = 0
+        state.pop('log_truncation', None)
+        self._save_merge_state(RATINGS_DATA, state)
+        for segment in segments:
+            segment_path = os.path.join(os.path.dirname(RATINGS_DATA), segment)
+            for path in (segment_path, data_manager.columnar_path(segment_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.logger.info(f"Ratings data compacted and saved to {RATINGS_DATA}")
+        return True
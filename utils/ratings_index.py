@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from logging_custom.logger import Logger
+
+class RatingsIndex:
+    """
+    CSR-style index over the ratings table.
+    Ratings are kept twice: sorted by (userId, movieId) and by (movieId, userId), each with
+    an offsets array, so a user's or a movie's ratings are a single contiguous slice found by
+    binary search. Upserts go to a small overlay that is folded into the arrays once it grows
+    past overlay_limit.
+    """
+    def __init__(self, ratings_df: pd.DataFrame, overlay_limit: int = 10000):
+        self.logger = Logger("RatingsIndex").get_logger()
+        self.overlay_limit = overlay_limit
+        self._build(ratings_df['userId'].values, ratings_df['movieId'].values, ratings_df['rating'].values)
+
+    def _build(self, users, items, ratings, rows=None):
+        users = np.asarray(users)
+        items = np.asarray(items)
+        ratings = np.asarray(ratings)
+        # row position of every rating in the source dataframe
+        rows = np.arange(len(users), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+        # user major layout
+        order = np.lexsort((items, users))
+        self.user_ids, self.user_offsets = self._offsets(users[order])
+        self.user_items = items[order]
+        self.user_ratings = ratings[order]
+        self.user_rows = rows[order]
+        # item major layout
+        order = np.lexsort((users, items))
+        self.item_ids, self.item_offsets = self._offsets(items[order])
+        self.item_users = users[order]
+        self.item_ratings = ratings[order]
+        # pending upserts: {userId: {movieId: rating}} and the mirror {movieId: {userId: rating}}
+        self._user_overlay = {}
+        self._item_overlay = {}
+        self._overlay_rows = {}
+        self._overlay_size = 0
+        # (user_ids, item_ids, CSR matrix), built here and by freeze() so that readers never build it
+        self._matrix = self._matrix_of(self.user_ids, self.user_offsets, self.user_items, self.user_ratings,
+                                       self.item_ids)
+        self.logger.info(f"Ratings index built. Ratings: {len(ratings)}, users: {len(self.user_ids)}, items: {len(self.item_ids)}")
+
+    @staticmethod
+    def _offsets(sorted_keys):
+        keys, starts = np.unique(sorted_keys, return_index=True)
+        offsets = np.append(starts, len(sorted_keys)).astype(np.int64)
+        return keys, offsets
+
+    @staticmethod
+    def _slice(keys, offsets, key):
+        pos = np.searchsorted(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            return offsets[pos], offsets[pos + 1]
+        return 0, 0
+
+    @staticmethod
+    def _merge(base_keys, base_values, overrides: dict):
+        """Apply {key: value} overrides to a sorted (keys, values) slice."""
+        if not overrides:
+            return base_keys, base_values
+        keys = np.fromiter(overrides.keys(), dtype=base_keys.dtype, count=len(overrides))
+        values = np.fromiter(overrides.values(), dtype=base_values.dtype, count=len(overrides))
+        keep = ~np.isin(base_keys, keys)
+        merged_keys = np.concatenate([base_keys[keep], keys])
+        merged_values = np.concatenate([base_values[keep], values])
+        order = np.argsort(merged_keys, kind='stable')
+        return merged_keys[order], merged_values[order]
+
+    def user_ratings_of(self, userId):
+        """Return (movieIds, ratings) rated by the user, sorted by movieId."""
+        start, end = self._slice(self.user_ids, self.user_offsets, userId)
+        return self._merge(self.user_items[start:end], self.user_ratings[start:end], self._user_overlay.get(userId))
+
+    def item_ratings_of(self, movieId):
+        """Return (userIds, ratings) for the movie, sorted by userId."""
+        start, end = self._slice(self.item_ids, self.item_offsets, movieId)
+        return self._merge(self.item_users[start:end], self.item_ratings[start:end], self._item_overlay.get(movieId))
+
+    def seen(self, userId):
+        return self.user_ratings_of(userId)[0]
+
+    def _find(self, userId, movieId):
+        """Position of the pair in the user major arrays, or None."""
+        start, end = self._slice(self.user_ids, self.user_offsets, userId)
+        items = self.user_items[start:end]
+        pos = np.searchsorted(items, movieId)
+        if pos < len(items) and items[pos] == movieId:
+            return start + pos
+        return None
+
+    def rating(self, userId, movieId):
+        """Rating of the user for the movie, or None if not rated."""
+        overlay = self._user_overlay.get(userId)
+        if overlay and movieId in overlay:
+            return overlay[movieId]
+        pos = self._find(userId, movieId)
+        return None if pos is None else self.user_ratings[pos]
+
+    def locate(self, userId, movieId):
+        """Row position of the pair in the source dataframe, or None if not present."""
+        row = self._overlay_rows.get((userId, movieId))
+        if row is not None:
+            return None if row < 0 else row
+        pos = self._find(userId, movieId)
+        return None if pos is None else int(self.user_rows[pos])
+
+    @staticmethod
+    def _matrix_of(user_ids, user_offsets, user_items, user_ratings, item_ids):
+        # the user major arrays already are CSR, only movieIds need mapping to columns
+        columns = np.searchsorted(item_ids, user_items).astype(np.int32)
+        matrix = sp.csr_matrix((np.asarray(user_ratings, dtype=np.float32), columns, user_offsets),
+                               shape=(len(user_ids), len(item_ids)))
+        return user_ids, item_ids, matrix
+
+    def _merged_matrix(self):
+        users, items, ratings, _ = self._merged_arrays()
+        order = np.lexsort((items, users))
+        user_ids, user_offsets = self._offsets(users[order])
+        return self._matrix_of(user_ids, user_offsets, items[order], ratings[order], np.unique(items))
+
+    def rating_matrix(self):
+        """
+        (user_ids, item_ids, matrix): user x movie CSR matrix of ratings, pending upserts included;
+        row i is user_ids[i], column j is item_ids[j]. Read only: an index that was changed and not
+        frozen yet gets a matrix built for this call.
+        """
+        return self._matrix if self._matrix is not None else self._merged_matrix()
+
+    def freeze(self):
+        """Build the derived matrix of an index before it is shared (see DataRegistry.swap)."""
+        if self._matrix is None:
+            self._matrix = self._merged_matrix()
+        return self
+
+    def item_mean(self, movieId):
+        ratings = self.item_ratings_of(movieId)[1]
+        return float(ratings.mean()) if len(ratings) else None
+
+    def copy(self):
+        """
+        Index with the same ratings whose overlay can be changed without affecting this one.
+        The CSR arrays are shared, they are never modified in place (compact() replaces them).
+        """
+        index = object.__new__(RatingsIndex)
+        index.__dict__.update(self.__dict__)
+        index._user_overlay = {userId: dict(overrides) for userId, overrides in self._user_overlay.items()}
+        index._item_overlay = {movieId: dict(overrides) for movieId, overrides in self._item_overlay.items()}
+        index._overlay_rows = dict(self._overlay_rows)
+        return index
+
+    def upsert(self, userId, movieId, rating, row=None):
+        """
+        Insert or update a rating. row is its position in the source dataframe, if known.
+        Only for an index owned by the caller (see copy()), never one shared through the registry.
+        """
+        self._matrix = None
+        user_overlay = self._user_overlay.setdefault(userId, {})
+        if movieId not in user_overlay:
+            self._overlay_size += 1
+        user_overlay[movieId] = rating
+        self._item_overlay.setdefault(movieId, {})[userId] = rating
+        if row is None:
+            row = self.locate(userId, movieId)
+        self._overlay_rows[(userId, movieId)] = -1 if row is None else row
+        if self._overlay_size > self.overlay_limit:
+            self.compact()
+
+    def compact(self):
+        """Fold the overlay into the CSR arrays."""
+        if not self._overlay_size:
+            return
+        self.logger.info(f"Compacting {self._overlay_size} pending ratings into the index")
+        self._build(*self._merged_arrays())
+
+    def _merged_arrays(self):
+        """(users, items, ratings, rows) of the CSR arrays with the overlay applied, unsorted."""
+        users = np.repeat(self.user_ids, np.diff(self.user_offsets))
+        items = self.user_items
+        ratings = self.user_ratings
+        rows = self.user_rows
+        if not self._overlay_size:
+            return users, items, ratings, rows
+        new_users, new_items, new_ratings, new_rows = [], [], [], []
+        for userId, overrides in self._user_overlay.items():
+            for movieId, rating in overrides.items():
+                new_users.append(userId)
+                new_items.append(movieId)
+                new_ratings.append(rating)
+                new_rows.append(self._overlay_rows[(userId, movieId)])
+        new_users = np.asarray(new_users, dtype=users.dtype)
+        new_items = np.asarray(new_items, dtype=items.dtype)
+        new_ratings = np.asarray(new_ratings, dtype=ratings.dtype)
+        # drop base rows overridden by the overlay, then append the overlay
+        pair_base = pd.MultiIndex.from_arrays([users, items])
+        pair_new = pd.MultiIndex.from_arrays([new_users, new_items])
+        keep = ~pair_base.isin(pair_new)
+        return (np.concatenate([users[keep], new_users]),
+                np.concatenate([items[keep], new_items]),
+                np.concatenate([ratings[keep], new_ratings]),
+                np.concatenate([rows[keep], new_rows]))
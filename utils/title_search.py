@@ -0,0 +1,109 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from logging_custom.logger import Logger
+
+YEAR_PATTERN = re.compile(r"\((\d{4})\)\s*$")
+
+def normalize_title(title: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    title = unicodedata.normalize('NFKD', str(title))
+    title = "".join(ch for ch in title if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", title).split())
+
+def trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def query_trigrams(text: str) -> set:
+    # no padding: the query may match anywhere inside a word
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TitleSearchIndex:
+    """
+    Trigram inverted index over movie titles.
+    Postings are stored CSR-style (trigram -> sorted movie rows), a query gathers the
+    postings of its trigrams and scores movies by overlap with np.bincount, exact substring
+    matches rank first. Optional year range and genre filters are applied as masks.
+    """
+    def __init__(self, movies_df: pd.DataFrame):
+        self.logger = Logger("TitleSearchIndex").get_logger()
+        self.movie_ids = movies_df['movieId'].to_numpy(dtype=np.int64)
+        titles = movies_df['title'].fillna('').astype(str).tolist()
+        years = [YEAR_PATTERN.search(title) for title in titles]
+        self.years = np.array([int(year.group(1)) if year else 0 for year in years], dtype=np.int16)
+        self.normalized = [normalize_title(YEAR_PATTERN.sub('', title)) for title in titles]
+        # genre bitmask per movie
+        genre_lists = movies_df['genres'].fillna('').astype(str).str.split('|').tolist()
+        self.genres = sorted({genre for genres in genre_lists for genre in genres if genre})
+        genre_bits = {genre: np.uint64(1) << np.uint64(i) for i, genre in enumerate(self.genres)}
+        self.genre_masks = np.array([np.bitwise_or.reduce([genre_bits[g] for g in genres if g] or [np.uint64(0)])
+                                     for genres in genre_lists], dtype=np.uint64)
+        # postings
+        vocabulary = {}
+        codes, rows = [], []
+        self.title_trigram_counts = np.zeros(len(titles), dtype=np.int32)
+        for row, title in enumerate(self.normalized):
+            grams = trigrams(title) if title else set()
+            self.title_trigram_counts[row] = len(grams)
+            for gram in grams:
+                codes.append(vocabulary.setdefault(gram, len(vocabulary)))
+                rows.append(row)
+        codes = np.asarray(codes, dtype=np.int32)
+        rows = np.asarray(rows, dtype=np.int32)
+        order = np.argsort(codes, kind='stable')
+        self.vocabulary = vocabulary
+        self.posting_rows = rows[order]
+        self.posting_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(vocabulary)), out=self.posting_offsets[1:])
+        self.logger.info(f"Title search index built. Titles: {len(titles)}, trigrams: {len(vocabulary)}, postings: {len(rows)}")
+
+    def _filter_mask(self, min_year=None, max_year=None, genres=None):
+        mask = np.ones(len(self.movie_ids), dtype=bool)
+        if min_year is not None:
+            mask &= self.years >= min_year
+        if max_year is not None:
+            mask &= self.years <= max_year
+        if genres:
+            wanted = np.uint64(0)
+            for genre in genres:
+                if genre in self.genres:
+                    wanted |= np.uint64(1) << np.uint64(self.genres.index(genre))
+            mask &= (self.genre_masks & wanted) == wanted
+        return mask
+
+    def search(self, query: str, k: int = 20, min_year=None, max_year=None, genres=None) -> np.ndarray:
+        """Return up to k movieIds ranked by title similarity to the query."""
+        query = normalize_title(query)
+        if not query:
+            return np.empty(0, dtype=np.int64)
+        if len(query) >= 3:
+            grams = query_trigrams(query)
+            codes = [self.vocabulary[gram] for gram in grams if gram in self.vocabulary]
+        else:
+            # short queries match word prefixes
+            grams = {f" {query}"}
+            codes = [code for gram, code in self.vocabulary.items() if gram.startswith(f" {query}")]
+        if not codes:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate([self.posting_rows[self.posting_offsets[c]:self.posting_offsets[c + 1]] for c in codes])
+        hits = np.bincount(rows, minlength=len(self.movie_ids))
+        candidates = np.flatnonzero(hits)
+        if min_year is not None or max_year is not None or genres:
+            candidates = candidates[self._filter_mask(min_year, max_year, genres)[candidates]]
+        if not len(candidates):
+            return np.empty(0, dtype=np.int64)
+        n_query = len(grams)
+        matched = np.minimum(hits[candidates], n_query)
+        # fraction of query trigrams found, plus a small dice-style term favouring shorter titles
+        scores = matched / n_query + 0.1 * matched / self.title_trigram_counts[candidates]
+        # exact substring matches always rank above partial matches
+        full = candidates[matched == n_query]
+        if len(full):
+            exact = np.fromiter((query in self.normalized[row] for row in full), dtype=bool, count=len(full))
+            scores[np.isin(candidates, full[exact])] += 1.0
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return self.movie_ids[candidates[top]]
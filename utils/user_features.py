@@ -0,0 +1,98 @@
+import os
+import zoneinfo
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from logging_custom.logger import Logger
+
+def _local_timezone():
+    """
+    The zone datetime.fromtimestamp() converts to, with its DST rules. pandas needs it by
+    name: TZ, else the zone /etc/localtime links to; a fixed offset if neither is known.
+    """
+    names = [os.getenv('TZ', '').lstrip(':')]
+    if os.path.islink("/etc/localtime"):
+        names.append(os.path.realpath("/etc/localtime").partition("zoneinfo/")[2])
+    for name in names:
+        if name:
+            try:
+                return zoneinfo.ZoneInfo(name)
+            except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+                pass
+    Logger("UserFeatureStore").get_logger().warning("Local time zone not found, hours use the current UTC offset")
+    return datetime.now().astimezone().tzinfo
+
+LOCAL_TIMEZONE = _local_timezone()
+
+def timestamp_hours(timestamps) -> np.ndarray:
+    """Local hour of day for unix timestamps, vectorised, with the UTC offset in effect at each timestamp."""
+    local = pd.to_datetime(np.asarray(timestamps, dtype=np.int64), unit='s', utc=True).tz_convert(LOCAL_TIMEZONE)
+    return local.hour.to_numpy(dtype=np.int64)
+
+class UserFeatureStore:
+    """
+    Running per-user sums behind the users table (rating sum, hour sum and number of ratings).
+    Averages are derived from the sums, so new ratings are folded in without regrouping the
+    whole ratings table.
+    """
+    def __init__(self, user_ids, rating_sum, hour_sum, counts):
+        self.logger = Logger("UserFeatureStore").get_logger()
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.rating_sum = np.asarray(rating_sum, dtype=np.float64)
+        self.hour_sum = np.asarray(hour_sum, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @staticmethod
+    def _aggregate(ratings_df):
+        user_ids, inverse = np.unique(ratings_df['userId'].values, return_inverse=True)
+        rating_sum = np.bincount(inverse, weights=ratings_df['rating'].values.astype(np.float64), minlength=len(user_ids))
+        hour_sum = np.bincount(inverse, weights=timestamp_hours(ratings_df['timestamp'].values), minlength=len(user_ids))
+        counts = np.bincount(inverse, minlength=len(user_ids))
+        return user_ids, rating_sum, hour_sum, counts
+
+    @classmethod
+    def from_ratings(cls, ratings_df: pd.DataFrame):
+        return cls(*cls._aggregate(ratings_df))
+
+    @classmethod
+    def load(cls, file_path: str):
+        data = np.load(file_path)
+        return cls(data['user_ids'], data['rating_sum'], data['hour_sum'], data['counts'])
+
+    def save(self, file_path: str):
+        tmp_path = file_path + ".tmp.npz"
+        np.savez(tmp_path, user_ids=self.user_ids, rating_sum=self.rating_sum, hour_sum=self.hour_sum, counts=self.counts)
+        os.replace(tmp_path, file_path)
+        self.logger.info(f"User feature store saved to {file_path}")
+
+    def _add(self, ratings_df, sign):
+        if ratings_df is None or ratings_df.empty:
+            return
+        user_ids, rating_sum, hour_sum, counts = self._aggregate(ratings_df)
+        # make room for users not seen before
+        new_users = np.setdiff1d(user_ids, self.user_ids, assume_unique=True)
+        if len(new_users):
+            insert_at = np.searchsorted(self.user_ids, new_users)
+            self.user_ids = np.insert(self.user_ids, insert_at, new_users)
+            self.rating_sum = np.insert(self.rating_sum, insert_at, 0)
+            self.hour_sum = np.insert(self.hour_sum, insert_at, 0)
+            self.counts = np.insert(self.counts, insert_at, 0)
+        rows = np.searchsorted(self.user_ids, user_ids)
+        self.rating_sum[rows] += sign * rating_sum
+        self.hour_sum[rows] += sign * hour_sum
+        self.counts[rows] += sign * counts
+
+    def update(self, new_ratings_df: pd.DataFrame, replaced_df: pd.DataFrame = None):
+        """Fold in new ratings; replaced_df holds the previous values of ratings that were overwritten."""
+        self._add(replaced_df, -1)
+        self._add(new_ratings_df, 1)
+        self.logger.info(f"User features updated with {len(new_ratings_df)} ratings. Users: {len(self.user_ids)}")
+
+    def to_frame(self) -> pd.DataFrame:
+        rated = self.counts > 0
+        counts = self.counts[rated]
+        return pd.DataFrame({
+            'userId': self.user_ids[rated],
+            'avg_rating': self.rating_sum[rated] / counts,
+            'avg_hour': self.hour_sum[rated] / counts,
+        })
@@ -1,57 +1,75 @@
 import os
 from dotenv import load_dotenv
-from datetime import datetime
 from logging_custom.logger import Logger
 import pandas as pd
-import streamlit as st
 import numpy as np
 from dataframe_manager.manage_dataframe import DataFrameManager
+from utils.user_features import UserFeatureStore
+from utils.data_registry import get_data_registry
 
 load_dotenv()
 
 USERS_DATA = os.getenv("USERS_DATA")
+USERS_FEATURES = os.getenv("USERS_FEATURES") or os.path.join(os.path.dirname(USERS_DATA or ""), "users_features.npz")
 
 class UserHelper:
     def __init__(self):
         self.logger = Logger("UserHelper").get_logger()
         self.users_df = self.load_users_data_cached(USERS_DATA)
-        # Set columns and index once after loading
-        self.users_df.columns = ['userId', 'avg_rating', 'avg_hour']
-        self.users_df.set_index('userId', inplace=True)
+        self._build_vectors()
         self.logger.info(f"User dataframe loaded from {USERS_DATA}")
 
     @staticmethod
-    @st.cache_data
     def load_users_data_cached(file_path):
+        # shared, read-only copy for the whole process
+        return get_data_registry().get(f"users:{file_path}", lambda: UserHelper.load_users_data(file_path))
+
+    @staticmethod
+    def load_users_data(file_path):
         if file_path and os.path.exists(file_path):
-            return DataFrameManager(file_path).load_dataframe()
+            users_df = DataFrameManager(file_path).load_dataframe()
+            # Set columns and index once after loading
+            users_df.columns = ['userId', 'avg_rating', 'avg_hour']
+            return users_df.set_index('userId').sort_index()
         else:
             raise FileNotFoundError(f"Users data path {file_path} does not exist.")
     
+    def _build_vectors(self):
+        # dense feature rows addressed by the position of the user in the sorted id array
+        self.user_ids = self.users_df.index.values
+        self.user_vectors = self.users_df[['avg_rating', 'avg_hour']].to_numpy(dtype=np.float64)
+
     def get_user_vector(self, userId):
         self.logger.info(f"Generating user genre preference vector for userId {userId}.")
-        if userId not in self.users_df.index:
+        row = np.searchsorted(self.user_ids, userId)
+        if row >= len(self.user_ids) or self.user_ids[row] != userId:
             self.logger.error(f"User ID {userId} not found in users data.")
             raise ValueError(f"User ID {userId} not found in users data.")
-        user_vector = np.array(self.users_df.loc[userId]).reshape(1, -1)
+        user_vector = self.user_vectors[row].reshape(1, -1)
         return user_vector
     
-    def update_user_data_from_ratings(self, ratings_df):
-        self.logger.info(f"Updating users data from ratings data")
-        ratings_df['hour'] = ratings_df['timestamp'].apply(lambda x: datetime.fromtimestamp(x).hour)
-        # users data
-        users_df_new = ratings_df.groupby('userId').agg(
-            avg_rating=('rating', 'mean'),
-            avg_hour=('hour', 'mean')
-        ).reset_index()
-
-        if len(users_df_new) > len(self.users_df):
-            users_df_new.to_csv(USERS_DATA, index=False)
-            self.users_df = users_df_new.set_index('userId')
-            self.logger.info(f"Users data updated and saved to {USERS_DATA}")
-            return True
+    def update_user_data_from_ratings(self, new_ratings_df, replaced_df=None, ratings_df=None):
+        """
+        Fold new ratings into the user feature store and rewrite the users table from it.
+        replaced_df holds previous values of overwritten ratings. ratings_df (the full table,
+        already containing the new ratings) is only used to build the store the first time.
+        """
+        self.logger.info(f"Updating users data from {len(new_ratings_df)} new ratings")
+        if os.path.exists(USERS_FEATURES):
+            feature_store = UserFeatureStore.load(USERS_FEATURES)
+            feature_store.update(new_ratings_df, replaced_df)
+        elif ratings_df is not None:
+            self.logger.info(f"No user feature store at {USERS_FEATURES}. Building it from the full ratings data.")
+            feature_store = UserFeatureStore.from_ratings(ratings_df)
         else:
-            self.logger.info(f"Users data length mismatch. Previous users data len: {len(self.users_df)}, New Users data len: {len(users_df_new)}")
-            raise ValueError(f"Users data length mismatch. Previous users data len: {len(self.users_df)}, New Users data len: {len(users_df_new)}")
-
+            self.logger.error(f"User feature store {USERS_FEATURES} not found and no ratings data to build it from.")
+            raise ValueError(f"User feature store {USERS_FEATURES} not found and no ratings data to build it from.")
+        feature_store.save(USERS_FEATURES)
 
+        users_df_new = feature_store.to_frame()
+        DataFrameManager(USERS_DATA).save_dataframe(users_df_new, USERS_DATA)
+        self.users_df = users_df_new.set_index('userId').sort_index()
+        self._build_vectors()
+        get_data_registry().swap(f"users:{USERS_DATA}", self.users_df)
+        self.logger.info(f"Users data updated and saved to {USERS_DATA}. Users: {len(self.users_df)}")
+        return True